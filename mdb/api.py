@@ -0,0 +1,265 @@
+"""
+Read-only JSON API over hosts, interfaces, addresses and domains.
+
+Every list is ordered by id and paged with a cursor: a page ends with
+the cursor of the next page, which returns the objects after the last
+one on this page. Unlike offsets, cursors stay correct while objects are
+added and removed between requests. Related objects are prefetched, so
+every page costs the same number of queries regardless of its size.
+
+Only logged in users and the addresses in MDB_API_CLIENTS get through.
+
+Parameters:
+  limit      objects per page, at most MAX_LIMIT
+  cursor     the cursor of a previous page
+  fields     comma separated fields to include
+  host_type, domain, subnet
+             only objects of hosts of this type, in this domain or in
+             this subnet (name or network address)
+"""
+
+from django.conf import settings
+from django.db.models import Q
+from django.http import HttpResponse
+
+from mdb.models import *
+
+from functools import wraps
+import json
+import urllib
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+class ApiError(Exception):
+	pass
+
+def format_datetime(value):
+	if value is None:
+		return None
+	return value.isoformat()
+
+def interface_ip6addresses(interface):
+	return [a.full_address() for a in interface.ip6address_set.all()]
+
+def interface_ip4address(interface):
+	if interface.ip4address is None:
+		return None
+	return interface.ip4address.address
+
+def serialize(fields, obj, names = None):
+	""" The dict of the (name, function of obj) pairs in fields, or only
+	of the named ones, so fields left out are never computed. """
+	return dict([(name, value(obj)) for name, value in fields \
+		if names is None or name in names])
+
+INTERFACE_FIELDS = (
+	("id", lambda i: i.id),
+	("host", lambda i: i.host_id),
+	("name", lambda i: i.name),
+	("macaddr", lambda i: i.macaddr),
+	("dhcp_client", lambda i: i.dhcp_client),
+	("pxe_filename", lambda i: i.pxe_filename),
+	("ip4address", interface_ip4address),
+	("ip6addresses", interface_ip6addresses),
+	("domain", lambda i: i.domain.domain_name),
+	("created_date", lambda i: format_datetime(i.created_date)),
+)
+
+def serialize_interface(interface, names = None):
+	return serialize(INTERFACE_FIELDS, interface, names)
+
+HOST_FIELDS = (
+	("id", lambda h: h.id),
+	("hostname", lambda h: h.hostname),
+	("host_type", lambda h: h.host_type.host_type),
+	("operating_system", lambda h: unicode(h.operating_system)),
+	("location", lambda h: h.location),
+	("brand", lambda h: h.brand),
+	("model", lambda h: h.model),
+	("owner", lambda h: h.owner),
+	("serial_number", lambda h: h.serial_number),
+	("description", lambda h: h.description),
+	("virtual", lambda h: h.virtual),
+	("created_date", lambda h: format_datetime(h.created_date)),
+	("interfaces", lambda h: [serialize_interface(i) for i in h.interface_set.all()]),
+)
+
+def serialize_host(host, names = None):
+	return serialize(HOST_FIELDS, host, names)
+
+def address_interface(address):
+	# interface_set holds at most one interface, it is unique
+	interfaces = list(address.interface_set.all())
+	return interfaces and interfaces[0] or None
+
+IP4ADDRESS_FIELDS = (
+	("id", lambda a: a.id),
+	("address", lambda a: a.address),
+	("subnet", lambda a: a.subnet.name),
+	("last_contact", lambda a: format_datetime(a.last_contact)),
+	("ping_avg_rtt", lambda a: a.ping_avg_rtt),
+	("interface", lambda a: address_interface(a) and address_interface(a).id),
+	("hostname", lambda a: address_interface(a) and address_interface(a).host.hostname),
+)
+
+def serialize_ip4address(address, names = None):
+	return serialize(IP4ADDRESS_FIELDS, address, names)
+
+IP6ADDRESS_FIELDS = (
+	("id", lambda a: a.id),
+	("address", lambda a: a.full_address()),
+	("subnet", lambda a: a.subnet.name),
+	("interface", lambda a: a.interface_id),
+	("hostname", lambda a: a.interface.host.hostname),
+)
+
+def serialize_ip6address(address, names = None):
+	return serialize(IP6ADDRESS_FIELDS, address, names)
+
+DOMAIN_FIELDS = (
+	("id", lambda d: d.id),
+	("domain_name", lambda d: d.domain_name),
+	("domain_soa", lambda d: d.domain_soa),
+	("domain_admin", lambda d: d.domain_admin),
+	("domain_ipaddr", lambda d: d.domain_ipaddr),
+	("domain_serial", lambda d: d.domain_serial),
+	("domain_ttl", lambda d: d.domain_ttl),
+	("nameservers", lambda d: [n.hostname for n in d.domain_nameservers.all()]),
+	("mailexchanges", lambda d: [{"priority": m.priority, "hostname": m.hostname} \
+		for m in d.domain_mailexchanges.all()]),
+	("created_date", lambda d: format_datetime(d.created_date)),
+)
+
+def serialize_domain(domain, names = None):
+	return serialize(DOMAIN_FIELDS, domain, names)
+
+def subnet_filter(prefix, value):
+	return Q(**{prefix + "name": value}) | Q(**{prefix + "network": value})
+
+class Resource(object):
+	""" A list of objects served by the API. fields are the (name,
+	function) pairs serialize builds the objects from. filters maps the
+	host_type, domain and subnet parameters to a function returning a Q
+	object. """
+
+	def __init__(self, queryset, serialize, fields, filters):
+		self.queryset = queryset
+		self.serialize = serialize
+		self.fields = [name for name, value in fields]
+		self.filters = filters
+
+RESOURCES = {
+	"hosts": Resource(lambda: Host.objects \
+			.select_related("host_type", "operating_system__architecture") \
+			.prefetch_related("interface_set__ip4address", \
+				"interface_set__domain", "interface_set__ip6address_set__subnet"), \
+		serialize_host, HOST_FIELDS, {
+			"host_type": lambda v: Q(host_type__host_type = v),
+			"domain": lambda v: Q(interface__domain__domain_name = v),
+			"subnet": lambda v: subnet_filter("interface__ip4address__subnet__", v),
+		}),
+	"interfaces": Resource(lambda: Interface.objects \
+			.select_related("ip4address", "domain") \
+			.prefetch_related("ip6address_set__subnet"), \
+		serialize_interface, INTERFACE_FIELDS, {
+			"host_type": lambda v: Q(host__host_type__host_type = v),
+			"domain": lambda v: Q(domain__domain_name = v),
+			"subnet": lambda v: subnet_filter("ip4address__subnet__", v),
+		}),
+	"ip4addresses": Resource(lambda: Ip4Address.objects \
+			.select_related("subnet", "reachability") \
+			.prefetch_related("interface_set__host"), \
+		serialize_ip4address, IP4ADDRESS_FIELDS, {
+			"host_type": lambda v: Q(interface__host__host_type__host_type = v),
+			"domain": lambda v: Q(interface__domain__domain_name = v),
+			"subnet": lambda v: subnet_filter("subnet__", v),
+		}),
+	"ip6addresses": Resource(lambda: Ip6Address.objects \
+			.select_related("subnet", "interface__host"), \
+		serialize_ip6address, IP6ADDRESS_FIELDS, {
+			"host_type": lambda v: Q(interface__host__host_type__host_type = v),
+			"domain": lambda v: Q(interface__domain__domain_name = v),
+			"subnet": lambda v: subnet_filter("subnet__", v),
+		}),
+	"domains": Resource(lambda: Domain.objects \
+			.prefetch_related("domain_nameservers", "domain_mailexchanges"), \
+		serialize_domain, DOMAIN_FIELDS, {
+			"domain": lambda v: Q(domain_name = v),
+		}),
+}
+
+def int_parameter(params, name, default):
+	value = params.get(name)
+	if value is None or value == "":
+		return default
+	try:
+		value = int(value)
+	except ValueError:
+		raise ApiError("%s must be an integer" % name)
+	if value < 0:
+		raise ApiError("%s must not be negative" % name)
+	return value
+
+def page(resource, params):
+	""" Returns the page of resource selected by the request parameters
+	params, as a dict with the objects in "results" and the cursor of the
+	next page in "cursor", or None on the last page. """
+	limit = int_parameter(params, "limit", DEFAULT_LIMIT)
+	fields = params.get("fields")
+	if fields:
+		fields = fields.split(",")
+		unknown = set(fields) - set(resource.fields)
+		if unknown:
+			raise ApiError("unknown fields %s" % ",".join(sorted(unknown)))
+	if not 1 <= limit <= MAX_LIMIT:
+		raise ApiError("limit must be between 1 and %d" % MAX_LIMIT)
+	cursor = int_parameter(params, "cursor", 0)
+
+	queryset = resource.queryset().filter(id__gt = cursor)
+	for name, value in params.items():
+		if name in ("limit", "cursor", "fields"):
+			continue
+		if name not in resource.filters:
+			raise ApiError("unknown parameter %s" % name)
+		queryset = queryset.filter(resource.filters[name](value))
+	# filters across multi-valued relations can match an object twice
+	objects = list(queryset.distinct().order_by("id")[:limit + 1])
+
+	next_cursor = None
+	if len(objects) > limit:
+		objects = objects[:limit]
+		next_cursor = objects[-1].id
+	results = [resource.serialize(o, fields or None) for o in objects]
+	return {"results": results, "cursor": next_cursor}
+
+def json_response(data, status = 200):
+	return HttpResponse(json.dumps(data, sort_keys = True, indent = 1), \
+		content_type = "application/json", status = status)
+
+def api_allowed(view):
+	""" Lets logged in users and the addresses in MDB_API_CLIENTS
+	through. """
+	@wraps(view)
+	def wrapper(request, *args, **kwargs):
+		clients = getattr(settings, "MDB_API_CLIENTS", ())
+		if not request.user.is_authenticated() and \
+				request.META.get("REMOTE_ADDR") not in clients:
+			return json_response({"error": "not allowed"}, 403)
+		return view(request, *args, **kwargs)
+	return wrapper
+
+@api_allowed
+def resource_list(request, resource):
+	params = dict(request.GET.items())
+	try:
+		data = page(RESOURCES[resource], params)
+	except ApiError, e:
+		return json_response({"error": str(e)}, 400)
+	data["next"] = None
+	if data["cursor"] is not None:
+		params["cursor"] = data["cursor"]
+		# urlencode takes only byte strings
+		data["next"] = "%s?%s" % (request.path, urllib.urlencode(sorted( \
+			[(name, unicode(value).encode("utf-8")) for name, value in params.items()])))
+	return json_response(data)
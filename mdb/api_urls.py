@@ -0,0 +1,5 @@
+from django.conf.urls.defaults import *
+
+urlpatterns = patterns('mdb.api',
+	url(r'^(?P<resource>hosts|interfaces|ip4addresses|ip6addresses|domains)/$', 'resource_list'),
+)
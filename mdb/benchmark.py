@@ -0,0 +1,239 @@
+"""
+Synthetic inventories and timings of the expensive operations of mdb:
+rendering zone files and the dhcpd configuration, creating and deleting
+subnets, saving hosts and the admin changelists.
+
+	inventory = build_inventory(hosts = 10000, ip4_subnets = 4)
+	results = run_benchmarks(inventory, repeat = 3)
+
+The inventory is inserted in bulk without the signals, only the
+benchmarks go through save() and delete(). Every benchmark is run
+repeat times and reports the seconds of each run and the number of
+queries, see mdb.metrics. scripts/benchmark.py builds the inventory in
+a test database of its own and prints the results as JSON, so they can
+be compared across commits.
+"""
+
+from django.contrib.auth.models import User
+from django.core.signals import request_started
+from django.db import reset_queries, transaction
+from django.test.client import Client
+
+from mdb.metrics import Metrics
+from mdb.models import *
+
+import ipaddr
+import time
+
+HOST_TYPES = ("server", "workstation", "printer", "switch")
+
+ADMIN_CHANGELISTS = ("host", "ip4subnet", "domain", "ip6address")
+
+ADMIN_USER = "benchmark"
+
+def bulk_insert(model, objects):
+	""" bulk_create in batches, SQLite allows at most 999 parameters
+	per query. """
+	batch = max(1, 900 // len(model._meta.fields))
+	for i in range(0, len(objects), batch):
+		model.objects.bulk_create(objects[i:i + batch])
+
+def reverse_ip4_domain(network):
+	# like set_domain_name_for_subnet
+	ipspl = network.split(".")
+	return "%s.%s.%s.in-addr.arpa" % (ipspl[2], ipspl[1], ipspl[0])
+
+def reverse_ip6_domain(network):
+	# like set_domain_name_for_ipv6_subnet
+	network = ipaddr.IPv6Address("%s::" % network)
+	return ".".join(network.exploded.replace(":","")[:16])[::-1] + ".ip6.arpa"
+
+class Inventory(object):
+	""" What build_inventory created, for the benchmarks. """
+
+	def __init__(self, scale, dhcp_config, seconds):
+		self.scale = scale
+		self.dhcp_config = dhcp_config
+		self.seconds = seconds
+
+@transaction.commit_on_success
+def build_inventory(hosts = 10000, ip4_subnets = 4, ip4_prefix = 16, \
+		ip6_subnets = 4, domains = 200):
+	""" Creates hosts with one interface each. The interfaces take
+	addresses from all Ip4Subnets in turn, get an address in one of the
+	Ip6Subnets and are spread over the domains. """
+	started = time.time()
+	scale = {"hosts": hosts, "ip4_subnets": ip4_subnets, \
+		"ip4_prefix": ip4_prefix, "ip6_subnets": ip6_subnets, \
+		"domains": domains}
+
+	config = DhcpConfig.objects.create(serial = 1, active_serial = 0, \
+		name = "default", authoritative = True, \
+		ddns_update_style = "none", log_facility = "local7")
+	nameservers = [Nameserver.objects.create(hostname = "ns%d.example.com" % i) \
+		for i in (1, 2)]
+	arch = OsArchitecture.objects.create(architecture = "amd64")
+	operating_system = OperatingSystem.objects.create(name = "Debian", \
+		version = "6.0", architecture = arch)
+	host_types = [HostType.objects.create(host_type = name, description = name) \
+		for name in HOST_TYPES]
+
+	bulk_insert(Domain, [Domain(domain_name = "d%d.example.com" % i, \
+		domain_soa = "ns1.example.com", domain_admin = "admin@example.com", \
+		domain_ipaddr = "192.0.2.1", domain_filename = "d%d.example.com" % i) \
+		for i in range(domains)])
+	domain_ids = list(Domain.objects.order_by("id").values_list("id", flat = True))
+	Through = Domain.domain_nameservers.through
+	bulk_insert(Through, [Through(domain_id = domain_id, nameserver = n) \
+		for domain_id in domain_ids for n in nameservers])
+
+	networks = ipaddr.IPv4Network("10.0.0.0/8").iter_subnets(new_prefix = ip4_prefix)
+	networks = [networks.next() for i in range(ip4_subnets)]
+	bulk_insert(Ip4Subnet, [Ip4Subnet(name = "net%d" % i, \
+		network = str(n.network), netmask = str(n.netmask), \
+		domain_name = reverse_ip4_domain(str(n.network)), \
+		domain_soa = "ns1.example.com", domain_admin = "admin@example.com", \
+		domain_filename = "net%d" % i, dhcp_config = config) \
+		for i, n in enumerate(networks)])
+	subnets = list(Ip4Subnet.objects.order_by("id"))
+	bulk_insert(DhcpOption, [DhcpOption(key = "routers", \
+		value = str(n.network + 1), ip4subnet = s) \
+		for s, n in zip(subnets, networks)])
+	bulk_insert(Ip4Address, [Ip4Address(subnet = s, address = str(a)) \
+		for s, n in zip(subnets, networks) for a in n.iterhosts()])
+
+	bulk_insert(Ip6Subnet, [Ip6Subnet(name = "v6net%d" % i, \
+		network = "2001:db8:%x:0" % i, \
+		domain_name = reverse_ip6_domain("2001:db8:%x:0" % i), \
+		domain_soa = "ns1.example.com", domain_admin = "admin@example.com", \
+		domain_filename = "v6net%d" % i) for i in range(ip6_subnets)])
+	ip6_subnets = list(Ip6Subnet.objects.order_by("id"))
+
+	bulk_insert(Host, [Host(hostname = "host%05d" % i, \
+		host_type = host_types[i % len(host_types)], \
+		operating_system = operating_system, owner = "benchmark") \
+		for i in range(hosts)])
+	host_ids = list(Host.objects.order_by("hostname").values_list("id", flat = True))
+
+	# the first addresses of every subnet, taken in turn
+	per_subnet = [list(s.ip4address_set.order_by("id") \
+		.values_list("id", flat = True)[:hosts // len(subnets) + 1]) \
+		for s in subnets]
+	address_ids = []
+	for i in range(max([0] + [len(a) for a in per_subnet])):
+		address_ids += [a[i] for a in per_subnet if i < len(a)]
+	interfaces = []
+	for i, host_id in enumerate(host_ids):
+		interfaces.append(Interface(name = "eth0", \
+			macaddr = "02:00:" + ":".join(["%02x" % ((i >> shift) & 0xff) \
+				for shift in (24, 16, 8, 0)]), \
+			dhcp_client = True, host_id = host_id, \
+			ip4address_id = i < len(address_ids) and address_ids[i] or None, \
+			domain_id = domain_ids[i % len(domain_ids)]))
+	bulk_insert(Interface, interfaces)
+
+	if ip6_subnets:
+		bulk_insert(Ip6Address, [Ip6Address(subnet = ip6_subnets[i % len(ip6_subnets)], \
+			address = "::%x" % (i + 1), interface_id = interface_id) \
+			for i, interface_id in enumerate(Interface.objects \
+				.order_by("id").values_list("id", flat = True))])
+
+	User.objects.create_superuser(ADMIN_USER, "benchmark@example.com", ADMIN_USER)
+	return Inventory(scale, DhcpConfig.objects.get(id = config.id), \
+		time.time() - started)
+
+def zone_files(model):
+	def benchmark(inventory, options):
+		for zone in model.objects.all():
+			zone.zone_file_contents()
+	return benchmark
+
+def dhcpd_configuration(inventory, options):
+	DhcpConfig.objects.get(id = inventory.dhcp_config.id).dhcpd_configuration()
+
+def ip4subnet(options):
+	# well outside the subnets of the inventory
+	return Ip4Subnet(name = "benchmark", network = "172.16.0.0", \
+		netmask = str(ipaddr.IPv4Network("172.16.0.0/%d" \
+			% options["create_prefix"]).netmask), \
+		domain_soa = "ns1.example.com", domain_admin = "admin@example.com", \
+		domain_filename = "benchmark", \
+		dhcp_config = DhcpConfig.objects.get(name = "default"))
+
+def ip4subnet_create(inventory, options):
+	ip4subnet(options).save()
+
+def ip4subnet_delete(inventory, options):
+	Ip4Subnet.objects.get(name = "benchmark").delete()
+
+def host_save(inventory, options):
+	for host in Host.objects.order_by("id")[:options["host_saves"]]:
+		host.save()
+
+def admin_changelist(model):
+	def benchmark(inventory, options):
+		response = options["client"].get("/admin/mdb/%s/" % model)
+		if response.status_code != 200:
+			raise Exception("/admin/mdb/%s/ returned %d" % \
+				(model, response.status_code))
+	return benchmark
+
+# (name, function), run in this order; ip4subnet_delete removes the
+# subnet ip4subnet_create made
+BENCHMARKS = [
+	("domain_zone_files", zone_files(Domain)),
+	("ip4subnet_zone_files", zone_files(Ip4Subnet)),
+	("ip6subnet_zone_files", zone_files(Ip6Subnet)),
+	("dhcpd_configuration", dhcpd_configuration),
+	("ip4subnet_create", ip4subnet_create),
+	("ip4subnet_delete", ip4subnet_delete),
+	("host_save", host_save),
+] + [("admin_%s_changelist" % model, admin_changelist(model)) \
+	for model in ADMIN_CHANGELISTS]
+
+def median(values):
+	values = sorted(values)
+	middle = len(values) // 2
+	if len(values) % 2:
+		return values[middle]
+	return (values[middle - 1] + values[middle]) / 2.0
+
+def run_benchmarks(inventory, repeat = 3, names = None, create_prefix = 22, \
+		host_saves = 100):
+	""" Runs the benchmarks named in names, all if None. Returns a list
+	of dicts with the name, the seconds of every run, their minimum and
+	median and the queries and query seconds of the fastest run. """
+	options = {"create_prefix": create_prefix, "host_saves": host_saves, \
+		"client": Client()}
+	options["client"].login(username = ADMIN_USER, password = ADMIN_USER)
+	metrics = Metrics("benchmark", track_queries = True)
+	runs = {}
+	# every request of the admin benchmarks would clear the query log
+	request_started.disconnect(reset_queries)
+	try:
+		for i in range(repeat):
+			metrics.start()
+			for name, function in BENCHMARKS:
+				if names is not None and name not in names:
+					continue
+				with metrics.stage(name):
+					function(inventory, options)
+				runs.setdefault(name, []).append(metrics.stages[-1])
+	finally:
+		request_started.connect(reset_queries)
+
+	results = []
+	for name, function in BENCHMARKS:
+		if name not in runs:
+			continue
+		fastest = min(runs[name], key = lambda run: run["seconds"])
+		seconds = [run["seconds"] for run in runs[name]]
+		results.append({
+			"name": name,
+			"runs": seconds,
+			"min": min(seconds),
+			"median": median(seconds),
+			"queries": fastest["queries"],
+			"query_seconds": fastest["query_seconds"],
+		})
+	return results
@@ -0,0 +1,73 @@
+"""
+Helpers for comparing rendered dhcpd configurations, used by the dhcp
+synchronizer to decide between doing nothing, pushing host changes
+through OMAPI and restarting dhcpd.
+"""
+
+import hashlib
+import re
+
+HEADER_PREFIX = "# Autogenerated configuration"
+
+host_re = re.compile(r"^\nhost (\S+) \{\n.*?^\}\n", re.MULTILINE | re.DOTALL)
+
+def strip_header(content):
+	""" Removes the timestamp line written by dhcpd_header. """
+	if content.startswith(HEADER_PREFIX):
+		return content.split("\n", 1)[-1]
+	return content
+
+def config_digest(content):
+	if isinstance(content, unicode):
+		content = content.encode("utf-8")
+	return hashlib.sha1(strip_header(content)).hexdigest()
+
+def split_configuration(content):
+	""" Splits a configuration into everything but the host
+	declarations, and a dict of host name -> host declaration.
+	The dict is None if a host name is declared more than once. """
+	content = strip_header(content)
+	hosts = {}
+	for match in host_re.finditer(content):
+		if match.group(1) in hosts:
+			return host_re.sub("", content), None
+		hosts[match.group(1)] = match.group(0)
+	return host_re.sub("", content), hosts
+
+def host_changes(old, new):
+	""" Compares two configurations. If they only differ in host
+	declarations, returns a (removed, added) tuple of host names,
+	where a changed host is in both. Returns None if anything else
+	changed, and the whole configuration has to be reloaded. """
+	old_base, old_hosts = split_configuration(old)
+	new_base, new_hosts = split_configuration(new)
+	if old_base != new_base or old_hosts is None or new_hosts is None:
+		return None
+
+	removed = [name for name, block in old_hosts.items() \
+		if new_hosts.get(name) != block]
+	added = [name for name, block in new_hosts.items() \
+		if old_hosts.get(name) != block]
+	return sorted(removed), sorted(added)
+
+def shard_contents(serial, body):
+	""" Prefixes a subnet include file with the serial of the subnet it
+	was generated from and the digest of the rest of the file. """
+	return "# serial:%s\n# digest:%s\n%s" % (serial, config_digest(body), body)
+
+def read_shard(filename):
+	""" Returns (serial, digest, body) for an include file written with
+	shard_contents, or None if there is no usable file. """
+	try:
+		f = open(filename)
+		try:
+			serial = f.readline()
+			digest = f.readline()
+			body = f.read()
+		finally:
+			f.close()
+	except IOError:
+		return None
+	if not serial.startswith("# serial:") or not digest.startswith("# digest:"):
+		return None
+	return serial[9:].strip(), digest[9:].strip(), body
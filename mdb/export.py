@@ -0,0 +1,90 @@
+"""
+Zone files and dhcp configurations over HTTP, for DNS and DHCP servers
+that poll mdb instead of having zone_synchronizer.py or
+dhcp_synchronizer.py write their files.
+
+The ETag of every file is its serial. A poll with a matching
+If-None-Match costs one primary key lookup of the serial and returns
+304 without rendering anything.
+"""
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.shortcuts import get_object_or_404
+from django.views.decorators.http import condition, require_GET
+
+from mdb.models import *
+
+from functools import wraps
+import json
+
+# type in the URL: (model, serial field)
+ZONES = {
+	"domain": (Domain, "domain_serial"),
+	"ip4subnet": (Ip4Subnet, "domain_serial"),
+	"ip6subnet": (Ip6Subnet, "domain_serial"),
+}
+
+def client_allowed(view):
+	""" Only lets the addresses in MDB_EXPORT_CLIENTS through, if it is
+	set. """
+	@wraps(view)
+	def wrapper(request, *args, **kwargs):
+		clients = getattr(settings, "MDB_EXPORT_CLIENTS", None)
+		if clients is not None and request.META.get("REMOTE_ADDR") not in clients:
+			return HttpResponseForbidden("Not allowed.", content_type="text/plain")
+		return view(request, *args, **kwargs)
+	return wrapper
+
+def serial_etag(model, field, kind, id):
+	serials = model.objects.filter(id = id).values_list(field, flat = True)
+	if not serials:
+		return None
+	return "%s-%s-%s" % (kind, id, serials[0])
+
+def zone_etag(request, kind, id):
+	model, field = ZONES[kind]
+	return serial_etag(model, field, kind, id)
+
+def dhcp_etag(request, format, id):
+	return serial_etag(DhcpConfig, "serial", format, id)
+
+def text_response(content, content_type = "text/plain; charset=utf-8"):
+	return HttpResponse(content, content_type = content_type)
+
+@client_allowed
+@require_GET
+@condition(etag_func = zone_etag)
+def zone(request, kind, id):
+	""" The zone file of a Domain, Ip4Subnet or Ip6Subnet. """
+	model, field = ZONES[kind]
+	return text_response(get_object_or_404(model, id = id).zone_file_contents())
+
+@client_allowed
+@require_GET
+@condition(etag_func = dhcp_etag)
+def dhcp(request, format, id):
+	""" The configuration of a DhcpConfig, for dhcpd or as Kea JSON. """
+	config = get_object_or_404(DhcpConfig, id = id)
+	if format == "kea":
+		return text_response(json.dumps(config.kea_configuration(), \
+			indent = 1, sort_keys = True), "application/json")
+	return text_response(config.dhcpd_configuration())
+
+@client_allowed
+@require_GET
+def index(request):
+	""" The files that can be fetched, with their serials, as JSON. """
+	files = []
+	for kind, (model, field) in sorted(ZONES.items()):
+		for id, name, serial in model.objects.order_by("id") \
+				.values_list("id", "domain_name", field):
+			files.append({"name": name, "serial": serial, \
+				"url": "/export/%s/%d.zone" % (kind, id)})
+	for id, name, serial in DhcpConfig.objects.order_by("id") \
+			.values_list("id", "name", "serial"):
+		for format, extension in (("dhcpd", "conf"), ("kea", "json")):
+			files.append({"name": name, "serial": serial, \
+				"url": "/export/%s/%d.%s" % (format, id, extension)})
+	return text_response(json.dumps(files, indent = 1, sort_keys = True), \
+		"application/json")
@@ -0,0 +1,8 @@
+from django.conf.urls.defaults import *
+
+urlpatterns = patterns('mdb.export',
+	url(r'^$', 'index'),
+	url(r'^(?P<kind>domain|ip4subnet|ip6subnet)/(?P<id>\d+)\.zone$', 'zone'),
+	url(r'^(?P<format>dhcpd)/(?P<id>\d+)\.conf$', 'dhcp'),
+	url(r'^(?P<format>kea)/(?P<id>\d+)\.json$', 'dhcp'),
+)
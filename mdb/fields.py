@@ -0,0 +1,34 @@
+from django.db import models
+from django.utils.importlib import import_module
+
+def binary(connection, value):
+	""" Wraps value for the database driver of connection, for raw
+	queries with blob parameters. """
+	backend = import_module(connection.settings_dict['ENGINE'] + '.base')
+	return backend.Database.Binary(value)
+
+class BlobField(models.Field):
+	""" Raw bytes, stored as bytea on PostgreSQL and as a blob elsewhere.
+	Values are str. """
+	description = "Binary data"
+
+	__metaclass__ = models.SubfieldBase
+
+	def db_type(self, connection):
+		engine = connection.settings_dict['ENGINE']
+		if 'postgresql' in engine:
+			return 'bytea'
+		if 'mysql' in engine:
+			return 'longblob'
+		return 'blob'
+
+	def to_python(self, value):
+		if value is None:
+			return None
+		# the database drivers return buffer objects
+		return str(value)
+
+	def get_db_prep_value(self, value, connection, prepared=False):
+		if value is None:
+			return None
+		return binary(connection, value)
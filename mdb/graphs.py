@@ -0,0 +1,80 @@
+"""
+Latency graphs rendered when someone asks for them, kept in a bounded
+cache directory.
+"""
+
+from mdb.rrd import rrd_filename, png_filename, graph_title, \
+	flush_rrds, graph_is_current, render_graph
+
+import os
+import time
+
+class GraphCache(object):
+	""" Renders the graph of a ProbeTarget from its RRD file into
+	cache_dir, unless the cached graph is newer than the RRD file. At
+	most max_files graphs are kept; the least recently served ones are
+	removed first. rrdcached is the address of the rrdcached the RRD
+	files are updated through, or None. """
+
+	def __init__(self, rrd_dir, cache_dir, max_files = 1000, rrdcached = None):
+		self.rrd_dir = rrd_dir
+		self.cache_dir = cache_dir
+		self.max_files = max_files
+		self.rrdcached = rrdcached
+
+	def source(self, target):
+		""" The RRD file the graph is rendered from. """
+		return rrd_filename(self.rrd_dir, target)
+
+	def source_stat(self, target):
+		""" os.stat of the RRD file, once rrdcached wrote its pending
+		updates. Raises OSError if there is no RRD file. """
+		rrd = self.source(target)
+		if self.rrdcached is not None:
+			flush_rrds(self.rrdcached, [rrd])
+		return os.stat(rrd)
+
+	def get(self, target):
+		""" Returns the filename of an up to date graph, or None if
+		there is no RRD file or rendering failed. """
+		rrd = self.source(target)
+		if not os.path.isfile(rrd):
+			return None
+		if not os.path.isdir(self.cache_dir):
+			os.makedirs(self.cache_dir)
+		png = png_filename(self.cache_dir, target)
+		if graph_is_current(rrd, png, self.rrdcached):
+			# the access time marks how recently a graph was used,
+			# the modification time when it was rendered
+			now = time.time()
+			try:
+				os.utime(png, (now, os.stat(png).st_mtime))
+				return png
+			except OSError:
+				# removed by another process in the meantime
+				pass
+		png, success = render_graph((rrd, png, graph_title(target), \
+			self.rrdcached))
+		if not success:
+			return None
+		self.evict()
+		return png
+
+	def evict(self):
+		graphs = []
+		for name in os.listdir(self.cache_dir):
+			if not name.endswith(".png"):
+				continue
+			filename = os.path.join(self.cache_dir, name)
+			try:
+				graphs.append((os.stat(filename).st_atime, filename))
+			except OSError:
+				pass
+		if len(graphs) <= self.max_files:
+			return
+		graphs.sort()
+		for atime, filename in graphs[:len(graphs) - self.max_files]:
+			try:
+				os.unlink(filename)
+			except OSError:
+				pass
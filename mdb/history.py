@@ -0,0 +1,193 @@
+"""
+Round trip time history in the database, as an alternative to RRD files.
+
+Every address has one LatencyHistory row whose data is a fixed size blob
+of ring buffers, one per tier. A tier keeps the average of each period
+of HISTORY_STEP * steps seconds for the last rows periods, the same
+layout as the RRAs of RRD_DEFINITION. The blob starts with the state of
+the period each tier is filling (period number as uint32, sum as float64,
+count as uint32), followed by the timestamps (uint32) and the averages
+(float32) of every tier. Everything is little endian.
+
+Writing only needs the standard library; the query functions return
+NumPy arrays.
+"""
+
+from django.db import connection, transaction
+
+from mdb.fields import binary
+from mdb.models import LatencyHistory
+from mdb.results import DatabaseWriter, insert_or_update
+
+import array
+import struct
+import sys
+import time
+
+HISTORY_STEP = 300
+
+HISTORY_TIERS = ((1, 576), (6, 336), (72, 124), (288, 365))
+
+STATE = struct.Struct("<IdI")
+
+UINT32 = "I"
+if array.array(UINT32).itemsize != 4:
+	UINT32 = "L"
+
+def tier_offsets():
+	""" (offset of the timestamps, offset of the values) of each tier. """
+	offsets = []
+	offset = STATE.size * len(HISTORY_TIERS)
+	for steps, rows in HISTORY_TIERS:
+		offsets.append((offset, offset + 4 * rows))
+		offset += 8 * rows
+	return offsets
+
+TIER_OFFSETS = tier_offsets()
+
+HISTORY_SIZE = TIER_OFFSETS[-1][1] + 4 * HISTORY_TIERS[-1][1]
+
+def unpack_array(typecode, data, offset, count):
+	a = array.array(typecode)
+	a.fromstring(data[offset:offset + 4 * count])
+	if sys.byteorder == "big":
+		a.byteswap()
+	return a
+
+def pack_array(a):
+	if sys.byteorder == "big":
+		a = array.array(a.typecode, a)
+		a.byteswap()
+	return a.tostring()
+
+class History(object):
+	""" The ring buffers of one address. """
+
+	def __init__(self, data = None):
+		if data is None:
+			self.state = [[0, 0.0, 0] for tier in HISTORY_TIERS]
+			self.timestamps = [array.array(UINT32, [0] * rows) \
+				for steps, rows in HISTORY_TIERS]
+			self.values = [array.array("f", [0.0] * rows) \
+				for steps, rows in HISTORY_TIERS]
+			return
+		if len(data) != HISTORY_SIZE:
+			raise ValueError("history is %d bytes, expected %d" % \
+				(len(data), HISTORY_SIZE))
+		self.state = [list(STATE.unpack_from(data, i * STATE.size)) \
+			for i in range(len(HISTORY_TIERS))]
+		self.timestamps = []
+		self.values = []
+		for (steps, rows), (timestamps, values) in \
+				zip(HISTORY_TIERS, TIER_OFFSETS):
+			self.timestamps.append(unpack_array(UINT32, data, timestamps, rows))
+			self.values.append(unpack_array("f", data, values, rows))
+
+	def dumps(self):
+		parts = [STATE.pack(*state) for state in self.state]
+		for timestamps, values in zip(self.timestamps, self.values):
+			parts.append(pack_array(timestamps))
+			parts.append(pack_array(values))
+		return "".join(parts)
+
+	def add(self, when, value):
+		""" Adds a round trip time measured at when (seconds since the
+		epoch). The slot of the current period always holds the average
+		so far. Values older than the current period are ignored. """
+		for i, (steps, rows) in enumerate(HISTORY_TIERS):
+			width = HISTORY_STEP * steps
+			period = int(when) // width
+			state = self.state[i]
+			if period < state[0]:
+				continue
+			if period > state[0]:
+				state[:] = [period, 0.0, 0]
+			state[1] += value
+			state[2] += 1
+			slot = period % rows
+			self.timestamps[i][slot] = period * width
+			self.values[i][slot] = state[1] / state[2]
+
+	def series(self, tier = 0):
+		""" (timestamp, average) pairs of a tier, oldest first. """
+		steps, rows = HISTORY_TIERS[tier]
+		first = (self.state[tier][0] - rows + 1) * HISTORY_STEP * steps
+		return sorted([(t, v) for t, v in \
+			zip(self.timestamps[tier], self.values[tier]) \
+			if t > 0 and t >= first])
+
+def history_arrays(data, tier = 0, start = None, end = None):
+	""" (timestamps, averages) of a tier of a history blob as NumPy
+	arrays, oldest first. start and end limit the period returned. """
+	import numpy
+
+	steps, rows = HISTORY_TIERS[tier]
+	period = STATE.unpack_from(data, tier * STATE.size)[0]
+	offset_timestamps, offset_values = TIER_OFFSETS[tier]
+	timestamps = numpy.frombuffer(data, "<u4", rows, offset_timestamps)
+	values = numpy.frombuffer(data, "<f4", rows, offset_values)
+
+	valid = (timestamps > 0) & \
+		(timestamps >= (period - rows + 1) * HISTORY_STEP * steps)
+	if start is not None:
+		valid &= timestamps >= start
+	if end is not None:
+		valid &= timestamps <= end
+	timestamps = timestamps[valid]
+	order = numpy.argsort(timestamps)
+	return timestamps[order], values[valid][order]
+
+def latency_history(ip4address_id, tier = 0, start = None, end = None):
+	""" The round trip time history of an address, see history_arrays.
+	Empty arrays if there is none. """
+	import numpy
+
+	data = LatencyHistory.objects.filter(ip4address = ip4address_id) \
+		.values_list("data", flat = True)
+	if not data:
+		return numpy.zeros(0, "<u4"), numpy.zeros(0, "<f4")
+	return history_arrays(str(data[0]), tier, start, end)
+
+class HistoryWriter(DatabaseWriter):
+	""" Adds probe results to the history of their address, batched
+	like DatabaseWriter. Each flush reads and writes the histories of
+	the addresses in the batch in one query each. """
+
+	def read(self, ids):
+		""" Address id -> history of the addresses that have one. The
+		rows stay locked until the transaction ends, so another writer
+		adds its samples after ours instead of overwriting them. """
+		return dict(LatencyHistory.objects.select_for_update() \
+			.filter(ip4address__in = ids).values_list("ip4address", "data"))
+
+	@transaction.commit_on_success
+	def write(self, rows):
+		samples = {}
+		for id, last_contact, rtt in rows:
+			samples.setdefault(id, []).append( \
+				(time.mktime(last_contact.timetuple()), rtt))
+
+		def dumps(id, data):
+			history = History(data is not None and str(data) or None)
+			for timestamp, rtt in samples[id]:
+				history.add(timestamp, rtt)
+			return binary(connection, history.dumps())
+
+		def inserted_meanwhile(row):
+			# add to the history another writer just inserted
+			id = row[0]
+			return dumps(id, self.read([id])[id]), id
+
+		existing = self.read(samples.keys())
+		table = connection.ops.quote_name(LatencyHistory._meta.db_table)
+		update = "UPDATE %s SET data = %%s WHERE ip4address_id = %%s" % table
+		insert = "INSERT INTO %s (ip4address_id, data) VALUES (%%s, %%s)" % table
+		cursor = connection.cursor()
+		updates = [(dumps(id, existing[id]), id) \
+			for id in samples if id in existing]
+		inserts = [(id, dumps(id, None)) for id in samples if id not in existing]
+		if updates:
+			cursor.executemany(update, updates)
+		if inserts:
+			insert_or_update(cursor, insert, inserts, update, inserted_meanwhile)
+		transaction.set_dirty()
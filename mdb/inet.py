@@ -0,0 +1,109 @@
+"""
+Containment and overlap queries on networks and addresses.
+
+	Ip4Subnet.objects.containing("10.0.1.7")
+	Ip4Subnet.objects.overlapping("10.0.0.0/16")
+	Ip4Address.objects.contained_by("10.0.1.0/28")
+
+On PostgreSQL IPAddressField columns are inet already. The subnets get
+an immutable function building their cidr from network and netmask,
+and GiST indexes over it and over the addresses (see the files in
+mdb/sql/, installed by syncdb), so these are index lookups with the
+>>=, <<= and && operators. On SQLite the same tests run in Python as
+SQL functions, and other databases filter in Python.
+"""
+
+from django.db import connection, models
+from django.db.backends.signals import connection_created
+
+import ipaddr
+
+def network(value):
+	try:
+		return ipaddr.IPNetwork(value)
+	except ValueError:
+		return None
+
+def contains(outer, inner):
+	""" Whether the network outer contains the network or address inner,
+	False if either is not valid or their versions differ. """
+	outer, inner = network(outer), network(inner)
+	if outer is None or inner is None or outer.version != inner.version:
+		return False
+	return inner in outer
+
+def overlaps(a, b):
+	a, b = network(a), network(b)
+	if a is None or b is None or a.version != b.version:
+		return False
+	return a.overlaps(b)
+
+def register_sqlite_functions(sender, connection, **kwargs):
+	if connection.vendor == "sqlite":
+		connection.connection.create_function("mdb_net_contains", 2, contains)
+		connection.connection.create_function("mdb_net_overlaps", 2, overlaps)
+
+connection_created.connect(register_sqlite_functions)
+
+# (PostgreSQL, SQLite) condition per lookup; %(network)s is the network
+# of the row, %%s the value looked up
+LOOKUPS = {
+	"containing": ("%(network)s >>= %%s::inet", "mdb_net_contains(%(network)s, %%s)"),
+	"contained_by": ("%(network)s <<= %%s::cidr", "mdb_net_contains(%%s, %(network)s)"),
+	"overlapping": ("%(network)s && %%s::cidr", "mdb_net_overlaps(%(network)s, %%s)"),
+}
+
+PYTHON_LOOKUPS = {
+	"containing": lambda row, value: contains(row, value),
+	"contained_by": lambda row, value: contains(value, row),
+	"overlapping": overlaps,
+}
+
+class NetworkManager(models.Manager):
+	""" The manager of a model whose rows are networks or addresses.
+	Subclasses set postgresql and sqlite to SQL expressions for the
+	network of a row, with its columns as %(column)s; the PostgreSQL one
+	must match the expression of the GiST index. python builds the same
+	network from the values of columns. """
+	columns = ()
+	postgresql = None
+	sqlite = None
+
+	def python(self, *values):
+		raise NotImplementedError
+
+	def lookup(self, name, value):
+		value = ipaddr.IPNetwork(str(value))
+		if name != "containing":
+			# a cidr must not have host bits set
+			value = value.masked()
+		value = str(value)
+		vendor = connection.vendor
+		if vendor not in ("postgresql", "sqlite"):
+			rows = self.get_query_set().values_list("id", *self.columns)
+			return self.get_query_set().filter(id__in = [row[0] for row in rows \
+				if PYTHON_LOOKUPS[name](self.python(*row[1:]), value)])
+
+		table = connection.ops.quote_name(self.model._meta.db_table)
+		columns = dict([(column, "%s.%s" % (table, connection.ops.quote_name( \
+			self.model._meta.get_field(column).column))) for column in self.columns])
+		if vendor == "postgresql":
+			expression, condition = self.postgresql, LOOKUPS[name][0]
+		else:
+			expression, condition = self.sqlite, LOOKUPS[name][1]
+		where = condition % {"network": expression % columns}
+		return self.get_query_set().extra(where = [where], params = [value])
+
+	def containing(self, address):
+		""" The rows whose network contains address, which may also be a
+		network. """
+		return self.lookup("containing", address)
+
+	def contained_by(self, network):
+		""" The rows whose network or address lies within network. """
+		return self.lookup("contained_by", network)
+
+	def overlapping(self, network):
+		""" The rows whose network shares at least one address with
+		network. """
+		return self.lookup("overlapping", network)
@@ -0,0 +1,87 @@
+"""
+Client for the control channel of the ISC Kea DHCPv4 server.
+
+Kea listens for JSON commands on a unix socket, configured with
+"control-socket" in the Dhcp4 section. Each connection carries a single
+command and its response.
+"""
+
+import json
+import re
+import socket
+
+class KeaError(Exception):
+	pass
+
+# strings are matched as well, so comment characters inside them are kept
+COMMENT = re.compile(r'"(?:[^"\\]|\\.)*"|//[^\n]*|#[^\n]*|/\*.*?\*/', re.DOTALL)
+
+def strip_comments(text):
+	""" Removes the //, # and /* */ comments Kea allows in its
+	configuration files. """
+	return COMMENT.sub(lambda m: m.group(0).startswith('"') and m.group(0) or "", \
+		text)
+
+def read_config(path):
+	""" Reads a Kea configuration file. Raises KeaError if it can not be
+	read or parsed. """
+	try:
+		return json.loads(strip_comments(open(path).read()))
+	except (IOError, ValueError), e:
+		raise KeaError("%s: %s" % (path, e))
+
+class KeaControl(object):
+	def __init__(self, socket_path, timeout = 10):
+		self.socket_path = socket_path
+		self.timeout = timeout
+
+	def command(self, command, arguments = None):
+		""" Sends a command and returns the arguments of the response. """
+		request = {"command": command}
+		if arguments is not None:
+			request["arguments"] = arguments
+
+		sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		sock.settimeout(self.timeout)
+		try:
+			sock.connect(self.socket_path)
+			sock.sendall(json.dumps(request))
+			# kea closes the connection after the response, but
+			# stop as soon as we have a complete document
+			data = ""
+			while True:
+				chunk = sock.recv(65536)
+				if not chunk:
+					break
+				data += chunk
+				try:
+					json.loads(data)
+					break
+				except ValueError:
+					continue
+		except socket.error, e:
+			raise KeaError("%s: %s" % (command, e))
+		finally:
+			sock.close()
+
+		try:
+			response = json.loads(data)
+		except ValueError:
+			raise KeaError("%s: malformed response" % command)
+		if isinstance(response, list):
+			response = response[0]
+		if response.get("result") != 0:
+			raise KeaError("%s: %s" % (command, response.get("text", "failed")))
+		return response.get("arguments")
+
+	def config_get(self):
+		""" Returns the running configuration. """
+		return self.command("config-get")
+
+	def config_set(self, config):
+		""" Replaces the running configuration without a restart. """
+		return self.command("config-set", config)
+
+	def config_reload(self):
+		""" Makes Kea re-read its configuration file. """
+		return self.command("config-reload")
@@ -0,0 +1,131 @@
+"""
+Incremental reader for the dhcpd.leases file.
+
+dhcpd only appends to the leases file, and now and then replaces it
+with a compacted copy. LeaseFile remembers the inode and byte offset it
+got to, so each run only reads what was appended since the last one.
+"""
+
+from django.db import connection, transaction
+
+from mdb.models import Ip4Address, Reachability, invalidate_host_details
+from mdb.results import insert_or_update
+
+import calendar
+import datetime
+import os
+import re
+
+lease_re = re.compile(r"^lease (\S+) \{(.*?)^\}\n", re.MULTILINE | re.DOTALL)
+time_re = re.compile(r"^\s*(?:cltt|starts) (?:\d (\d{4}/\d\d/\d\d \d\d:\d\d:\d\d)|epoch (\d+));", \
+	re.MULTILINE)
+
+def lease_time(block):
+	""" The newest of the starts and cltt times of a lease block, as a
+	naive local datetime. dhcpd writes these in UTC. """
+	newest = None
+	for utc, epoch in time_re.findall(block):
+		if utc:
+			epoch = calendar.timegm(datetime.datetime.strptime(utc, \
+				"%Y/%m/%d %H:%M:%S").timetuple())
+		timestamp = datetime.datetime.fromtimestamp(int(epoch))
+		if newest is None or timestamp > newest:
+			newest = timestamp
+	return newest
+
+def parse_leases(stream, chunk_size = 1 << 20):
+	""" Reads lease blocks from the stream, a chunk at a time. Yields
+	(address, timestamp, consumed) for each complete block, where
+	consumed is the number of bytes read up to the end of the block. """
+	buf = ""
+	consumed = 0
+	while True:
+		chunk = stream.read(chunk_size)
+		if not chunk:
+			return
+		buf += chunk
+		end = 0
+		for match in lease_re.finditer(buf):
+			end = match.end()
+			timestamp = lease_time(match.group(2))
+			if timestamp is not None:
+				yield match.group(1), timestamp, consumed + end
+		consumed += end
+		buf = buf[end:]
+
+class LeaseFile(object):
+	def __init__(self, filename, state_filename):
+		self.filename = filename
+		self.state_filename = state_filename
+		self.inode = None
+		self.offset = 0
+		try:
+			f = open(state_filename)
+			inode, offset = f.read().split()
+			f.close()
+			self.inode, self.offset = int(inode), int(offset)
+		except (IOError, ValueError):
+			pass
+
+	def read(self):
+		""" Returns a dict of address -> newest lease time for all
+		lease blocks appended since the last call. """
+		f = open(self.filename)
+		try:
+			stat = os.fstat(f.fileno())
+			if stat.st_ino != self.inode or stat.st_size < self.offset:
+				# dhcpd replaced or truncated the file, start over
+				self.inode = stat.st_ino
+				self.offset = 0
+			f.seek(self.offset)
+
+			start = self.offset
+			latest = {}
+			for address, timestamp, consumed in parse_leases(f):
+				if address not in latest or timestamp > latest[address]:
+					latest[address] = timestamp
+				self.offset = start + consumed
+			return latest
+		finally:
+			f.close()
+
+	def save_state(self):
+		f = open(self.state_filename + ".new", "w")
+		f.write("%d %d\n" % (self.inode, self.offset))
+		f.close()
+		os.rename(self.state_filename + ".new", self.state_filename)
+
+@transaction.commit_on_success
+def update_last_contact(latest, batch_size = 500):
+	""" Sets the last_contact of addresses from a dict of address -> time,
+	without moving any last_contact backwards. Addresses that are not in
+	the database are skipped. """
+	table = connection.ops.quote_name(Reachability._meta.db_table)
+	update = "UPDATE %s SET last_contact = %%s WHERE ip4address_id = %%s " \
+		"AND (last_contact IS NULL OR last_contact < %%s)" % table
+	insert = "INSERT INTO %s (ip4address_id, last_contact) VALUES (%%s, %%s)" % table
+
+	cursor = connection.cursor()
+	items = latest.items()
+	for i in xrange(0, len(items), batch_size):
+		batch = dict(items[i:i + batch_size])
+		ids = Ip4Address.objects.filter(address__in = batch.keys()) \
+			.values_list("address", "id")
+		existing = set(Reachability.objects \
+			.filter(ip4address__in = [id for address, id in ids]) \
+			.values_list("ip4address", flat = True))
+		updates = []
+		inserts = []
+		for address, id in ids:
+			timestamp = connection.ops.value_to_db_datetime(batch[address])
+			if id in existing:
+				updates.append((timestamp, id, timestamp))
+			else:
+				inserts.append((id, timestamp))
+		if updates:
+			cursor.executemany(update, updates)
+		if inserts:
+			insert_or_update(cursor, insert, inserts, update, \
+				lambda (id, timestamp): (timestamp, id, timestamp))
+		invalidate_host_details([id for address, id in ids])
+	transaction.set_dirty()
@@ -0,0 +1,191 @@
+"""
+Timings of the stages of a sync or probe run, written as JSON lines and
+as a Prometheus textfile for the node exporter's textfile collector.
+
+	metrics = Metrics("zone_sync", track_queries = True)
+	with metrics.stage("render", zone = "example.com"):
+		content = domain.zone_file_contents()
+	metrics.save("/var/log/mdb/sync.json", \
+		"/var/lib/node_exporter/mdb_zone_sync.prom")
+
+With track_queries, the number of queries and the time spent in the
+database is recorded for every stage as well. This makes Django keep a
+log of all queries, which is cleared at the start of every run.
+"""
+
+from django.db import connection, reset_queries
+
+import json
+import os
+import re
+import time
+
+class Stage(object):
+	def __init__(self, metrics, name, labels):
+		self.metrics = metrics
+		self.name = name
+		self.labels = labels
+
+	def __enter__(self):
+		self.queries = self.metrics.query_stats()
+		self.started = time.time()
+		return self
+
+	def __exit__(self, type, value, traceback):
+		seconds = time.time() - self.started
+		queries, query_seconds = self.metrics.query_stats()
+		self.metrics.record(self.name, self.labels, seconds, \
+			queries - self.queries[0], query_seconds - self.queries[1], \
+			type is None)
+		return False
+
+class Metrics(object):
+	def __init__(self, job, track_queries = False):
+		self.job = job
+		self.track_queries = track_queries
+		if track_queries:
+			connection.use_debug_cursor = True
+		self.start()
+
+	def start(self):
+		""" Starts a new run, forgetting the stages of the last one. """
+		if self.track_queries:
+			reset_queries()
+		self.started = time.time()
+		self.finished = None
+		self.stages = []
+		self.counters = {}
+
+	def query_stats(self):
+		""" (number of queries, seconds spent in them) so far. """
+		if not self.track_queries:
+			return 0, 0.0
+		return len(connection.queries), \
+			sum([float(q["time"]) for q in connection.queries])
+
+	def stage(self, name, **labels):
+		""" A context manager timing a stage of the run. labels tell
+		apart the same stage for different objects, like the zone. """
+		return Stage(self, name, labels)
+
+	def record(self, name, labels, seconds, queries, query_seconds, success):
+		self.stages.append({
+			"stage": name,
+			"labels": labels,
+			"seconds": seconds,
+			"queries": queries,
+			"query_seconds": query_seconds,
+			"success": success,
+		})
+
+	def count(self, name, value = 1):
+		""" Adds value to a counter of the run, like zones written. """
+		self.counters[name] = self.counters.get(name, 0) + value
+
+	def finish(self):
+		self.finished = time.time()
+
+	def totals(self):
+		""" Seconds, queries and query seconds per stage, summed over
+		all labels. """
+		totals = {}
+		for s in self.stages:
+			total = totals.setdefault(s["stage"], \
+				{"seconds": 0.0, "queries": 0, "query_seconds": 0.0, "count": 0})
+			total["seconds"] += s["seconds"]
+			total["queries"] += s["queries"]
+			total["query_seconds"] += s["query_seconds"]
+			total["count"] += 1
+		return totals
+
+	def run_summary(self):
+		finished = self.finished or time.time()
+		queries, query_seconds = 0, 0.0
+		for s in self.stages:
+			queries += s["queries"]
+			query_seconds += s["query_seconds"]
+		return {
+			"job": self.job,
+			"started": self.started,
+			"seconds": finished - self.started,
+			"queries": queries,
+			"query_seconds": query_seconds,
+			"stages": self.totals(),
+			"counters": self.counters,
+		}
+
+	def write_json(self, stream):
+		""" One line per stage, then one line for the run. """
+		for s in self.stages:
+			line = {"job": self.job, "time": self.started}
+			line.update(s)
+			stream.write(json.dumps(line, sort_keys = True) + "\n")
+		run = self.run_summary()
+		run["stage"] = "run"
+		stream.write(json.dumps(run, sort_keys = True) + "\n")
+		stream.flush()
+
+	def prometheus(self):
+		""" The metrics of the run in the Prometheus text format. """
+		prefix = "mdb_" + re.sub(r"[^a-zA-Z0-9_]", "_", self.job)
+		run = self.run_summary()
+		lines = []
+
+		def metric(name, help, samples):
+			lines.append("# HELP %s_%s %s" % (prefix, name, help))
+			lines.append("# TYPE %s_%s gauge" % (prefix, name))
+			for labels, value in samples:
+				label_text = ",".join(["%s=\"%s\"" % (k, escape(v)) \
+					for k, v in sorted(labels.items())])
+				if label_text:
+					label_text = "{" + label_text + "}"
+				lines.append("%s_%s%s %s" % (prefix, name, label_text, \
+					repr(float(value))))
+
+		metric("last_run_timestamp_seconds", "When the last run started.", \
+			[({}, run["started"])])
+		metric("run_seconds", "Duration of the last run.", \
+			[({}, run["seconds"])])
+		metric("run_queries", "Database queries of the last run.", \
+			[({}, run["queries"])])
+		metric("run_query_seconds", "Time spent in the database in the last run.", \
+			[({}, run["query_seconds"])])
+		totals = sorted(run["stages"].items())
+		metric("stage_seconds", "Duration of each stage in the last run.", \
+			[({"stage": name}, t["seconds"]) for name, t in totals])
+		metric("stage_queries", "Database queries of each stage in the last run.", \
+			[({"stage": name}, t["queries"]) for name, t in totals])
+		labeled = [s for s in self.stages if s["labels"]]
+		if labeled:
+			metric("object_stage_seconds", \
+				"Duration of each stage per object in the last run.", \
+				[(dict(s["labels"], stage = s["stage"]), s["seconds"]) \
+					for s in labeled])
+		for name, value in sorted(self.counters.items()):
+			metric(re.sub(r"[^a-zA-Z0-9_]", "_", name), \
+				"Counted in the last run.", [({}, value)])
+		return "\n".join(lines) + "\n"
+
+	def write_textfile(self, filename):
+		""" Writes the metrics for the textfile collector, replacing
+		the file atomically so a half written file is never read. """
+		tmp = "%s.%d.tmp" % (filename, os.getpid())
+		f = open(tmp, "w")
+		f.write(self.prometheus())
+		f.close()
+		os.rename(tmp, filename)
+
+	def save(self, json_log = None, textfile = None):
+		""" Finishes the run and writes its metrics to the JSON log
+		and the textfile, if given. """
+		self.finish()
+		if json_log is not None:
+			stream = open(json_log, "a")
+			self.write_json(stream)
+			stream.close()
+		if textfile is not None:
+			self.write_textfile(textfile)
+
+def escape(value):
+	return unicode(value).replace("\\", "\\\\").replace("\"", "\\\"") \
+		.replace("\n", "\\n").encode("utf-8")
@@ -1,8 +1,12 @@
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
 from django.db import models
-from django.db.models.signals import post_save, pre_save, pre_delete
+from django.db.models.signals import post_delete, post_save, pre_save, pre_delete
 from django.dispatch import receiver
 
 from validators import validate_hostname
+from fields import BlobField
+from inet import NetworkManager
 
 import ipaddr
 import datetime
@@ -166,7 +170,41 @@ class DhcpConfig(models.Model):
 	max_lease_time = models.IntegerField(default=7200)
 	log_facility = models.CharField(max_length=255)
 
-	def dhcpd_configuration(self):
+	def dhcp_subnet_entries(self, subnets=None):
+		""" Collect everything needed to render the given subnets
+		(default: all subnets in this config) using a fixed number of
+		queries. Returns a list of (subnet, options, custom_fields,
+		interfaces) tuples, where interfaces are the dhcp clients on the
+		subnet with ip4address, host and domain already loaded. """
+		if subnets is None:
+			subnets = self.ip4subnet_set.all()
+		subnets = list(subnets)
+		ids = [subnet.id for subnet in subnets]
+
+		options = {}
+		custom_fields = {}
+		interfaces = {}
+		if len(ids) > 0:
+			for option in DhcpOption.objects \
+					.filter(ip4subnet__in = ids).order_by("id"):
+				options.setdefault(option.ip4subnet_id, []).append(option)
+
+			for field in DhcpCustomField.objects \
+					.filter(ip4subnet__in = ids).order_by("id"):
+				custom_fields.setdefault(field.ip4subnet_id, []).append(field)
+
+			for interface in Interface.objects \
+					.filter(dhcp_client = True, ip4address__subnet__in = ids) \
+					.select_related("ip4address", "host", "domain") \
+					.order_by("ip4address__id"):
+				interfaces.setdefault(interface.ip4address.subnet_id, []) \
+					.append(interface)
+
+		return [(subnet, options.get(subnet.id, []), \
+			custom_fields.get(subnet.id, []), \
+			interfaces.get(subnet.id, [])) for subnet in subnets]
+
+	def dhcpd_header(self):
 		content = "# Autogenerated configuration %s\n" % datetime.datetime.now()
 		if self.authoritative:
 			content += "authoritative;\n"
@@ -174,46 +212,126 @@ class DhcpConfig(models.Model):
 		content += "max-lease-time %d;\n" % self.max_lease_time
 		content += "log-facility %s;\n" % self.log_facility
 		content += "ddns-update-style %s;\n" % self.ddns_update_style
-		
+		return content
 
-		# time to write the subnet definitions
-		for subnet in self.ip4subnet_set.all():
-			content += "\n# %s\n" % subnet.name
-			content += "subnet %s netmask %s {\n" % (subnet.network, subnet.netmask)
-			
-			for option in subnet.dhcpoption_set.all():
-				content += "\toption %s %s;\n" % (option.key, option.value)
+	def dhcpd_subnet_declaration(self, subnet, options, custom_fields):
+		content = "\n# %s\n" % subnet.name
+		content += "subnet %s netmask %s {\n" % (subnet.network, subnet.netmask)
 
-			for option in subnet.dhcpcustomfield_set.all():
-				content += "\t%s;\n" % option.value
+		for option in options:
+			content += "\toption %s %s;\n" % (option.key, option.value)
 
-			if subnet.dhcp_dynamic:
-				content += "\trange %s %s;\n" \
-					% (subnet.dhcp_dynamic_start, subnet.dhcp_dynamic_end)
+		for option in custom_fields:
+			content += "\t%s;\n" % option.value
+
+		if subnet.dhcp_dynamic:
+			content += "\trange %s %s;\n" \
+				% (subnet.dhcp_dynamic_start, subnet.dhcp_dynamic_end)
+
+		content += "}\n"
+		return content
+
+	def dhcpd_host_declaration(self, interface):
+		content = "\nhost %s {\n" % interface.host.hostname
+		content += "\thardware ethernet %s;\n" % interface.macaddr
+		content += "\tfixed-address %s.%s;\n" % \
+			(interface.host.hostname, interface.domain.domain_name)
+		if len(interface.pxe_filename) > 0:
+			content += "\tfilename \"%s\";\n" % interface.pxe_filename
+		content += "}\n"
+		return content
+
+	def dhcpd_main_configuration(self, subnets, include_dir):
+		""" The main configuration for sharded output, including
+		one file per subnet from include_dir. """
+		content = self.dhcpd_header()
+		for subnet in subnets:
+			content += "include \"%s/%s\";\n" % \
+				(include_dir, subnet.dhcpd_include_filename())
+		return content
+
+	def dhcpd_subnet_shard(self, subnet, options, custom_fields, interfaces):
+		""" The subnet declaration and host declarations of one subnet,
+		as written to its include file. """
+		content = self.dhcpd_subnet_declaration(subnet, options, custom_fields)
+		for interface in interfaces:
+			content += self.dhcpd_host_declaration(interface)
+		return content
 
-			content += "}\n"
+	def dhcpd_configuration(self, entries=None):
+		if entries is None:
+			entries = self.dhcp_subnet_entries()
+
+		content = self.dhcpd_header()
+
+		# time to write the subnet definitions
+		for subnet, options, custom_fields, interfaces in entries:
+			content += self.dhcpd_subnet_declaration(subnet, options, \
+				custom_fields)
 
 		# time to write host definitions
-		for subnet in self.ip4subnet_set.all():
-			for ip4address in subnet.ip4address_set.all():
-				if ip4address.interface_set.count() == 0:
-					continue
-				interface = ip4address.interface_set.get()
-				if not interface.dhcp_client:
-					continue
-				content += "\nhost %s {\n" % interface.host.hostname
-				content += "\thardware ethernet %s;\n" % interface.macaddr
-				content += "\tfixed-address %s.%s;\n" % \
-					(interface.host.hostname, interface.domain.domain_name)
-				if len(interface.pxe_filename) > 0:
-					content += "\tfilename \"%s\";\n" % interface.pxe_filename
-				content += "}\n"
+		for subnet, options, custom_fields, interfaces in entries:
+			for interface in interfaces:
+				content += self.dhcpd_host_declaration(interface)
 
 		return content
 
+	def kea_configuration(self, entries=None, base=None):
+		""" The same configuration for ISC Kea, as a dict ready to be
+		serialized to JSON. base is an existing Kea configuration whose
+		Dhcp4 settings (interfaces, lease database, control socket...)
+		are kept. Custom fields are dhcpd syntax and are left out. """
+		if entries is None:
+			entries = self.dhcp_subnet_entries()
+
+		dhcp4 = {}
+		if base is not None:
+			dhcp4.update(base.get("Dhcp4", {}))
+		dhcp4["authoritative"] = bool(self.authoritative)
+		dhcp4["valid-lifetime"] = self.default_lease_time
+		dhcp4["max-valid-lifetime"] = self.max_lease_time
+
+		dhcp4["subnet4"] = []
+		for subnet, options, custom_fields, interfaces in entries:
+			network = ipaddr.IPv4Network(subnet.network + "/" + subnet.netmask)
+			entry = {
+				"id": subnet.id,
+				"subnet": str(network),
+				"user-context": {"name": subnet.name},
+				"option-data": [],
+				"pools": [],
+				"reservations": [],
+			}
+			for option in options:
+				entry["option-data"].append({"name": option.key, \
+					"data": option.value.strip("\"")})
+			if subnet.dhcp_dynamic:
+				entry["pools"].append({"pool": "%s - %s" % \
+					(subnet.dhcp_dynamic_start, subnet.dhcp_dynamic_end)})
+			for interface in interfaces:
+				reservation = {
+					"hostname": interface.host.hostname,
+					"hw-address": interface.macaddr,
+					"ip-address": interface.ip4address.address,
+				}
+				if len(interface.pxe_filename) > 0:
+					reservation["boot-file-name"] = interface.pxe_filename
+				entry["reservations"].append(reservation)
+			dhcp4["subnet4"].append(entry)
+
+		return {"Dhcp4": dhcp4}
+
 	def __unicode__(self):
 		return self.name
 
+class Ip6SubnetManager(NetworkManager):
+	columns = ("network", "netmask")
+	postgresql = "mdb_ip6_cidr(%(network)s, %(netmask)s)"
+	sqlite = "%(network)s || '::/' || %(netmask)s"
+
+	def python(self, network, netmask):
+		return "%s::/%d" % (network, netmask)
+
 class Ip6Subnet(models.Model):
 	name = models.CharField(max_length=255)
 	network = models.CharField(max_length=255)
@@ -232,9 +350,26 @@ class Ip6Subnet(models.Model):
 	domain_admin = models.EmailField()
 	domain_filename = models.CharField(max_length=256)
 
+	objects = Ip6SubnetManager()
+
 	def __unicode__(self):
 		return self.network + " (" + self.name + ")"
 
+	def cidr(self):
+		return "%s::/%d" % (self.network, self.netmask)
+
+	def clean(self):
+		if not self.network or self.netmask is None:
+			return
+		try:
+			ipaddr.IPv6Network(self.cidr())
+		except ValueError:
+			raise ValidationError("%s is not a valid network" % self.cidr())
+		overlapping = Ip6Subnet.objects.overlapping(self.cidr()).exclude(id = self.id)
+		if overlapping:
+			raise ValidationError("%s overlaps %s" % (self.cidr(), \
+				", ".join([unicode(subnet) for subnet in overlapping])))
+
 	def zone_file_contents(self, generate_unassigned = False):
 		content = ""
 		content += "; zone file for %s\n" % self.domain_name
@@ -277,6 +412,14 @@ class Ip6Subnet(models.Model):
 
 		return content
 
+class Ip4SubnetManager(NetworkManager):
+	columns = ("network", "netmask")
+	postgresql = "mdb_ip4_cidr(%(network)s, %(netmask)s)"
+	sqlite = "%(network)s || '/' || %(netmask)s"
+
+	def python(self, network, netmask):
+		return "%s/%s" % (network, netmask)
+
 class Ip4Subnet(models.Model):
 
 	name = models.CharField(max_length=256)
@@ -300,10 +443,28 @@ class Ip4Subnet(models.Model):
 	dhcp_dynamic_start = models.IPAddressField(null=True, blank=True)
 	dhcp_dynamic_end = models.IPAddressField(null=True, blank=True)
 	dhcp_config = models.ForeignKey(DhcpConfig)
+
+	objects = Ip4SubnetManager()
 	
 	def __unicode__(self):
 		return self.network + " (" + self.name + ")"
 
+	def clean(self):
+		# create_ips_for_subnet would create the addresses of an
+		# overlapping subnet a second time
+		if self.network is None or self.netmask is None:
+			# the form already reports the invalid field
+			return
+		try:
+			network = ipaddr.IPv4Network(self.network + "/" + self.netmask)
+		except ValueError:
+			raise ValidationError("%s/%s is not a valid network" % \
+				(self.network, self.netmask))
+		overlapping = Ip4Subnet.objects.overlapping(network).exclude(id = self.id)
+		if overlapping:
+			raise ValidationError("%s overlaps %s" % (network, \
+				", ".join([unicode(subnet) for subnet in overlapping])))
+
 	def num_addresses(self):
 		subnet = ipaddr.IPv4Network(self.network + "/" + self.netmask)
 		return subnet.numhosts
@@ -323,6 +484,9 @@ class Ip4Subnet(models.Model):
 
 		return curr
 
+	def dhcpd_include_filename(self):
+		return "subnet-%d.conf" % self.id
+
 	broadcast_address.short_description = 'broadcast'
 	num_addresses.short_description = '#addresses'
 	first_address.short_description = 'first address'
@@ -384,11 +548,19 @@ class DhcpCustomField(models.Model):
 	value = models.CharField(max_length=255)
 	ip4subnet = models.ForeignKey(Ip4Subnet)
 
+class Ip4AddressManager(NetworkManager):
+	columns = ("address",)
+	postgresql = "%(address)s"
+	sqlite = "%(address)s"
+
+	def python(self, address):
+		return address
+
 class Ip4Address(models.Model):
 	subnet = models.ForeignKey(Ip4Subnet)
 	address = models.IPAddressField()
-	last_contact = models.DateTimeField()
-	ping_avg_rtt = models.FloatField()
+
+	objects = Ip4AddressManager()
 
 	def __unicode__(self):
 		if self.interface_set.count() == 0:
@@ -401,6 +573,55 @@ class Ip4Address(models.Model):
 
 	assigned_to_host.short_description = "Assigned to Host"
 
+	def get_reachability(self):
+		""" The Reachability of this address, None if it was never seen. """
+		if not hasattr(self, "_reachability"):
+			try:
+				self._reachability = self.reachability
+			except Reachability.DoesNotExist:
+				self._reachability = None
+		return self._reachability
+
+	@property
+	def last_contact(self):
+		reachability = self.get_reachability()
+		return reachability and reachability.last_contact
+
+	@property
+	def ping_avg_rtt(self):
+		reachability = self.get_reachability()
+		return reachability and reachability.ping_avg_rtt
+
+class Reachability(models.Model):
+	""" When an address last answered ping or dhcp and its round trip
+	time, written by the ping scripts and the lease service. It has a
+	table of its own so those writes never touch the Ip4Address rows
+	zones and dhcp configurations are rendered from. """
+	ip4address = models.OneToOneField(Ip4Address, primary_key=True)
+	last_contact = models.DateTimeField(null=True, blank=True)
+	ping_avg_rtt = models.FloatField(null=True, blank=True)
+
+def load_reachability(addresses):
+	""" Loads the Reachability of all addresses in one query, for lists
+	that would otherwise query it per address. """
+	addresses = [a for a in addresses if a is not None]
+	found = Reachability.objects.in_bulk([a.id for a in addresses])
+	for address in addresses:
+		address._reachability = found.get(address.id)
+
+class LatencyHistory(models.Model):
+	""" Round trip time history of an address, see mdb.history for the
+	layout of data. """
+	ip4address = models.OneToOneField(Ip4Address)
+	data = BlobField()
+
+class SyncJournal(models.Model):
+	""" A zone or dhcp configuration whose serial moved and that has to
+	be published, see mdb.sync. """
+	kind = models.CharField(max_length=16)
+	object_id = models.IntegerField()
+	serial = models.IntegerField()
+	created_date = models.DateTimeField(auto_now_add=True)
 
 class HostType(models.Model):
 	host_type = models.CharField(max_length=64)
@@ -615,6 +836,45 @@ def update_domain_serial_when_change_to_interface(sender, instance, created, **k
 		subnet.domain_serial = format_domain_serial_and_add_one(subnet.domain_serial)
 		subnet.save()
 
+@receiver(pre_save, sender=Interface)
+def update_domain_serial_when_interface_moved(sender, instance, **kwargs):
+	# the post_save receiver only sees the new address, make sure the
+	# subnet the interface is moved away from is regenerated as well
+	if instance.id is None:
+		return
+	try:
+		old = Interface.objects.select_related("ip4address__subnet") \
+			.get(id = instance.id)
+	except Interface.DoesNotExist:
+		return
+	if old.ip4address != None and old.ip4address_id != instance.ip4address_id:
+		subnet = old.ip4address.subnet
+		subnet.domain_serial = format_domain_serial_and_add_one(subnet.domain_serial)
+		subnet.save()
+
+def bump_serial(instance, field, active_field, kind):
+	""" Bumps the serial of a zone or dhcp config with an update rather
+	than a save, which would rerun its signals, and journals it like
+	journal_zone_change. """
+	serial = int(format_domain_serial_and_add_one(getattr(instance, field)))
+	type(instance).objects.filter(id = instance.id).update(**{field: serial})
+	setattr(instance, field, serial)
+	if serial != getattr(instance, active_field):
+		SyncJournal.objects.create(kind = kind, object_id = instance.id, \
+			serial = serial)
+
+@receiver(post_save, sender=DhcpOption)
+@receiver(post_delete, sender=DhcpOption)
+@receiver(post_save, sender=DhcpCustomField)
+@receiver(post_delete, sender=DhcpCustomField)
+def update_subnet_serial_when_dhcp_option_changed(sender, instance, **kwargs):
+	# post_delete is sent once all rows are gone, so a subnet deleted
+	# along with its options is not found and nothing is bumped
+	for subnet in Ip4Subnet.objects.filter(id = instance.ip4subnet_id) \
+			.select_related("dhcp_config"):
+		bump_serial(subnet, "domain_serial", "domain_active_serial", "ip4subnet")
+		bump_serial(subnet.dhcp_config, "serial", "active_serial", "dhcpconfig")
+
 @receiver(post_save, sender=Host)
 def update_domain_serial_when_change_to_host(sender, instance, created, **kwargs):
 	for interface in instance.interface_set.all():
@@ -641,6 +901,64 @@ def update_domain_serial_when_interface_deleted(sender, instance, **kwargs):
 		subnet.domain_serial = subnet.domain_serial + 1
 		subnet.save()
 
+@receiver(post_save, sender=Domain)
+@receiver(post_save, sender=Ip4Subnet)
+@receiver(post_save, sender=Ip6Subnet)
+def journal_zone_change(sender, instance, **kwargs):
+	if instance.domain_serial != instance.domain_active_serial:
+		SyncJournal.objects.create(kind = sender.__name__.lower(), \
+			object_id = instance.id, serial = instance.domain_serial)
+
+@receiver(post_save, sender=DhcpConfig)
+def journal_dhcp_config_change(sender, instance, **kwargs):
+	if instance.serial != instance.active_serial:
+		SyncJournal.objects.create(kind = "dhcpconfig", \
+			object_id = instance.id, serial = instance.serial)
+
+def host_detail_cache_key(host_id):
+	return "mdb.host_detail.%s" % host_id
+
+@receiver(post_save, sender=Host)
+@receiver(pre_delete, sender=Host)
+def invalidate_host_detail_when_host_changed(sender, instance, **kwargs):
+	cache.delete(host_detail_cache_key(instance.id))
+
+@receiver(post_save, sender=Interface)
+@receiver(pre_delete, sender=Interface)
+def invalidate_host_detail_when_interface_changed(sender, instance, **kwargs):
+	cache.delete(host_detail_cache_key(instance.host_id))
+
+@receiver(pre_save, sender=Interface)
+def invalidate_host_detail_when_interface_moved(sender, instance, **kwargs):
+	# the post_save receiver only sees the new host
+	if instance.id is None:
+		return
+	for host_id in Interface.objects.filter(id = instance.id) \
+			.exclude(host = instance.host_id).values_list("host", flat = True):
+		cache.delete(host_detail_cache_key(host_id))
+
+@receiver(post_save, sender=Ip6Address)
+@receiver(pre_delete, sender=Ip6Address)
+def invalidate_host_detail_when_ip6address_changed(sender, instance, **kwargs):
+	cache.delete(host_detail_cache_key(instance.interface.host_id))
+
+def invalidate_host_details(ip4address_ids):
+	""" Drops the cached details of the hosts with these addresses. For
+	the writers of Reachability, which use SQL and send no signals. """
+	cache.delete_many([host_detail_cache_key(host_id) for host_id in \
+		Interface.objects.filter(ip4address__in = ip4address_ids) \
+			.values_list("host", flat = True)])
+
+@receiver(post_save, sender=Ip4Address)
+@receiver(pre_delete, sender=Ip4Address)
+def invalidate_host_detail_when_ip4address_changed(sender, instance, **kwargs):
+	invalidate_host_details([instance.id])
+
+@receiver(post_save, sender=Reachability)
+@receiver(pre_delete, sender=Reachability)
+def invalidate_host_detail_when_reachability_changed(sender, instance, **kwargs):
+	invalidate_host_details([instance.ip4address_id])
+
 #@receiver(pre_save, sender=Domain)
 #def update_domain_serial_when_domain_is_saved(sender, instance, **kwargs):
 #	instance.domain_serial = format_domain_serial_and_add_one(instance.domain_serial)
@@ -0,0 +1,194 @@
+"""
+Minimal client for the ISC dhcpd OMAPI protocol.
+
+Only what the dhcp synchronizer needs is implemented: adding and
+removing host objects on a running dhcpd, optionally signed with a
+HMAC-MD5 key (the same key configured with "omapi-key" in dhcpd.conf).
+dhcpd must be started with "omapi-port" set for this to work.
+"""
+
+import base64
+import hashlib
+import hmac
+import random
+import socket
+import struct
+
+OMAPI_PROTOCOL_VERSION = 100
+OMAPI_HEADER_SIZE = 24
+
+OMAPI_OP_OPEN = 1
+OMAPI_OP_REFRESH = 2
+OMAPI_OP_UPDATE = 3
+OMAPI_OP_NOTIFY = 4
+OMAPI_OP_STATUS = 5
+OMAPI_OP_DELETE = 6
+
+HMAC_MD5 = "hmac-md5.SIG-ALG.REG.INT."
+
+class OmapiError(Exception):
+	pass
+
+class OmapiNotFound(OmapiError):
+	pass
+
+def pack_int(value):
+	return struct.pack("!I", value)
+
+def unpack_int(data):
+	return struct.unpack("!I", data)[0]
+
+def pack_values(values):
+	data = ""
+	for key, value in values:
+		# names from the database are unicode, the rest is binary
+		if isinstance(value, unicode):
+			value = value.encode("utf-8")
+		data += struct.pack("!H", len(key)) + key
+		data += struct.pack("!I", len(value)) + value
+	return data + struct.pack("!H", 0)
+
+class OmapiMessage(object):
+	def __init__(self, opcode, handle = 0, tid = 0, rid = 0, \
+			message = None, obj = None):
+		self.authid = 0
+		self.signature = ""
+		self.opcode = opcode
+		self.handle = handle
+		self.tid = tid
+		self.rid = rid
+		self.message = message or []
+		self.obj = obj or []
+
+	def value(self, key, default = None):
+		for k, v in self.message + self.obj:
+			if k == key:
+				return v
+		return default
+
+	def as_string(self, forsigning = False):
+		data = ""
+		if not forsigning:
+			data += pack_int(self.authid)
+		data += pack_int(len(self.signature))
+		data += pack_int(self.opcode) + pack_int(self.handle)
+		data += pack_int(self.tid) + pack_int(self.rid)
+		data += pack_values(self.message) + pack_values(self.obj)
+		if not forsigning:
+			data += self.signature
+		return data
+
+	def sign(self, authid, key):
+		self.authid = authid
+		self.signature = "\0" * 16
+		self.signature = hmac.new(key, self.as_string(True), \
+			hashlib.md5).digest()
+
+def read_exact(stream, size):
+	data = stream.read(size)
+	if len(data) != size:
+		raise OmapiError("connection closed by peer")
+	return data
+
+def read_values(stream):
+	values = []
+	while True:
+		length = struct.unpack("!H", read_exact(stream, 2))[0]
+		if length == 0:
+			return values
+		key = read_exact(stream, length)
+		length = unpack_int(read_exact(stream, 4))
+		values.append((key, read_exact(stream, length)))
+
+def read_message(stream):
+	authid, authlen, opcode, handle, tid, rid = \
+		struct.unpack("!6I", read_exact(stream, OMAPI_HEADER_SIZE))
+	msg = OmapiMessage(opcode, handle, tid, rid)
+	msg.authid = authid
+	msg.message = read_values(stream)
+	msg.obj = read_values(stream)
+	msg.signature = read_exact(stream, authlen)
+	return msg
+
+def read_startup(stream):
+	version, header_size = struct.unpack("!II", read_exact(stream, 8))
+	if version != OMAPI_PROTOCOL_VERSION or header_size != OMAPI_HEADER_SIZE:
+		raise OmapiError("unsupported protocol version %d" % version)
+
+def startup_message():
+	return pack_int(OMAPI_PROTOCOL_VERSION) + pack_int(OMAPI_HEADER_SIZE)
+
+class OmapiClient(object):
+	""" Talks OMAPI to dhcpd over a single TCP connection.
+
+	key_name and key are the name and base64 secret of the omapi-key
+	from dhcpd.conf; leave them out for an unauthenticated server. """
+
+	def __init__(self, host, port = 7911, key_name = None, key = None, \
+			timeout = 5):
+		self.authid = 0
+		self.key = None
+		self.sock = socket.create_connection((host, port), timeout)
+		self.stream = self.sock.makefile("rb")
+		self.sock.sendall(startup_message())
+		read_startup(self.stream)
+
+		if key_name is not None:
+			msg = OmapiMessage(OMAPI_OP_OPEN, message = [("type", "authenticator")], \
+				obj = [("name", key_name), ("algorithm", HMAC_MD5)])
+			response = self.query(msg)
+			if response.opcode != OMAPI_OP_UPDATE:
+				raise OmapiError("authentication failed")
+			self.authid = response.handle
+			self.key = base64.b64decode(key)
+
+	def close(self):
+		self.stream.close()
+		self.sock.close()
+
+	def query(self, msg):
+		msg.tid = random.randint(1, 2 ** 31)
+		if self.key is not None:
+			msg.sign(self.authid, self.key)
+		self.sock.sendall(msg.as_string())
+		response = read_message(self.stream)
+		if response.rid != msg.tid:
+			raise OmapiError("response does not match request")
+		return response
+
+	def lookup_host(self, name):
+		""" Returns the handle of the host object with the given name. """
+		msg = OmapiMessage(OMAPI_OP_OPEN, message = [("type", "host")], \
+			obj = [("name", name)])
+		response = self.query(msg)
+		if response.opcode != OMAPI_OP_UPDATE:
+			raise OmapiNotFound("host %s not found" % name)
+		return response.handle
+
+	def add_host(self, name, macaddr, ipaddr, statements = None):
+		obj = [("name", name), \
+			("hardware-address", "".join([chr(int(x, 16)) \
+				for x in macaddr.split(":")])), \
+			("hardware-type", pack_int(1)), \
+			("ip-address", socket.inet_aton(ipaddr))]
+		if statements:
+			obj.append(("statements", statements))
+		msg = OmapiMessage(OMAPI_OP_OPEN, message = [("create", pack_int(1)), \
+			("exclusive", pack_int(1)), ("type", "host")], obj = obj)
+		response = self.query(msg)
+		if response.opcode != OMAPI_OP_UPDATE:
+			raise OmapiError("could not add host %s: %s" % \
+				(name, response.value("message", "unknown error")))
+
+	def del_host(self, name):
+		""" Removes the host with the given name. Hosts that dhcpd does
+		not know about are silently ignored. """
+		try:
+			handle = self.lookup_host(name)
+		except OmapiNotFound:
+			return
+		response = self.query(OmapiMessage(OMAPI_OP_DELETE, handle = handle))
+		if response.opcode != OMAPI_OP_STATUS or \
+				unpack_int(response.value("result", pack_int(0))) != 0:
+			raise OmapiError("could not delete host %s: %s" % \
+				(name, response.value("message", "unknown error")))
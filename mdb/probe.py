@@ -0,0 +1,216 @@
+"""
+ICMP echo prober that keeps many requests in flight from a single
+socket and a single select() loop, instead of running one ping process
+per address.
+
+Opening an ICMP socket needs either root (raw socket) or a group listed
+in net.ipv4.ping_group_range (datagram socket).
+"""
+
+import collections
+import errno
+import heapq
+import itertools
+import os
+import select
+import socket
+import struct
+import time
+
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+
+# seconds until a request is sent again when the send buffer was full
+SEND_RETRY = 0.01
+
+def checksum(data):
+	if len(data) % 2:
+		data += "\0"
+	total = sum(struct.unpack("!%dH" % (len(data) / 2), data))
+	total = (total >> 16) + (total & 0xffff)
+	total += total >> 16
+	return ~total & 0xffff
+
+def echo_packet(icmp_type, ident, seq, payload):
+	header = struct.pack("!BBHHH", icmp_type, 0, 0, ident, seq)
+	header = struct.pack("!BBHHH", icmp_type, 0, \
+		checksum(header + payload), ident, seq)
+	return header + payload
+
+def parse_echo_reply(data, ident = None):
+	""" Returns the sequence number of an echo reply, or None. Raw
+	sockets deliver the IP header as well, datagram sockets do not.
+	With ident, replies to other identifiers are ignored too. """
+	if len(data) >= 20 and ord(data[0]) >> 4 == 4:
+		data = data[(ord(data[0]) & 0x0f) * 4:]
+	if len(data) < 8:
+		return None
+	icmp_type, code, csum, reply_ident, seq = struct.unpack("!BBHHH", data[:8])
+	if icmp_type != ICMP_ECHO_REPLY:
+		return None
+	if ident is not None and reply_ident != ident:
+		return None
+	return seq
+
+def icmp_socket():
+	try:
+		return socket.socket(socket.AF_INET, socket.SOCK_DGRAM, \
+			socket.getprotobyname("icmp"))
+	except socket.error:
+		return socket.socket(socket.AF_INET, socket.SOCK_RAW, \
+			socket.getprotobyname("icmp"))
+
+class ProbeResult(object):
+	def __init__(self, address):
+		self.address = address
+		self.sent = 0
+		self.rtts = []
+
+	def received(self):
+		return len(self.rtts)
+
+	def loss(self):
+		if self.sent == 0:
+			return 1.0
+		return 1.0 - float(len(self.rtts)) / self.sent
+
+	def avg_rtt(self):
+		""" Average round trip time in milliseconds, like the avg
+		value of ping, or None if nothing came back. """
+		if len(self.rtts) == 0:
+			return None
+		return sum(self.rtts) / len(self.rtts)
+
+	def __repr__(self):
+		return "<ProbeResult %s %d/%d %s>" % (self.address, \
+			len(self.rtts), self.sent, self.avg_rtt())
+
+class Prober(object):
+	""" Sends count echo requests, interval seconds apart, to each
+	target and waits up to timeout seconds for each reply. At most
+	max_in_flight requests are outstanding at any time.
+
+	sock and port are only meant for tests, which probe a stand-in
+	echo responder on a loopback udp port. """
+
+	def __init__(self, count = 5, timeout = 1.0, interval = 0.2, \
+			max_in_flight = 1000, sock = None, port = 0):
+		self.count = count
+		self.timeout = timeout
+		self.interval = interval
+		self.max_in_flight = max_in_flight
+		self.port = port
+		self.sock = sock or icmp_socket()
+		self.sock.setblocking(0)
+		self.ident = os.getpid() & 0xffff
+		# a raw socket sees the replies to every process, the kernel
+		# sets and matches the identifier of datagram sockets itself
+		self.reply_ident = None
+		if self.sock.type == socket.SOCK_RAW:
+			self.reply_ident = self.ident
+		self.seq = 0
+		self.payload = "mdb-probe".ljust(56, "\0")
+
+		self.schedule = []
+		self.order = itertools.count()
+		self.results = {}
+		self.remaining = {}
+		self.in_flight = {}
+		self.deadlines = collections.deque()
+
+	def close(self):
+		self.sock.close()
+
+	def add(self, key, address):
+		""" Starts probing address. key identifies the target in the
+		results and must be unique among the targets being probed. """
+		self.results[key] = ProbeResult(address)
+		self.remaining[key] = self.count
+		heapq.heappush(self.schedule, (time.time(), self.order.next(), key))
+
+	def pending(self):
+		return len(self.results)
+
+	def run(self, targets):
+		""" Probes (key, address) targets. Yields (key, ProbeResult)
+		pairs as soon as all samples of a target are done. """
+		for key, address in targets:
+			self.add(key, address)
+		while self.pending():
+			for done in self.poll():
+				yield done
+
+	def poll(self, max_wait = None):
+		""" Sends the requests that are due and waits for replies, at
+		most max_wait seconds. Returns the (key, ProbeResult) pairs of
+		the targets that finished. """
+		done = []
+		now = time.time()
+
+		# send everything that is due
+		while self.schedule and self.schedule[0][0] <= now and \
+				len(self.in_flight) < self.max_in_flight:
+			when, n, key = heapq.heappop(self.schedule)
+			self.seq = (self.seq + 1) & 0xffff
+			packet = echo_packet(ICMP_ECHO_REQUEST, self.ident, \
+				self.seq, self.payload)
+			try:
+				self.sock.sendto(packet, (self.results[key].address, self.port))
+			except socket.error, e:
+				if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS):
+					# nothing was sent, try again once the buffer drained
+					heapq.heappush(self.schedule, (now + SEND_RETRY, n, key))
+					break
+				# unreachable and the like, the request is lost
+				self.results[key].sent += 1
+				self.sample_done(key, done)
+				continue
+			self.results[key].sent += 1
+			sent = time.time()
+			self.in_flight[self.seq] = (key, sent)
+			self.deadlines.append((sent + self.timeout, self.seq, sent))
+
+		wait = self.timeout
+		if max_wait is not None:
+			wait = min(wait, max_wait)
+		if self.deadlines:
+			wait = min(wait, self.deadlines[0][0] - now)
+		if self.schedule and len(self.in_flight) < self.max_in_flight:
+			wait = min(wait, self.schedule[0][0] - now)
+		select.select([self.sock], [], [], max(wait, 0))
+
+		# read all replies that have arrived
+		while True:
+			try:
+				data, source = self.sock.recvfrom(1024)
+			except socket.error:
+				break
+			seq = parse_echo_reply(data, self.reply_ident)
+			if seq not in self.in_flight:
+				continue
+			key, sent = self.in_flight[seq]
+			if source[0] != self.results[key].address:
+				continue
+			del self.in_flight[seq]
+			self.results[key].rtts.append((time.time() - sent) * 1000.0)
+			self.sample_done(key, done)
+
+		# expire requests that timed out
+		now = time.time()
+		while self.deadlines and self.deadlines[0][0] <= now:
+			deadline, seq, sent = self.deadlines.popleft()
+			# the sequence number may have been reused since
+			if seq in self.in_flight and self.in_flight[seq][1] == sent:
+				key, sent = self.in_flight.pop(seq)
+				self.sample_done(key, done)
+
+		return done
+
+	def sample_done(self, key, done):
+		self.remaining[key] -= 1
+		if self.remaining[key] > 0:
+			heapq.heappush(self.schedule, (time.time() + self.interval, \
+				self.order.next(), key))
+			return
+		del self.remaining[key]
+		done.append((key, self.results.pop(key)))
@@ -0,0 +1,149 @@
+"""
+Query counts, SQL time and view time of every request, for finding out
+why pages like the admin changelists are slow.
+
+Put mdb.profiling.ProfileMiddleware first in MIDDLEWARE_CLASSES and set
+MDB_PROFILE = True. With MDB_PROFILE off the middleware removes itself
+when Django starts, so leaving it in costs nothing. Profiled responses
+get the headers
+
+  X-Mdb-Queries            number of queries
+  X-Mdb-Query-Time         milliseconds spent in them
+  X-Mdb-Duplicate-Queries  queries that only differ from an earlier one
+                           in their values, like the queries of
+                           interface_set.count() in a loop over hosts
+  X-Mdb-View-Time          milliseconds from calling the view until the
+                           response is done
+  X-Mdb-Total-Time         milliseconds for the whole request
+
+The last MDB_PROFILE_WINDOW requests of every URL name or view are kept
+in the cache and summarized on /info/profile/. Concurrent requests can
+overwrite each other's samples, which is fine for finding the worst
+pages.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.urlresolvers import resolve
+from django.db import connection
+
+import re
+import time
+
+CACHE_KEY = "mdb-profile"
+CACHE_TIMEOUT = 86400
+
+# duplicated fingerprints kept per request
+TOP_DUPLICATES = 5
+
+def fingerprint(sql):
+	""" The query with its values replaced by ?, so queries that only
+	differ in the id they look up are the same. """
+	sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+	sql = re.sub(r"\b\d+(?:\.\d+)?\b", "?", sql)
+	sql = re.sub(r"\bIN \([?, ]+\)", "IN (...)", sql)
+	return sql
+
+def query_profile(queries):
+	""" (number of queries, seconds spent in them, duplicates, the most
+	duplicated fingerprints as (count, fingerprint)). """
+	seconds = 0.0
+	fingerprints = {}
+	for query in queries:
+		seconds += float(query["time"])
+		key = fingerprint(query["sql"])
+		fingerprints[key] = fingerprints.get(key, 0) + 1
+	duplicated = sorted([(count, sql) for sql, count in fingerprints.items() \
+		if count > 1], reverse = True)
+	return len(queries), seconds, len(queries) - len(fingerprints), \
+		duplicated[:TOP_DUPLICATES]
+
+def record(endpoint, sample):
+	window = getattr(settings, "MDB_PROFILE_WINDOW", 100)
+	samples = cache.get(CACHE_KEY) or {}
+	samples[endpoint] = (samples.get(endpoint, []) + [sample])[-window:]
+	cache.set(CACHE_KEY, samples, CACHE_TIMEOUT)
+
+def mean(values):
+	return sum(values) / float(len(values))
+
+def endpoint_summary(order = "total"):
+	""" One dict per endpoint with the number of requests and the mean
+	and maximum times and query counts of the kept samples, worst first
+	by mean total time, queries or duplicates. """
+	summary = []
+	for endpoint, samples in (cache.get(CACHE_KEY) or {}).items():
+		worst = max(samples, key = lambda s: s["duplicates"])
+		summary.append({
+			"endpoint": endpoint,
+			"requests": len(samples),
+			"total": mean([s["total"] for s in samples]),
+			"max_total": max([s["total"] for s in samples]),
+			"view": mean([s["view"] for s in samples]),
+			"queries": mean([s["queries"] for s in samples]),
+			"max_queries": max([s["queries"] for s in samples]),
+			"query_time": mean([s["query_time"] for s in samples]),
+			"duplicates": worst["duplicates"],
+			"duplicated": worst["duplicated"],
+			"path": worst["path"],
+		})
+	summary.sort(key = lambda e: e[order], reverse = True)
+	return summary
+
+def profile_exempt(view):
+	""" Keeps a view, like the profile page itself, out of the samples. """
+	view.profile_exempt = True
+	return view
+
+class ProfileMiddleware(object):
+	def __init__(self):
+		if not getattr(settings, "MDB_PROFILE", False):
+			raise MiddlewareNotUsed
+
+	def process_request(self, request):
+		request.mdb_profile = {
+			"started": time.time(),
+			"debug_cursor": connection.use_debug_cursor,
+			"first_query": len(connection.queries),
+		}
+		connection.use_debug_cursor = True
+
+	def process_view(self, request, view_func, view_args, view_kwargs):
+		profile = getattr(request, "mdb_profile", None)
+		if profile is None or getattr(view_func, "profile_exempt", False):
+			return None
+		profile["endpoint"] = resolve(request.path_info).url_name or \
+			"%s.%s" % (view_func.__module__, view_func.__name__)
+		profile["view_started"] = time.time()
+		return None
+
+	def process_response(self, request, response):
+		profile = getattr(request, "mdb_profile", None)
+		if profile is None:
+			return response
+		now = time.time()
+		connection.use_debug_cursor = profile["debug_cursor"]
+		queries, query_time, duplicates, duplicated = \
+			query_profile(connection.queries[profile["first_query"]:])
+		total = (now - profile["started"]) * 1000
+		view = (now - profile.get("view_started", now)) * 1000
+
+		response["X-Mdb-Queries"] = str(queries)
+		response["X-Mdb-Query-Time"] = "%.1f" % (query_time * 1000)
+		response["X-Mdb-Duplicate-Queries"] = str(duplicates)
+		response["X-Mdb-View-Time"] = "%.1f" % view
+		response["X-Mdb-Total-Time"] = "%.1f" % total
+
+		if "endpoint" in profile:
+			record(profile["endpoint"], {
+				"time": now,
+				"path": request.path,
+				"total": total,
+				"view": view,
+				"queries": queries,
+				"query_time": query_time * 1000,
+				"duplicates": duplicates,
+				"duplicated": duplicated,
+			})
+		return response
@@ -0,0 +1,125 @@
+"""
+Copies published files to several servers at once.
+
+A Publisher hands the same set of files to each of its targets in a
+thread of its own, so publishing to five servers takes about as long as
+publishing to the slowest one. Every target gets all files, each
+replaced atomically, and is then reloaded once. Failed steps are
+retried.
+"""
+
+from commands import getstatusoutput
+import os
+import pipes
+import shutil
+import tempfile
+import threading
+import time
+
+class PublishError(Exception):
+	pass
+
+def run(command):
+	status, output = getstatusoutput(command)
+	if status != 0:
+		raise PublishError("%s failed: %s" % (command, output))
+
+class Target(object):
+	""" The name and reload of a target, see Publisher for what else a
+	target needs. reload_command is run once after all files of a
+	publish are in place. """
+
+	def __init__(self, name, reload_command = None):
+		self.name = name
+		self.reload_command = reload_command
+
+	def reload(self):
+		if self.reload_command is not None:
+			run(self.reload_command)
+
+class DirectoryTarget(Target):
+	""" A local directory, for example an NFS mount or the zone directory
+	of the local bind. """
+
+	def __init__(self, directory, reload_command = None, name = None):
+		Target.__init__(self, name or directory, reload_command)
+		self.directory = directory
+
+	def put(self, source, name):
+		path = os.path.join(self.directory, name)
+		tmp = os.path.join(self.directory, ".%s.tmp" % name)
+		shutil.copyfile(source, tmp)
+		os.rename(tmp, path)
+
+class CommandTarget(Target):
+	""" A server reached by a copy command like
+	"rsync %(source)s ns2:/etc/bind/zones/%(name)s". The command has to
+	replace the file atomically, as rsync does. """
+
+	def __init__(self, copy_command, reload_command = None, name = None):
+		Target.__init__(self, name or copy_command, reload_command)
+		self.copy_command = copy_command
+
+	def put(self, source, name):
+		run(self.copy_command % {"source": pipes.quote(source), \
+			"name": pipes.quote(name)})
+
+class Publisher(object):
+	""" Publishes to targets, which are any objects with
+		name           the key of the target in the results of publish
+		put(source, name)
+		               replaces the file name on the target with the
+		               local file source, atomically
+		reload()       makes the target pick up the new files
+	put and reload raise PublishError, IOError or OSError on failure,
+	and are retried. DirectoryTarget and CommandTarget are the targets
+	that come with mdb. """
+
+	def __init__(self, targets, retries = 3, retry_delay = 1.0):
+		self.targets = targets
+		self.retries = retries
+		self.retry_delay = retry_delay
+
+	def retry(self, function, *args):
+		for attempt in range(self.retries):
+			try:
+				return function(*args)
+			except (PublishError, IOError, OSError):
+				if attempt == self.retries - 1:
+					raise
+				time.sleep(self.retry_delay * (attempt + 1))
+
+	def publish_to(self, target, files, results):
+		try:
+			for source, name in files:
+				self.retry(target.put, source, name)
+			self.retry(target.reload)
+			results[target.name] = None
+		except (PublishError, IOError, OSError), e:
+			results[target.name] = str(e)
+
+	def publish(self, files):
+		""" Publishes (name, content) pairs to all targets. Returns a
+		dict of target name to None, or the error if the target failed. """
+		staging = tempfile.mkdtemp(prefix = "mdb-publish-")
+		try:
+			staged = []
+			for name, content in files:
+				if isinstance(content, unicode):
+					content = content.encode("utf-8")
+				source = os.path.join(staging, name)
+				f = open(source, "w")
+				f.write(content)
+				f.close()
+				staged.append((source, name))
+
+			results = {}
+			threads = [threading.Thread(target = self.publish_to, \
+				args = (target, staged, results)) for target in self.targets]
+			for thread in threads:
+				thread.start()
+			for thread in threads:
+				thread.join()
+			return results
+		finally:
+			shutil.rmtree(staging)
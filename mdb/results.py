@@ -0,0 +1,91 @@
+"""
+Writes probe results to the database in batches.
+"""
+
+from django.db import IntegrityError, connection, transaction
+
+from mdb.models import Reachability, invalidate_host_details
+
+import time
+
+def insert_or_update(cursor, insert, rows, update, update_row):
+	""" Runs the INSERT insert for rows. Another writer may have inserted
+	some of them since we looked, those are written with the UPDATE
+	update instead, with the parameters update_row returns for the row.
+	update_row is only called for those rows, and may read the row the
+	other writer inserted. """
+	sid = transaction.savepoint()
+	try:
+		cursor.executemany(insert, rows)
+		transaction.savepoint_commit(sid)
+		return
+	except IntegrityError:
+		transaction.savepoint_rollback(sid)
+	for row in rows:
+		sid = transaction.savepoint()
+		try:
+			cursor.execute(insert, row)
+			transaction.savepoint_commit(sid)
+		except IntegrityError:
+			transaction.savepoint_rollback(sid)
+			cursor.execute(update, update_row(row))
+
+class DatabaseWriter(object):
+	""" Collects (ip4address id, last contact, avg rtt) results and
+	writes them to the Reachability of the addresses in one transaction
+	once batch_size results are waiting or flush_interval seconds have
+	passed since the last write. """
+
+	def __init__(self, batch_size = 500, flush_interval = 5.0):
+		self.batch_size = batch_size
+		self.flush_interval = flush_interval
+		self.rows = []
+		self.last_flush = time.time()
+		self.flushes = 0
+
+	def put(self, ip4address_id, last_contact, ping_avg_rtt):
+		self.rows.append((ip4address_id, last_contact, ping_avg_rtt))
+		if len(self.rows) >= self.batch_size:
+			self.flush()
+		else:
+			self.flush_if_due()
+
+	def flush_if_due(self):
+		""" Writes the waiting results if flush_interval has passed. """
+		if self.rows and time.time() - self.last_flush >= self.flush_interval:
+			self.flush()
+
+	def close(self):
+		self.flush()
+
+	def flush(self):
+		if self.rows:
+			self.write(self.rows)
+			self.flushes += 1
+		self.rows = []
+		self.last_flush = time.time()
+
+	@transaction.commit_on_success
+	def write(self, rows):
+		# the last result of an address wins
+		latest = dict([(id, (last_contact, rtt)) for id, last_contact, rtt in rows])
+		existing = set(Reachability.objects.filter(ip4address__in = latest.keys()) \
+			.values_list("ip4address", flat = True))
+
+		table = connection.ops.quote_name(Reachability._meta.db_table)
+		update = "UPDATE %s SET last_contact = %%s, ping_avg_rtt = %%s " \
+			"WHERE ip4address_id = %%s" % table
+		insert = "INSERT INTO %s (ip4address_id, last_contact, ping_avg_rtt) " \
+			"VALUES (%%s, %%s, %%s)" % table
+		cursor = connection.cursor()
+		updates = [(connection.ops.value_to_db_datetime(last_contact), rtt, id) \
+			for id, (last_contact, rtt) in latest.items() if id in existing]
+		inserts = [(id, connection.ops.value_to_db_datetime(last_contact), rtt) \
+			for id, (last_contact, rtt) in latest.items() if id not in existing]
+		if updates:
+			cursor.executemany(update, updates)
+		if inserts:
+			insert_or_update(cursor, insert, inserts, update, \
+				lambda (id, last_contact, rtt): (last_contact, rtt, id))
+		invalidate_host_details(latest.keys())
+		transaction.set_dirty()
@@ -0,0 +1,309 @@
+"""
+Round trip time history in RRD files, one file per interface.
+
+RrdService forks rrdtool for every update. RrdCachedWriter sends the
+updates to rrdcached instead, many at a time over one connection. The
+files are then behind until rrdcached writes them, so with rrdcached
+graphs are rendered through it (rrdtool graph --daemon) and the files
+are flushed before their modification time is compared to a graph.
+"""
+
+import os
+import socket
+import subprocess
+import sys
+import time
+
+RRD_DS = "rtt"
+
+RRD_DEFINITION = "-s 300 " \
+		"DS:%s:GAUGE:600:U:U "\
+		"RRA:AVERAGE:0.5:1:576 "\
+		"RRA:AVERAGE:0.5:6:336 "\
+		"RRA:AVERAGE:0.5:72:124 "\
+		"RRA:AVERAGE:0.5:288:365" % RRD_DS
+
+RRD_CREATE = "%s " + RRD_DEFINITION
+
+RRD_UPDATE = "%s --template " + RRD_DS + " N:%s"
+
+RRD_GRAPH = ["-w", "785", "-h", "120", "-a", "PNG",
+		"--slope-mode",
+		"--start", "-86400", "--end", "now",
+		"--font", "DEFAULT:7:",
+		"--watermark", "NEUF.NO",
+		"--vertical-label", "latency(ms)",
+		"--right-axis-label", "latency(ms)",
+		"--lower-limit", "0",
+		"--right-axis", "1:0",
+		"--x-grid", "MINUTE:10:HOUR:1:MINUTE:120:0:%R",
+		"--alt-y-grid", "--rigid"]
+
+RRDTOOL = "/usr/bin/rrdtool"
+
+def rrd_filename(rrd_dir, target):
+	return "%s/%s_%s.rrd" % (rrd_dir, target.host_id, target.interface_id)
+
+def png_filename(graph_dir, target):
+	return "%s/%s_%s.png" % (graph_dir, target.host_id, target.interface_id)
+
+def graph_title(target):
+	return "%s (%s/%s)" % (target.hostname, target.interface_name, \
+		target.address)
+
+def flush_rrds(rrdcached, rrds):
+	""" Makes rrdcached write its pending updates of the files rrds, so
+	their modification times can be trusted. Returns the set of files
+	that are up to date, empty if rrdcached can not be reached. """
+	flushed = set()
+	try:
+		client = RrdCachedClient(rrdcached)
+	except socket.error:
+		return flushed
+	try:
+		for rrd in rrds:
+			try:
+				client.command("FLUSH %s" % rrd)
+				flushed.add(rrd)
+			except RrdCachedError, e:
+				# files without pending updates are not in its cache
+				if "No such file" in str(e):
+					flushed.add(rrd)
+	except socket.error:
+		pass
+	finally:
+		client.close()
+	return flushed
+
+def graph_is_current(rrd, png, rrdcached = None):
+	""" True if png was rendered after the last change to rrd. With the
+	address of rrdcached, its pending updates of rrd count as changes. """
+	if rrdcached is not None and rrd not in flush_rrds(rrdcached, [rrd]):
+		return False
+	try:
+		return os.stat(png).st_mtime >= os.stat(rrd).st_mtime
+	except OSError:
+		return False
+
+def render_graph(job):
+	""" Renders the graph of an RRD file to a PNG, replacing the old
+	PNG only once the new one is complete. job is a (rrd, png, title,
+	rrdcached) tuple, so this can be used with a multiprocessing pool.
+	rrdcached is its address or None. Returns (png, success). """
+	rrd, png, title, rrdcached = job
+	tmp = "%s.%d.tmp" % (png, os.getpid())
+	daemon = []
+	if rrdcached is not None:
+		daemon = ["--daemon", rrdcached]
+	devnull = open(os.devnull, "w")
+	try:
+		status = subprocess.call([RRDTOOL, "graph", tmp] + RRD_GRAPH + daemon + \
+			["--title", title,
+			"DEF:roundtrip=%s:%s:AVERAGE" % (rrd, RRD_DS),
+			"LINE1:roundtrip#0000FF:latency(ms)"], \
+			stdout = devnull, stderr = devnull)
+	except OSError:
+		status = -1
+	finally:
+		devnull.close()
+	if status != 0:
+		if os.path.exists(tmp):
+			os.unlink(tmp)
+		return png, False
+	os.rename(tmp, png)
+	return png, True
+
+class RrdService():
+	def __init__(self, rrd_dir, debug = False):
+		self.rrd_dir = rrd_dir
+		self.debug = debug
+		self.known = set()
+
+	def log(self, target, avg_ping):
+		rrd = self.get_rrd(target)
+		self.update_rrd(rrd, avg_ping)
+
+	def get_rrd(self, target):
+		return rrd_filename(self.rrd_dir, target)
+
+	def update_rrd(self, rrd, avg_ping):
+		self.create_rrd(rrd)
+
+		self.rrd_exec("update", RRD_UPDATE % (rrd, avg_ping))
+
+	def create_rrd(self, rrd):
+		if rrd in self.known or os.path.isfile(rrd):
+			self.known.add(rrd)
+			return True
+		if self.debug:
+			print "Creating rrd: " + rrd
+		if not self.rrd_exec("create", RRD_CREATE % rrd):
+			if self.debug:
+				print "Could not create RRD database."
+			return False
+		self.known.add(rrd)
+		return True
+
+	def rrd_exec(self, function, rrd_cmd):
+		cmd = "%s %s %s" % (RRDTOOL, function, rrd_cmd)
+		if self.debug:
+			print "RRD_EXEC (%s)" % cmd
+		if os.system(cmd) != 0:
+			return False
+		else:
+			return True
+
+class RrdCachedError(Exception):
+	pass
+
+class RrdCachedClient(object):
+	""" Speaks the rrdcached protocol. address is either a path to a
+	unix socket (optionally prefixed with unix:) or host:port. """
+
+	def __init__(self, address, timeout = 30):
+		if address.startswith("unix:"):
+			address = address[5:]
+		if address.startswith("/"):
+			self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+			self.sock.settimeout(timeout)
+			self.sock.connect(address)
+		else:
+			host, port = address.rsplit(":", 1)
+			self.sock = socket.create_connection((host, int(port)), timeout)
+		self.stream = self.sock.makefile("rb")
+
+	def close(self):
+		try:
+			self.sock.sendall("QUIT\n")
+		except socket.error:
+			pass
+		self.stream.close()
+		self.sock.close()
+
+	def read_response(self):
+		""" Returns (status, message, lines). A negative status is an
+		error, a positive status is the number of lines that follow. """
+		line = self.stream.readline()
+		if not line:
+			raise RrdCachedError("connection closed by rrdcached")
+		status, message = line.rstrip("\n").split(" ", 1)
+		status = int(status)
+		lines = []
+		for i in xrange(max(status, 0)):
+			lines.append(self.stream.readline().rstrip("\n"))
+		return status, message, lines
+
+	def command(self, line):
+		self.sock.sendall(line + "\n")
+		status, message, lines = self.read_response()
+		if status < 0:
+			raise RrdCachedError(message)
+		return message, lines
+
+	def batch(self, commands):
+		""" Sends commands in one batch. Returns a dict of the index of
+		each failed command to its error message. """
+		if not commands:
+			return {}
+		self.sock.sendall("BATCH\n")
+		status, message, lines = self.read_response()
+		if status < 0:
+			raise RrdCachedError(message)
+		self.sock.sendall("".join([c + "\n" for c in commands]) + ".\n")
+		status, message, lines = self.read_response()
+		errors = {}
+		for line in lines:
+			number, error = line.split(" ", 1)
+			# rrdcached numbers the commands of a batch from 1
+			errors[int(number) - 1] = error
+		return errors
+
+class RrdCachedWriter(object):
+	""" Queues round trip times and sends them to rrdcached in batches
+	of batch_size values, or once flush_interval seconds have passed
+	since the last batch. Which RRD files exist is read from rrd_dir
+	once; missing files are created through rrdcached as well. When
+	rrdcached goes away, e.g. because it was restarted, the batch is
+	sent again over a new connection; if that fails too, the batch is
+	dropped and counted in errors. """
+
+	def __init__(self, address, rrd_dir, batch_size = 1000, \
+			flush_interval = 5.0, debug = False):
+		self.address = address
+		self.client = RrdCachedClient(address)
+		self.rrd_dir = rrd_dir
+		self.batch_size = batch_size
+		self.flush_interval = flush_interval
+		self.last_flush = time.time()
+		self.debug = debug
+		self.known = set()
+		if os.path.isdir(rrd_dir):
+			self.known = set([os.path.join(rrd_dir, f) \
+				for f in os.listdir(rrd_dir) if f.endswith(".rrd")])
+		self.updates = {}
+		self.pending = 0
+		self.errors = 0
+
+	def log(self, target, avg_ping, when = None):
+		if when is None:
+			when = time.time()
+		rrd = rrd_filename(self.rrd_dir, target)
+		self.updates.setdefault(rrd, []).append("%d:%s" % (when, avg_ping))
+		self.pending += 1
+		if self.pending >= self.batch_size:
+			self.flush()
+		else:
+			self.flush_if_due()
+
+	def flush_if_due(self):
+		""" Sends the waiting values if flush_interval has passed. """
+		if self.pending and time.time() - self.last_flush >= self.flush_interval:
+			self.flush()
+
+	def flush(self):
+		commands = []
+		created = {}
+		for rrd, values in self.updates.iteritems():
+			if rrd not in self.known:
+				created[len(commands)] = rrd
+				commands.append("CREATE %s -O %s" % (rrd, RRD_DEFINITION))
+			commands.append("UPDATE %s %s" % (rrd, " ".join(values)))
+		self.updates = {}
+		self.pending = 0
+		self.last_flush = time.time()
+
+		errors = self.send(commands)
+		if errors is None:
+			return
+		for index, error in errors.items():
+			# creating a file that is already there is fine
+			if index in created and "exists" in error:
+				continue
+			if index in created:
+				del created[index]
+			self.errors += 1
+			if self.debug:
+				print "rrdcached: %s: %s" % (commands[index], error)
+		self.known.update(created.values())
+
+	def send(self, commands):
+		""" Sends a batch, reconnecting once if that fails. Returns the
+		errors of the batch, or None if it was dropped. """
+		for attempt in (1, 2):
+			try:
+				if self.client is None:
+					self.client = RrdCachedClient(self.address)
+				return self.client.batch(commands)
+			except (socket.error, RrdCachedError), e:
+				if self.client is not None:
+					self.client.close()
+					self.client = None
+		self.errors += len(commands)
+		print >> sys.stderr, "rrdcached: dropped %d commands: %s" % \
+			(len(commands), e)
+		return None
+
+	def close(self):
+		self.flush()
+		if self.client is not None:
+			self.client.close()
@@ -0,0 +1,119 @@
+"""
+Keeps track of when each interface should be probed next.
+
+Reachable addresses are probed every interval seconds. Addresses that
+stay down are probed less and less often, up to max_interval, and an
+address that just went up or down is rechecked after recheck_interval
+to confirm the change. All intervals get some random jitter, so probes
+spread out over time instead of coming in bursts.
+"""
+
+import heapq
+import itertools
+import random
+
+class Target(object):
+	def __init__(self, probe_target):
+		self.probe_target = probe_target
+		self.interface_id = probe_target.interface_id
+		self.address = probe_target.address
+		self.up = None
+		self.failures = 0
+		self.version = 0
+
+class ProbeScheduler(object):
+	def __init__(self, interval = 300, recheck_interval = 30, \
+			max_interval = 3600, jitter = 0.1):
+		self.interval = interval
+		self.recheck_interval = recheck_interval
+		self.max_interval = max_interval
+		self.jitter = jitter
+		self.targets = {}
+		self.queue = []
+		self.order = itertools.count()
+
+	def __len__(self):
+		return len(self.targets)
+
+	def schedule(self, target, when):
+		# entries of removed or rescheduled targets are skipped when
+		# they come up, see due()
+		target.version += 1
+		heapq.heappush(self.queue, (when, self.order.next(), \
+			target.interface_id, target.version))
+
+	def update_inventory(self, probe_targets, now):
+		""" Brings the targets in line with a list of ProbeTargets. New
+		targets are spread out over one interval, targets whose address
+		changed are probed right away. Returns the number of targets
+		added, changed and removed. """
+		added = changed = 0
+		seen = set()
+		for probe_target in probe_targets:
+			seen.add(probe_target.interface_id)
+			target = self.targets.get(probe_target.interface_id)
+			if target is None:
+				target = Target(probe_target)
+				self.targets[target.interface_id] = target
+				self.schedule(target, now + random.uniform(0, self.interval))
+				added += 1
+			elif target.address != probe_target.address:
+				target.probe_target = probe_target
+				target.address = probe_target.address
+				target.up = None
+				target.failures = 0
+				self.schedule(target, now)
+				changed += 1
+			else:
+				# the hostname or interface name may have changed
+				target.probe_target = probe_target
+
+		removed = [id for id in self.targets if id not in seen]
+		for id in removed:
+			del self.targets[id]
+		return added, changed, len(removed)
+
+	def next_due(self):
+		""" When the next target is due, or None without targets. """
+		while self.queue:
+			when, n, interface_id, version = self.queue[0]
+			target = self.targets.get(interface_id)
+			if target is not None and target.version == version:
+				return when
+			heapq.heappop(self.queue)
+		return None
+
+	def due(self, now):
+		""" Removes and returns the targets that are due. They are
+		not scheduled again until completed() is called for them. """
+		targets = []
+		while self.queue and self.queue[0][0] <= now:
+			when, n, interface_id, version = heapq.heappop(self.queue)
+			target = self.targets.get(interface_id)
+			if target is not None and target.version == version:
+				targets.append(target)
+		return targets
+
+	def next_interval(self, target, up):
+		if target.up is not None and up != target.up:
+			return self.recheck_interval
+		if up:
+			return self.interval
+		return min(self.interval * 2 ** (target.failures - 1), \
+			self.max_interval)
+
+	def completed(self, target, up, now):
+		""" Schedules the next probe of a target that was probed.
+		Returns True if the target went up or down. """
+		if self.targets.get(target.interface_id) is not target:
+			return False
+		if up:
+			target.failures = 0
+		else:
+			target.failures += 1
+		interval = self.next_interval(target, up)
+		changed = target.up is not None and target.up != up
+		target.up = up
+		self.schedule(target, now + interval * \
+			random.uniform(1 - self.jitter, 1 + self.jitter))
+		return changed
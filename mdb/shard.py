@@ -0,0 +1,34 @@
+"""
+Splitting probe work between several prober processes or machines.
+
+This module does not use the database, so scripts can use parse_shard
+for their arguments before django is set up.
+"""
+
+import argparse
+import hashlib
+
+def shard_of(key, count):
+	""" Which of count shards a key belongs to. Uses rendezvous hashing:
+	when shards are added or removed, only the keys of those shards
+	move. """
+	best = None
+	for index in xrange(count):
+		weight = hashlib.md5("%d:%s" % (index, key)).digest()
+		if best is None or weight > best[0]:
+			best = (weight, index)
+	return best[1]
+
+def in_shard(key, index, count):
+	return shard_of(key, count) == index
+
+def parse_shard(value):
+	""" argparse type for --shard i/N, with 1 <= i <= N. Returns a
+	zero based (index, count) tuple. """
+	try:
+		index, count = [int(x) for x in value.split("/")]
+	except ValueError:
+		raise argparse.ArgumentTypeError("expected i/N, like 1/3")
+	if count < 1 or index < 1 or index > count:
+		raise argparse.ArgumentTypeError("expected 1 <= i <= N")
+	return index - 1, count
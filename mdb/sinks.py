@@ -0,0 +1,196 @@
+"""
+Outputs for probe results. A probe run hands every result to each of
+its sinks, so one pass can update the database, the RRD files and a log
+at the same time.
+
+The probe scripts wrap their sinks in a SinkThread. Round trip times are
+taken when a reply is read, so replies that wait in the socket while
+a sink writes a batch would come out slower than they were.
+"""
+
+from django.db import connection, reset_queries
+
+from mdb.history import HistoryWriter
+from mdb.results import DatabaseWriter
+from mdb.rrd import RrdService, RrdCachedWriter
+
+import Queue
+import json
+import sys
+import threading
+import time
+
+class Sink(object):
+	def put(self, target, result, when):
+		""" target is a ProbeTarget, result a ProbeResult and when
+		the datetime the probe finished. """
+		pass
+
+	def flush_if_due(self):
+		""" Called regularly by long running probes, so buffered
+		results do not wait for the next result to come in. """
+		pass
+
+	def close(self):
+		pass
+
+class DatabaseSink(Sink):
+	""" Updates last_contact and ping_avg_rtt of reachable addresses. """
+	def __init__(self, batch_size = 500, flush_interval = 5.0):
+		self.writer = DatabaseWriter(batch_size, flush_interval)
+
+	def put(self, target, result, when):
+		if result.avg_rtt() is not None:
+			self.writer.put(target.ip4address_id, when, result.avg_rtt())
+		else:
+			self.writer.flush_if_due()
+
+	def flush_if_due(self):
+		self.writer.flush_if_due()
+
+	def close(self):
+		self.writer.close()
+
+class HistorySink(DatabaseSink):
+	""" Adds the round trip time of reachable addresses to their history
+	in the database. """
+	def __init__(self, batch_size = 500, flush_interval = 5.0):
+		self.writer = HistoryWriter(batch_size, flush_interval)
+
+class RrdSink(Sink):
+	""" Adds the round trip time of reachable addresses to their RRD,
+	through rrdcached if its address is given. """
+	def __init__(self, rrd_dir, debug = False, rrdcached = None, \
+			batch_size = 1000, flush_interval = 5.0):
+		self.writer = None
+		if rrdcached is not None:
+			self.writer = RrdCachedWriter(rrdcached, rrd_dir, batch_size, \
+				flush_interval, debug)
+		else:
+			self.rrd_service = RrdService(rrd_dir, debug)
+
+	def put(self, target, result, when):
+		if result.avg_rtt() is None:
+			return
+		if self.writer is not None:
+			self.writer.log(target, result.avg_rtt(), \
+				time.mktime(when.timetuple()))
+		else:
+			self.rrd_service.log(target, result.avg_rtt())
+
+	def flush_if_due(self):
+		if self.writer is not None:
+			self.writer.flush_if_due()
+
+	def close(self):
+		if self.writer is not None:
+			self.writer.close()
+
+class TextSink(Sink):
+	""" Prints one line per result, for debugging. """
+	def __init__(self, stream = sys.stdout):
+		self.stream = stream
+
+	def put(self, target, result, when):
+		if result.avg_rtt() is None:
+			self.stream.write("%s (%s/%s) : fail   \n" % (target.hostname, \
+				target.interface_name, target.address))
+		else:
+			self.stream.write("%s (%s/%s) : %.3f\n" % (target.hostname, \
+				target.interface_name, target.address, result.avg_rtt()))
+
+class JsonSink(Sink):
+	""" Writes one JSON object per result and line, which makes a
+	simple time series when appended to a file. """
+	def __init__(self, stream = sys.stdout):
+		self.stream = stream
+
+	def put(self, target, result, when):
+		self.stream.write(json.dumps({
+			"time": time.mktime(when.timetuple()),
+			"host": target.hostname,
+			"interface": target.interface_name,
+			"address": target.address,
+			"sent": result.sent,
+			"received": result.received(),
+			"avg_rtt": result.avg_rtt(),
+		}, sort_keys = True) + "\n")
+
+	def close(self):
+		self.stream.flush()
+
+class SinkThread(Sink):
+	""" Hands the results to sinks in a thread of its own, so put()
+	returns at once. flush_if_due() of the sinks is called after every
+	result and every poll_interval seconds without one. An exception of a sink
+	stops the thread and is raised again by the next put() or close(). """
+	def __init__(self, sinks, poll_interval = 1.0):
+		self.sinks = sinks
+		self.poll_interval = poll_interval
+		self.queue = Queue.Queue()
+		self.error = None
+		self.thread = threading.Thread(target = self.run)
+		self.thread.setDaemon(True)
+		self.thread.start()
+
+	def run(self):
+		try:
+			while True:
+				try:
+					item = self.queue.get(timeout = self.poll_interval)
+				except Queue.Empty:
+					item = ()
+				if item is None:
+					break
+				for sink in self.sinks:
+					if item:
+						sink.put(*item)
+					sink.flush_if_due()
+				# the query log of this thread's connection
+				reset_queries()
+			for sink in self.sinks:
+				sink.close()
+		except Exception:
+			self.error = sys.exc_info()
+		finally:
+			# the database connection of this thread
+			connection.close()
+
+	def check(self):
+		if self.error is not None:
+			raise self.error[0], self.error[1], self.error[2]
+
+	def put(self, target, result, when):
+		self.check()
+		self.queue.put((target, result, when))
+
+	def close(self):
+		""" Waits until all results are handed to the sinks and the
+		sinks are closed. """
+		if self.thread.isAlive():
+			self.queue.put(None)
+			self.thread.join()
+		self.check()
+
+def create_sinks(args):
+	""" Creates the sinks named by --sink from the probe script
+	arguments. Debugging always prints the results. """
+	sinks = []
+	for name in args.sinks or ["db"]:
+		if name == "db":
+			sinks.append(DatabaseSink(args.batch_size, args.flush_interval))
+		elif name == "history":
+			sinks.append(HistorySink(args.batch_size, args.flush_interval))
+		elif name == "rrd":
+			sinks.append(RrdSink(args.rrd_path, args.debug, args.rrdcached, \
+				args.batch_size, args.flush_interval))
+		elif name == "json":
+			stream = sys.stdout
+			if args.json_file is not None:
+				stream = open(args.json_file, "a")
+			sinks.append(JsonSink(stream))
+		elif name == "text":
+			sinks.append(TextSink())
+	if args.debug and "text" not in (args.sinks or []):
+		sinks.append(TextSink())
+	return sinks
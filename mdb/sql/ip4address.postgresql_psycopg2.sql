@@ -0,0 +1,2 @@
+-- address is an inet column on PostgreSQL. See mdb.inet.
+CREATE INDEX mdb_ip4address_address_gist ON mdb_ip4address USING gist (address inet_ops);
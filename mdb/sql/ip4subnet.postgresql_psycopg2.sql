@@ -0,0 +1,6 @@
+-- The network of a subnet as cidr, from its network and dotted netmask.
+-- Must be immutable to be indexed, see mdb.inet.
+CREATE OR REPLACE FUNCTION mdb_ip4_cidr(inet, inet) RETURNS cidr AS
+	'SELECT set_masklen($1::cidr, 32 - round(log(2, (4294967296 - ($2 - ''0.0.0.0''::inet))::numeric))::integer)'
+	LANGUAGE SQL IMMUTABLE STRICT;
+CREATE INDEX mdb_ip4subnet_cidr_gist ON mdb_ip4subnet USING gist (mdb_ip4_cidr(network, netmask) inet_ops);
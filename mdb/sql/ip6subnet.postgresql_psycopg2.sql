@@ -0,0 +1,6 @@
+-- The network of a subnet as cidr, from its network without the
+-- trailing :: and its prefix length. See mdb.inet.
+CREATE OR REPLACE FUNCTION mdb_ip6_cidr(varchar, integer) RETURNS cidr AS
+	'SELECT set_masklen(($1 || ''::'')::cidr, $2)'
+	LANGUAGE SQL IMMUTABLE STRICT;
+CREATE INDEX mdb_ip6subnet_cidr_gist ON mdb_ip6subnet USING gist (mdb_ip6_cidr(network, netmask) inet_ops);
@@ -0,0 +1,83 @@
+"""
+Latency and reachability of the whole fleet, per host type and subnet.
+
+All addresses in use are fetched in one query and summarized with NumPy,
+so the summary is cheap enough to show on the overview page.
+"""
+
+from mdb.models import Interface
+
+import datetime
+
+PERCENTILES = (50, 90, 99)
+
+# (label, seconds) of the "not seen for" columns
+NOT_SEEN = (("1 hour", 3600), ("1 day", 86400), ("1 week", 7 * 86400))
+
+def fleet_summary(now = None, down_after = 900):
+	""" Returns a dict with down_after, a "total" summary and lists of summaries
+	"host_type" and "subnet", sorted by name. An address counts as down
+	if it has not answered for down_after seconds; loss is the share of
+	addresses that are down. The round trip time percentiles are over
+	the addresses that are up. The not seen counts include addresses
+	that were never seen. """
+	import numpy
+
+	if now is None:
+		now = datetime.datetime.now()
+	rows = Interface.objects.filter(ip4address__isnull = False).values_list( \
+		"host__host_type__host_type", "ip4address__subnet__name", \
+		"ip4address__reachability__last_contact", \
+		"ip4address__reachability__ping_avg_rtt")
+	if rows:
+		host_types, subnets, last_contact, rtt = zip(*rows)
+	else:
+		host_types, subnets, last_contact, rtt = (), (), (), ()
+
+	last_contact = numpy.array(last_contact, dtype = "datetime64[s]")
+	age = (numpy.datetime64(now, "s") - last_contact).astype("float64")
+	age[numpy.isnat(last_contact)] = numpy.inf
+	# None becomes NaN
+	rtt = numpy.array(rtt, dtype = "float64")
+	up = age <= down_after
+	rtt[~up] = numpy.nan
+
+	def summarize(name, index):
+		""" The summary of the addresses at index. """
+		group_age = age[index]
+		group_up = up[index]
+		total = len(index)
+		count_up = int(group_up.sum())
+		summary = {
+			"name": name,
+			"addresses": total,
+			"up": count_up,
+			"loss": total and float(total - count_up) / total or 0.0,
+			"never_seen": int(numpy.isinf(group_age).sum()),
+			"not_seen": [(label, int((group_age > seconds).sum())) \
+				for label, seconds in NOT_SEEN],
+		}
+		summary["rtt"] = [(p, None) for p in PERCENTILES]
+		if count_up:
+			values = numpy.nanpercentile(rtt[index][group_up], PERCENTILES)
+			summary["rtt"] = [(p, float(v)) \
+				for p, v in zip(PERCENTILES, values)]
+		return summary
+
+	def by(keys):
+		names, groups = numpy.unique(numpy.array(keys, dtype = object), \
+			return_inverse = True)
+		# the addresses of each group are next to each other in order
+		order = numpy.argsort(groups, kind = "mergesort")
+		sizes = numpy.bincount(groups, minlength = len(names))
+		ends = numpy.cumsum(sizes)
+		starts = ends - sizes
+		return [summarize(name, order[start:end]) \
+			for name, start, end in zip(names, starts, ends)]
+
+	return {
+		"down_after": down_after,
+		"total": summarize("all", numpy.arange(len(age))),
+		"host_type": by(host_types),
+		"subnet": by(subnets),
+	}
@@ -0,0 +1,534 @@
+"""
+Publishing of zone files and dhcp configurations, shared by
+zone_synchronizer.py, dhcp_synchronizer.py and sync_daemon.py.
+
+Objects whose serial differs from their active serial are dirty. The
+model signals add every object that becomes dirty to the SyncJournal,
+so sync_daemon.py only has to look at new journal entries to know what
+to publish.
+"""
+
+from django.core.mail import mail_admins
+from django.db.models import F, Max
+
+from mdb.models import *
+from mdb.dhcp import config_digest, host_changes, shard_contents, read_shard
+from mdb.omapi import OmapiClient, OmapiError
+from mdb.kea import KeaControl, KeaError, read_config
+from mdb.metrics import Metrics
+
+from commands import getstatusoutput
+import json
+import os
+import sys
+
+# kind in the journal: (model, serial field, active serial field)
+ZONE_KINDS = {
+	"domain": (Domain, "domain_serial", "domain_active_serial"),
+	"ip4subnet": (Ip4Subnet, "domain_serial", "domain_active_serial"),
+	"ip6subnet": (Ip6Subnet, "domain_serial", "domain_active_serial"),
+}
+
+ZONE_ORDER = ("domain", "ip4subnet", "ip6subnet")
+
+def dirty_zones(keys = None):
+	""" (kind, zone) of every zone whose serial is not active, one query
+	per kind. keys is a set of (kind, id) to limit the zones to, as
+	found in the journal. """
+	zones = []
+	for kind in ZONE_ORDER:
+		model, serial, active = ZONE_KINDS[kind]
+		queryset = model.objects.exclude(**{serial: F(active)})
+		if keys is not None:
+			ids = [id for k, id in keys if k == kind]
+			if not ids:
+				continue
+			queryset = queryset.filter(id__in = ids)
+		zones.extend([(kind, zone) for zone in queryset.order_by("id")])
+	return zones
+
+def set_active_serial(kind, zone, serial):
+	""" Marks serial as published. This is an update rather than a save,
+	saving a subnet would bump its serial again. """
+	model, serial_field, active = ZONE_KINDS[kind]
+	model.objects.filter(id = zone.id).update(**{active: serial})
+	setattr(zone, active, serial)
+
+class ZoneSync(object):
+	""" Validates zone files with named-checkzone, writes them to their
+	domain_filename and reloads bind once if any zone was written. With
+	a Publisher, the zone files are published to its targets instead,
+	named after the last part of their domain_filename. """
+
+	def __init__(self, bind_init = "/etc/init.d/bind9 %s", \
+			zone_check_command = "/usr/sbin/named-checkzone %s %s", \
+			zone_check_temp_dir = "/tmp/zonecheck", \
+			error_log_file = "/tmp/zonecheck/zonecheck-fail-%s-%s", \
+			debugging = False, output = sys.stdout, publisher = None, \
+			metrics = None):
+		self.bind_init = bind_init
+		self.zone_check_command = zone_check_command
+		self.zone_check_temp_dir = zone_check_temp_dir
+		self.zone_check_temp_file = os.path.join(zone_check_temp_dir, "zone")
+		self.error_log_file = error_log_file
+		self.debugging = debugging
+		self.output = output
+		self.publisher = publisher
+		self.staged = []
+		self.metrics = metrics or Metrics("zone_sync")
+
+	def check_zone(self, zone, filename):
+		status, output = getstatusoutput(self.zone_check_command % \
+			(zone, filename))
+		if self.debugging and status != 0:
+			self.output.write(output + "\n")
+		return status, output
+
+	def write(self, filename, content):
+		if isinstance(content, unicode):
+			content = content.encode("utf-8")
+		f = open(filename, "w")
+		f.write(content)
+		f.close()
+
+	def publish(self, kind, zone):
+		""" Validates and writes one zone. Returns True if it was
+		written. """
+		self.output.write("updating %s %s [%d -> %d]\n" % \
+			(kind == "domain" and "domain" or "subnet", zone.domain_name, \
+			zone.domain_active_serial, zone.domain_serial))
+		serial = zone.domain_serial
+		with self.metrics.stage("render", zone = zone.domain_name):
+			content = zone.zone_file_contents()
+
+		self.output.write("\t- validating...")
+		with self.metrics.stage("validate", zone = zone.domain_name):
+			if not os.path.isdir(self.zone_check_temp_dir):
+				os.mkdir(self.zone_check_temp_dir)
+			self.write(self.zone_check_temp_file, content)
+			status, output = self.check_zone(zone.domain_name, \
+				self.zone_check_temp_file)
+		if status != 0:
+			self.output.write("fail\n")
+			self.write(self.error_log_file % (zone.domain_name, serial), \
+				content)
+			self.metrics.count("zones_invalid")
+			return False
+		self.output.write("ok\n")
+
+		if self.publisher is not None:
+			self.staged.append((kind, zone, serial, content))
+			return True
+
+		self.output.write("\t- writing zone file...")
+		with self.metrics.stage("write", zone = zone.domain_name):
+			self.write(zone.domain_filename, content)
+			if not self.debugging:
+				set_active_serial(kind, zone, serial)
+		self.output.write("ok\n")
+		self.metrics.count("zones_written")
+		return True
+
+	def reload(self):
+		self.output.write("restarting bind...")
+		with self.metrics.stage("reload"):
+			status, output = getstatusoutput(self.bind_init % "reload")
+		if status != 0:
+			self.output.write("fail\n")
+			mail_admins("Failed to reload bind", \
+				"Failed to reload bind, plase inspect...\n\n" + output)
+			return False
+		self.output.write("ok\n")
+		mail_admins("Successfully updated bind zone files", \
+			"Bind zone files has been updated")
+		return True
+
+	def publish_staged(self):
+		""" Publishes the validated zones to the targets of publisher.
+		The zones stay dirty unless every target got them. """
+		staged, self.staged = self.staged, []
+		if not staged:
+			return 0
+		self.output.write("publishing %d zones to %d targets..." % \
+			(len(staged), len(self.publisher.targets)))
+		with self.metrics.stage("publish"):
+			results = self.publisher.publish([(os.path.basename( \
+				zone.domain_filename), content) \
+				for kind, zone, serial, content in staged])
+		failed = dict([(name, error) for name, error in results.items() \
+			if error is not None])
+		self.metrics.count("targets_failed", len(failed))
+		if failed:
+			self.output.write("fail\n")
+			mail_admins("Failed to publish zone files", \
+				"Failed to publish zone files, please inspect...\n\n" + \
+				"\n".join(["%s: %s" % item for item in sorted(failed.items())]))
+			return 0
+		self.output.write("ok\n")
+		if not self.debugging:
+			for kind, zone, serial, content in staged:
+				set_active_serial(kind, zone, serial)
+		self.metrics.count("zones_written", len(staged))
+		return len(staged)
+
+	def sync(self, zones):
+		""" Publishes (kind, zone) pairs and reloads bind if any of them
+		was written. Returns the number of zones written. """
+		written = 0
+		for kind, zone in zones:
+			if self.publish(kind, zone):
+				written += 1
+		if self.publisher is not None:
+			return self.publish_staged()
+		if written and not self.debugging:
+			self.reload()
+		return written
+
+class DhcpSync(object):
+	""" Writes the configuration of a DhcpConfig for dhcpd or kea and
+	makes the server load it. See dhcp_synchronizer.py for the
+	settings. With a Publisher, the complete dhcpd configuration is
+	published to its targets instead, named like dhcpd_config, and
+	each target restarts its dhcpd with its reload command. It is
+	checked with dhcpd_check_command first, written to
+	dhcpd_check_temp_file, and not published if the check fails.
+
+	dhcpd keeps the hosts added and deleted through OMAPI in its leases
+	file and applies them over dhcpd.conf on every start. The names of
+	those hosts are kept in dhcpd_config + ".omapi", and after a restart
+	they are set to what dhcpd.conf says again. """
+
+	def __init__(self, dhcpd_init = "/etc/init.d/dhcp3-server %s", \
+			dhcpd_config = "/etc/dhcp3/dhcpd.conf", dhcpd_include_dir = None, \
+			dhcp_server = "dhcpd", kea_config = "/etc/kea/kea-dhcp4.conf", \
+			kea_control_socket = "/tmp/kea4-ctrl-socket", \
+			omapi_host = "127.0.0.1", omapi_port = 7911, \
+			omapi_key_name = None, omapi_key = None, debugging = False, \
+			publisher = None, metrics = None, \
+			dhcpd_check_command = "/usr/sbin/dhcpd -t -cf %s", \
+			dhcpd_check_temp_file = "/tmp/dhcpd-check.conf"):
+		self.dhcpd_init = dhcpd_init
+		self.dhcpd_config = dhcpd_config
+		self.dhcpd_include_dir = dhcpd_include_dir
+		self.dhcp_server = dhcp_server
+		self.kea_config = kea_config
+		self.kea_control_socket = kea_control_socket
+		self.omapi_host = omapi_host
+		self.omapi_port = omapi_port
+		self.omapi_key_name = omapi_key_name
+		self.omapi_key = omapi_key
+		self.debugging = debugging
+		self.publisher = publisher
+		self.metrics = metrics or Metrics("dhcp_sync")
+		self.dhcpd_check_command = dhcpd_check_command
+		self.dhcpd_check_temp_file = dhcpd_check_temp_file
+		self.omapi_hosts_file = dhcpd_config + ".omapi"
+
+	def omapi_client(self):
+		return OmapiClient(self.omapi_host, self.omapi_port, \
+			self.omapi_key_name, self.omapi_key)
+
+	def add_omapi_host(self, omapi, interface):
+		statements = None
+		if len(interface.pxe_filename) > 0:
+			statements = "filename \"%s\";" % interface.pxe_filename
+		omapi.add_host(interface.host.hostname, interface.macaddr, \
+			interface.ip4address.address, statements)
+
+	def omapi_hosts(self):
+		""" The names of the hosts ever changed through OMAPI. """
+		content = self.read_file(self.omapi_hosts_file)
+		if content is None:
+			return set()
+		return set(content.split())
+
+	def remember_omapi_hosts(self, names):
+		names = self.omapi_hosts() | set(names)
+		self.write_file(self.omapi_hosts_file, \
+			"".join([name + "\n" for name in sorted(names)]))
+
+	def push_host_changes(self, entries, removed, added):
+		""" Apply host changes to the running dhcpd. Returns False if
+		dhcpd could not be updated and has to be restarted. """
+		if self.omapi_port is None:
+			return False
+
+		interfaces = {}
+		for subnet, options, custom_fields, subnet_interfaces in entries:
+			for interface in subnet_interfaces:
+				interfaces[interface.host.hostname] = interface
+
+		# remembered first, a failure halfway may have changed some
+		self.remember_omapi_hosts(list(removed) + list(added))
+		try:
+			omapi = self.omapi_client()
+			try:
+				for name in removed:
+					omapi.del_host(name)
+				for name in added:
+					self.add_omapi_host(omapi, interfaces[name])
+			finally:
+				omapi.close()
+		except (OmapiError, IOError), e:
+			if self.debugging:
+				print "omapi update failed: %s" % e
+			return False
+		return True
+
+	def restore_omapi_hosts(self, config):
+		""" Sets the hosts ever changed through OMAPI to what dhcpd.conf
+		says, after a restart brought back their state from the leases
+		file. Returns False if dhcpd could not be updated. """
+		names = self.omapi_hosts()
+		if self.omapi_port is None or not names:
+			return True
+		interfaces = {}
+		for subnet, options, custom_fields, subnet_interfaces in \
+				config.dhcp_subnet_entries():
+			for interface in subnet_interfaces:
+				interfaces[interface.host.hostname] = interface
+		try:
+			omapi = self.omapi_client()
+			try:
+				for name in sorted(names):
+					omapi.del_host(name)
+					if name in interfaces:
+						self.add_omapi_host(omapi, interfaces[name])
+			finally:
+				omapi.close()
+		except (OmapiError, IOError), e:
+			mail_admins("Failed to restore dhcpd hosts", \
+				"dhcpd was restarted, but the hosts changed through OMAPI " \
+				"before could not be set to the configuration again, " \
+				"please inspect...\n\n%s" % e)
+			return False
+		return True
+
+	def read_file(self, filename):
+		if not os.path.isfile(filename):
+			return None
+		return open(filename).read()
+
+	def write_file(self, filename, content):
+		f = open(filename, "w")
+		f.write(content)
+		f.close()
+
+	def sync_configuration(self, config):
+		""" Writes the complete configuration to dhcpd_config. Returns
+		(entries, changes) where changes is None if dhcpd must be
+		restarted, and ([], []) if nothing changed at all. """
+		with self.metrics.stage("render"):
+			entries = config.dhcp_subnet_entries()
+			content = config.dhcpd_configuration(entries)
+
+		with self.metrics.stage("compare"):
+			live = self.read_file(self.dhcpd_config)
+			if live is not None and \
+					config_digest(live) == config_digest(content):
+				# the serial moved, but dhcpd would not see any difference
+				return entries, ([], [])
+
+			changes = None
+			if live is not None:
+				changes = host_changes(live, content)
+
+		with self.metrics.stage("write"):
+			self.write_file(self.dhcpd_config, content)
+		return entries, changes
+
+	def sync_shards(self, config):
+		""" Writes a main configuration to dhcpd_config including one
+		file per subnet, and regenerates the include files of subnets
+		whose serial changed. Returns (entries, changes) like
+		sync_configuration. """
+		include_dir = self.dhcpd_include_dir
+		subnets = list(config.ip4subnet_set.all())
+		if not os.path.isdir(include_dir):
+			os.makedirs(include_dir)
+
+		removed = set()
+		added = set()
+		reload_dhcpd = False
+
+		content = config.dhcpd_main_configuration(subnets, include_dir)
+		live = self.read_file(self.dhcpd_config)
+		if live is None or config_digest(live) != config_digest(content):
+			self.write_file(self.dhcpd_config, content)
+			reload_dhcpd = True
+
+		filenames = set([subnet.dhcpd_include_filename() for subnet in subnets])
+		for filename in os.listdir(include_dir):
+			if filename.startswith("subnet-") and filename not in filenames:
+				os.unlink(os.path.join(include_dir, filename))
+
+		shards = {}
+		stale = []
+		for subnet in subnets:
+			filename = os.path.join(include_dir, subnet.dhcpd_include_filename())
+			shards[subnet.id] = read_shard(filename)
+			if shards[subnet.id] is None or \
+					shards[subnet.id][0] != str(subnet.domain_serial) or \
+					self.debugging:
+				stale.append(subnet)
+
+		entries = config.dhcp_subnet_entries(stale)
+		for subnet, options, custom_fields, interfaces in entries:
+			if self.debugging:
+				print "regenerating %s" % subnet.dhcpd_include_filename()
+			body = config.dhcpd_subnet_shard(subnet, options, custom_fields, \
+				interfaces)
+			self.write_file(os.path.join(include_dir, \
+				subnet.dhcpd_include_filename()), \
+				shard_contents(subnet.domain_serial, body))
+
+			old = shards[subnet.id]
+			if old is not None and old[1] == config_digest(body):
+				continue
+			changes = None
+			if old is not None:
+				changes = host_changes(old[2], body)
+			if changes is None:
+				reload_dhcpd = True
+			else:
+				removed.update(changes[0])
+				added.update(changes[1])
+
+		if reload_dhcpd:
+			return entries, None
+		return entries, (sorted(removed), sorted(added))
+
+	def sync_kea(self, config):
+		""" Writes the kea configuration and makes kea reload it. Without
+		kea_config, the configuration is pushed with config-set only.
+		Comments in kea_config are dropped when it is rewritten. """
+		kea = KeaControl(self.kea_control_socket)
+		try:
+			if self.kea_config is None:
+				live = kea.config_get()
+			elif os.path.isfile(self.kea_config):
+				live = read_config(self.kea_config)
+			else:
+				live = None
+
+			content = config.kea_configuration(base = live)
+			if content == live:
+				return True
+
+			if self.kea_config is None:
+				kea.config_set(content)
+			else:
+				self.write_file(self.kea_config + ".new", json.dumps(content, \
+					indent = 4, sort_keys = True))
+				os.rename(self.kea_config + ".new", self.kea_config)
+				kea.config_reload()
+		except KeaError, e:
+			mail_admins("Failed to reload kea configuration", \
+				"Failed to reload kea configuration, please inspect...\n\n%s" % e)
+			return False
+		return True
+
+	def check_configuration(self, content):
+		""" Runs dhcpd_check_command on content. Returns (status,
+		output), like check_zone of ZoneSync. """
+		self.write_file(self.dhcpd_check_temp_file, content)
+		try:
+			return getstatusoutput(self.dhcpd_check_command % \
+				self.dhcpd_check_temp_file)
+		finally:
+			os.unlink(self.dhcpd_check_temp_file)
+
+	def set_active_serial(self, config, serial):
+		# an update like set_active_serial, so no signals are sent
+		DhcpConfig.objects.filter(id = config.id).update(active_serial = serial)
+		config.active_serial = serial
+
+	def sync(self, config):
+		""" Publishes config if its serial is not active. Returns False
+		if the dhcp server could not be updated. """
+		if config.serial == config.active_serial and not self.debugging:
+			return True
+		serial = config.serial
+
+		if self.publisher is not None:
+			with self.metrics.stage("render"):
+				content = config.dhcpd_configuration()
+			# every target would restart its dhcpd with it
+			with self.metrics.stage("validate"):
+				status, output = self.check_configuration(content)
+			if status != 0:
+				mail_admins("Invalid dhcpd configuration", \
+					"The dhcpd configuration with serial %d failed the check " \
+					"and was not published, please inspect...\n\n%s" % \
+					(serial, output))
+				return False
+			with self.metrics.stage("publish"):
+				results = self.publisher.publish([(os.path.basename( \
+					self.dhcpd_config), content)])
+			failed = dict([(name, error) for name, error in results.items() \
+				if error is not None])
+			if failed:
+				mail_admins("Failed to publish dhcpd configuration", \
+					"Failed to publish dhcpd configuration, please inspect...\n\n" + \
+					"\n".join(["%s: %s" % item for item in sorted(failed.items())]))
+				return False
+			self.set_active_serial(config, serial)
+			return True
+
+		if self.dhcp_server == "kea":
+			with self.metrics.stage("kea"):
+				success = self.sync_kea(config)
+			if not success:
+				return False
+			self.set_active_serial(config, serial)
+			return True
+
+		if self.dhcpd_include_dir is None:
+			entries, changes = self.sync_configuration(config)
+		else:
+			with self.metrics.stage("shards"):
+				entries, changes = self.sync_shards(config)
+
+		self.set_active_serial(config, serial)
+
+		if changes == ([], []):
+			return True
+
+		pushed = False
+		if changes is not None:
+			with self.metrics.stage("omapi"):
+				pushed = self.push_host_changes(entries, *changes)
+		if pushed:
+			removed, added = changes
+			mail_admins("Update dhcpd configuration success!", \
+				"Updated dhcpd configuration to serial %d without restart " \
+				"(%d hosts removed, %d hosts added)." % \
+				(serial, len(removed), len(added)))
+			return True
+
+		with self.metrics.stage("reload"):
+			status, output = getstatusoutput(self.dhcpd_init % "restart")
+		if status != 0:
+			mail_admins("Failed to restart dhcp3-server", \
+				"Failed to restart dhcp3-server, plase inspect...\n\n" + output)
+			return False
+		mail_admins("Update dhcpd configuration success!", \
+			"Updated dhcpd configuration to serial %d." % serial)
+		with self.metrics.stage("omapi"):
+			return self.restore_omapi_hosts(config)
+
+def journal_entries(after = 0):
+	""" (id, kind, object id) of the journal entries after id after. """
+	return list(SyncJournal.objects.filter(id__gt = after).order_by("id") \
+		.values_list("id", "kind", "object_id"))
+
+def last_journal_id():
+	""" The id of the newest journal entry, 0 without entries. The
+	synchronizers run from cron publish everything dirty and then
+	forget the journal up to it, so it does not grow without the
+	daemon reading it. """
+	return SyncJournal.objects.aggregate(last = Max("id"))["last"] or 0
+
+def forget_journal(last_id):
+	""" Removes the journal entries up to last_id, once published. """
+	SyncJournal.objects.filter(id__lte = last_id).delete()
@@ -0,0 +1,38 @@
+"""
+The list of addresses to probe.
+"""
+
+from mdb.models import Interface
+from mdb.shard import in_shard
+
+import collections
+
+ProbeTarget = collections.namedtuple("ProbeTarget", ["host_id", "hostname", \
+	"interface_id", "interface_name", "ip4address_id", "address"])
+
+TARGET_FIELDS = ("host", "host__hostname", "id", "name", "ip4address", \
+	"ip4address__address")
+
+def probe_targets(host_type = None, shard = None):
+	""" All interfaces with an IPv4 address, fetched in one query. If
+	host_type is given, only hosts of that type. shard is an (index,
+	count) tuple, see in_shard. """
+	interfaces = Interface.objects.filter(ip4address__isnull = False)
+	if host_type is not None:
+		interfaces = interfaces.filter(host__host_type__host_type = host_type)
+	rows = interfaces.order_by("host__hostname", "name").values_list( \
+		*TARGET_FIELDS)
+
+	targets = [ProbeTarget(*row) for row in rows]
+	if shard is not None:
+		targets = [t for t in targets if in_shard(t.address, *shard)]
+	return targets
+
+def probe_target(interface_id):
+	""" The ProbeTarget of one interface, or None if it does not exist
+	or has no IPv4 address. """
+	rows = Interface.objects.filter(id = interface_id, \
+		ip4address__isnull = False).values_list(*TARGET_FIELDS)
+	if not rows:
+		return None
+	return ProbeTarget(*rows[0])
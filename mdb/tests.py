@@ -5,7 +5,42 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
+import SocketServer
+import StringIO
+import argparse
+import base64
+import calendar
+import datetime
+import errno
+import json
+import os
+import re
+import shutil
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models import F
+from django.forms.models import modelform_factory
 from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import unittest
+
+from mdb.models import *
+from mdb import benchmark, dhcp, graphs, history, inet, kea, metrics, omapi, \
+	probe, profiling, publish, results, rrd, scheduler, shard, sinks, summary, \
+	sync
+from mdb import leases as leases_module
+from mdb import targets as targets_module
 
 
 class SimpleTest(TestCase):
@@ -14,3 +49,1713 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+def create_inventory():
+	""" Build a small inventory with two dhcp subnets, a domain and
+	a couple of hosts. Returns the dhcp config. """
+	config = DhcpConfig.objects.create(serial = 1, active_serial = 0, \
+		name = "default", authoritative = True, \
+		ddns_update_style = "none", log_facility = "local7")
+	domain = Domain.objects.create(domain_name = "example.com", \
+		domain_soa = "ns.example.com", domain_admin = "admin@example.com", \
+		domain_ipaddr = "10.0.0.1", domain_filename = "/tmp/example.com")
+	arch = OsArchitecture.objects.create(architecture = "amd64")
+	operating_system = OperatingSystem.objects.create(name = "Debian", version = "6.0", \
+		architecture = arch)
+	host_type = HostType.objects.create(host_type = "server", \
+		description = "Servers")
+
+	subnets = []
+	for network, name in (("10.0.0.0", "servers"), ("10.0.1.0", "clients")):
+		subnet = Ip4Subnet(name = name, network = network, \
+			netmask = "255.255.255.248", domain_soa = "ns.example.com", \
+			domain_admin = "admin@example.com", \
+			domain_filename = "/tmp/%s" % name, dhcp_config = config)
+		subnet.save()
+		subnets.append(subnet)
+
+	DhcpOption.objects.create(key = "routers", value = "10.0.0.1", \
+		ip4subnet = subnets[0])
+	DhcpOption.objects.create(key = "domain-name", value = "\"example.com\"", \
+		ip4subnet = subnets[0])
+	DhcpCustomField.objects.create(value = "next-server 10.0.0.2", \
+		ip4subnet = subnets[0])
+	subnets[1].dhcp_dynamic = True
+	subnets[1].dhcp_dynamic_start = "10.0.1.4"
+	subnets[1].dhcp_dynamic_end = "10.0.1.6"
+	subnets[1].save()
+
+	hosts = (("alpha", subnets[0], "10.0.0.3", True, "pxelinux.0"),
+		("beta", subnets[0], "10.0.0.2", True, ""),
+		("gamma", subnets[0], "10.0.0.4", False, ""),
+		("delta", subnets[1], "10.0.1.2", True, ""))
+	for i, (hostname, subnet, address, dhcp_client, pxe) in enumerate(hosts):
+		host = Host.objects.create(hostname = hostname, host_type = host_type, \
+			operating_system = operating_system)
+		Interface.objects.create(name = "eth0", \
+			macaddr = "00:11:22:33:44:%02x" % i, pxe_filename = pxe, \
+			dhcp_client = dhcp_client, host = host, domain = domain, \
+			ip4address = subnet.ip4address_set.get(address = address))
+
+	return DhcpConfig.objects.get(id = config.id)
+
+DHCPD_CONFIGURATION = """authoritative;
+default-lease-time 600;
+max-lease-time 7200;
+log-facility local7;
+ddns-update-style none;
+
+# servers
+subnet 10.0.0.0 netmask 255.255.255.248 {
+	option routers 10.0.0.1;
+	option domain-name "example.com";
+	next-server 10.0.0.2;
+}
+
+# clients
+subnet 10.0.1.0 netmask 255.255.255.248 {
+	range 10.0.1.4 10.0.1.6;
+}
+
+host beta {
+	hardware ethernet 00:11:22:33:44:01;
+	fixed-address beta.example.com;
+}
+
+host alpha {
+	hardware ethernet 00:11:22:33:44:00;
+	fixed-address alpha.example.com;
+	filename "pxelinux.0";
+}
+
+host delta {
+	hardware ethernet 00:11:22:33:44:03;
+	fixed-address delta.example.com;
+}
+"""
+
+class DhcpConfigTest(TestCase):
+	def setUp(self):
+		self.config = create_inventory()
+
+	def test_dhcpd_configuration(self):
+		content = self.config.dhcpd_configuration()
+		self.assertTrue(content.startswith("# Autogenerated configuration "))
+		self.assertEqual(content.split("\n", 1)[1], DHCPD_CONFIGURATION)
+
+	def test_dhcpd_configuration_num_queries(self):
+		self.assertNumQueries(4, self.config.dhcpd_configuration)
+
+
+class OmapiStandInHandler(SocketServer.StreamRequestHandler):
+	""" Answers omapi host requests from an in-memory dict. With a key,
+	only requests signed with it are answered. """
+	def signed(self, msg):
+		signature = msg.signature
+		msg.sign(msg.authid, base64.b64decode(self.server.key[1]))
+		return msg.authid == 1 and msg.signature == signature
+
+	def handle(self):
+		hosts = self.server.hosts
+		omapi.read_startup(self.rfile)
+		self.wfile.write(omapi.startup_message())
+		while True:
+			try:
+				msg = omapi.read_message(self.rfile)
+			except omapi.OmapiError:
+				return
+			name = msg.value("name")
+			response = omapi.OmapiMessage(omapi.OMAPI_OP_STATUS, rid = msg.tid, \
+				message = [("result", omapi.pack_int(1))])
+			if msg.value("type") == "authenticator":
+				if self.server.key is not None and name == self.server.key[0]:
+					response = omapi.OmapiMessage(omapi.OMAPI_OP_UPDATE, \
+						handle = 1, rid = msg.tid)
+			elif self.server.key is not None and not self.signed(msg):
+				pass
+			elif msg.opcode == omapi.OMAPI_OP_OPEN and msg.value("create"):
+				if name not in hosts:
+					hosts[name] = dict(msg.obj)
+					response = omapi.OmapiMessage(omapi.OMAPI_OP_UPDATE, \
+						handle = len(hosts), rid = msg.tid, obj = msg.obj)
+			elif msg.opcode == omapi.OMAPI_OP_OPEN and name in hosts:
+				self.server.handles[len(self.server.handles) + 1] = name
+				response = omapi.OmapiMessage(omapi.OMAPI_OP_UPDATE, \
+					handle = len(self.server.handles), rid = msg.tid)
+			elif msg.opcode == omapi.OMAPI_OP_DELETE:
+				del hosts[self.server.handles[msg.handle]]
+				response = omapi.OmapiMessage(omapi.OMAPI_OP_STATUS, \
+					rid = msg.tid, message = [("result", omapi.pack_int(0))])
+			self.wfile.write(response.as_string())
+
+class OmapiStandIn(SocketServer.ThreadingTCPServer):
+	daemon_threads = True
+
+	def __init__(self, key = None):
+		SocketServer.ThreadingTCPServer.__init__(self, ("127.0.0.1", 0), \
+			OmapiStandInHandler)
+		self.key = key
+		self.hosts = {}
+		self.handles = {}
+		thread = threading.Thread(target = self.serve_forever)
+		thread.setDaemon(True)
+		thread.start()
+
+class DhcpChangesTest(TestCase):
+	def setUp(self):
+		self.config = create_inventory()
+
+	def test_digest_ignores_timestamp(self):
+		content = self.config.dhcpd_configuration()
+		again = "# Autogenerated configuration 2000-01-01\n" + \
+			content.split("\n", 1)[1]
+		self.assertEqual(dhcp.config_digest(content), dhcp.config_digest(again))
+		self.assertNotEqual(dhcp.config_digest(content), \
+			dhcp.config_digest(again.replace("beta", "epsilon")))
+
+	def test_host_changes(self):
+		old = self.config.dhcpd_configuration()
+		interface = Interface.objects.get(host__hostname = "alpha")
+		interface.pxe_filename = ""
+		interface.save()
+		interface = Interface.objects.get(host__hostname = "gamma")
+		interface.dhcp_client = True
+		interface.save()
+		new = self.config.dhcpd_configuration()
+		self.assertEqual(dhcp.host_changes(old, new), \
+			(["alpha"], ["alpha", "gamma"]))
+		self.assertEqual(dhcp.host_changes(new, new), ([], []))
+
+	def test_subnet_change_needs_reload(self):
+		old = self.config.dhcpd_configuration()
+		DhcpOption.objects.create(key = "domain-name-servers", \
+			value = "10.0.1.1", ip4subnet = Ip4Subnet.objects.get(name = "clients"))
+		self.assertEqual(dhcp.host_changes(old, \
+			self.config.dhcpd_configuration()), None)
+
+class OmapiClientTest(TestCase):
+	def setUp(self):
+		self.server = OmapiStandIn()
+		self.client = omapi.OmapiClient(*self.server.server_address)
+
+	def tearDown(self):
+		self.client.close()
+		self.server.shutdown()
+		self.server.server_close()
+
+	def test_add_and_delete_host(self):
+		self.client.add_host("alpha", "00:11:22:33:44:0a", "10.0.0.3", \
+			"filename \"pxelinux.0\";")
+		host = self.server.hosts["alpha"]
+		self.assertEqual(host["hardware-address"], "\x00\x11\x22\x33\x44\x0a")
+		self.assertEqual(host["ip-address"], "\x0a\x00\x00\x03")
+		self.assertEqual(host["statements"], "filename \"pxelinux.0\";")
+		self.assertRaises(omapi.OmapiError, self.client.add_host, \
+			"alpha", "00:11:22:33:44:0a", "10.0.0.3")
+
+		self.client.del_host("alpha")
+		self.assertEqual(self.server.hosts, {})
+		self.client.del_host("alpha")
+
+	def test_authentication(self):
+		key = ("mdb", base64.b64encode("secret"))
+		server = OmapiStandIn(key)
+		try:
+			client = omapi.OmapiClient(*server.server_address + key)
+			client.add_host("alpha", "00:11:22:33:44:0a", "10.0.0.3")
+			client.close()
+			self.assertEqual(server.hosts.keys(), ["alpha"])
+			self.assertRaises(omapi.OmapiError, omapi.OmapiClient, \
+				*server.server_address + ("other", key[1]))
+			client = omapi.OmapiClient(*server.server_address + \
+				("mdb", base64.b64encode("wrong")))
+			self.assertRaises(omapi.OmapiError, client.add_host, \
+				"beta", "00:11:22:33:44:0b", "10.0.0.2")
+			client.close()
+			self.assertEqual(server.hosts.keys(), ["alpha"])
+		finally:
+			server.shutdown()
+			server.server_close()
+
+	def test_dhcp_sync(self):
+		config = create_inventory()
+		directory = tempfile.mkdtemp()
+		key = ("mdb", base64.b64encode("secret"))
+		server = OmapiStandIn(key)
+		try:
+			restarts = os.path.join(directory, "restarts")
+			dhcp_sync = sync.DhcpSync("echo %%s >> %s" % restarts, \
+				os.path.join(directory, "dhcpd.conf"), \
+				omapi_host = server.server_address[0], \
+				omapi_port = server.server_address[1], \
+				omapi_key_name = key[0], omapi_key = key[1])
+			self.assertTrue(dhcp_sync.sync(config))
+			self.assertEqual(open(restarts).read(), "restart\n")
+
+			# only a host changed, it is pushed through omapi
+			interface = Interface.objects.get(host__hostname = "gamma")
+			interface.dhcp_client = True
+			interface.save()
+			self.assertTrue(dhcp_sync.sync(DhcpConfig.objects.get(id = config.id)))
+			self.assertEqual(open(restarts).read(), "restart\n")
+			self.assertEqual(server.hosts.keys(), ["gamma"])
+			self.assertEqual(dhcp_sync.omapi_hosts(), set(["gamma"]))
+
+			# after a restart the leases file brings back what omapi
+			# did, which is set to the configuration again
+			server.hosts["gamma"]["ip-address"] = socket.inet_aton("10.0.0.99")
+			DhcpOption.objects.create(key = "domain-name-servers", \
+				value = "10.0.1.1", ip4subnet = Ip4Subnet.objects.get(name = "clients"))
+			self.assertTrue(dhcp_sync.sync(DhcpConfig.objects.get(id = config.id)))
+			self.assertEqual(open(restarts).read(), "restart\nrestart\n")
+			self.assertEqual(server.hosts["gamma"]["ip-address"], \
+				socket.inet_aton(Interface.objects.get(host__hostname = "gamma") \
+					.ip4address.address))
+		finally:
+			server.shutdown()
+			server.server_close()
+			shutil.rmtree(directory)
+
+class DhcpShardTest(TestCase):
+	def setUp(self):
+		self.config = create_inventory()
+
+	def test_shards(self):
+		subnets = list(self.config.ip4subnet_set.all())
+		main = self.config.dhcpd_main_configuration(subnets, "/etc/dhcp3/mdb.d")
+		self.assertEqual(main.split("\n", 6)[6], \
+			"include \"/etc/dhcp3/mdb.d/subnet-%d.conf\";\n" \
+			"include \"/etc/dhcp3/mdb.d/subnet-%d.conf\";\n" % \
+			(subnets[0].id, subnets[1].id))
+
+		entries = self.config.dhcp_subnet_entries(subnets[1:])
+		self.assertEqual(len(entries), 1)
+		shard = self.config.dhcpd_subnet_shard(*entries[0])
+		self.assertEqual(shard, "\n# clients\n" \
+			"subnet 10.0.1.0 netmask 255.255.255.248 {\n" \
+			"\trange 10.0.1.4 10.0.1.6;\n}\n\n" \
+			"host delta {\n\thardware ethernet 00:11:22:33:44:03;\n" \
+			"\tfixed-address delta.example.com;\n}\n")
+
+	def test_option_change_bumps_subnet_serial(self):
+		subnet = Ip4Subnet.objects.get(name = "clients")
+		SyncJournal.objects.all().delete()
+		option = DhcpOption.objects.create(key = "routers", value = "10.0.1.1", \
+			ip4subnet = subnet)
+		self.assertNotEqual(Ip4Subnet.objects.get(id = subnet.id).domain_serial, \
+			subnet.domain_serial)
+		self.assertNotEqual(DhcpConfig.objects.get().serial, self.config.serial)
+		self.assertEqual(sorted(SyncJournal.objects.values_list("kind", "object_id")), \
+			[("dhcpconfig", self.config.id), ("ip4subnet", subnet.id)])
+
+		SyncJournal.objects.all().delete()
+		option.delete()
+		self.assertEqual(SyncJournal.objects.count(), 2)
+
+	def test_deleting_subnet_does_not_bump_it(self):
+		subnet = Ip4Subnet.objects.get(name = "servers")
+		Interface.objects.filter(ip4address__subnet = subnet).delete()
+		SyncJournal.objects.all().delete()
+		serial = DhcpConfig.objects.get().serial
+		subnet.delete()
+		self.assertFalse(DhcpOption.objects.exists())
+		self.assertFalse(SyncJournal.objects.exists())
+		self.assertEqual(DhcpConfig.objects.get().serial, serial)
+
+	def test_moved_interface_bumps_old_subnet_serial(self):
+		subnet = Ip4Subnet.objects.get(name = "clients")
+		interface = Interface.objects.get(host__hostname = "delta")
+		interface.ip4address = Ip4Address.objects.get(address = "10.0.0.5")
+		interface.save()
+		self.assertNotEqual(Ip4Subnet.objects.get(id = subnet.id).domain_serial, \
+			subnet.domain_serial)
+
+
+class KeaStandInHandler(SocketServer.StreamRequestHandler):
+	""" Records kea control commands and answers them like kea does. """
+	def handle(self):
+		request = json.loads(self.request.recv(65536))
+		self.server.commands.append(request)
+		response = {"result": 0}
+		if request["command"] == "config-get":
+			response["arguments"] = self.server.config
+		elif request["command"] == "config-set":
+			self.server.config = request["arguments"]
+		elif request["command"] != "config-reload":
+			response = {"result": 2, "text": "unknown command"}
+		self.wfile.write(json.dumps([response]))
+
+class KeaStandIn(SocketServer.UnixStreamServer):
+	def __init__(self):
+		self.directory = tempfile.mkdtemp()
+		SocketServer.UnixStreamServer.__init__(self, \
+			os.path.join(self.directory, "kea4-ctrl-socket"), KeaStandInHandler)
+		self.commands = []
+		self.config = {"Dhcp4": {"interfaces-config": {"interfaces": ["eth0"]}}}
+		thread = threading.Thread(target = self.serve_forever)
+		thread.setDaemon(True)
+		thread.start()
+
+	def server_close(self):
+		SocketServer.UnixStreamServer.server_close(self)
+		shutil.rmtree(self.directory)
+
+class KeaTest(TestCase):
+	def setUp(self):
+		self.config = create_inventory()
+
+	def test_kea_configuration(self):
+		content = self.config.kea_configuration( \
+			base = {"Dhcp4": {"interfaces-config": {"interfaces": ["eth0"]}}})
+		dhcp4 = content["Dhcp4"]
+		self.assertEqual(dhcp4["interfaces-config"], {"interfaces": ["eth0"]})
+		self.assertEqual(dhcp4["valid-lifetime"], 600)
+		servers, clients = dhcp4["subnet4"]
+		self.assertEqual(servers["subnet"], "10.0.0.0/29")
+		self.assertEqual(servers["option-data"], \
+			[{"name": "routers", "data": "10.0.0.1"}, \
+			{"name": "domain-name", "data": "example.com"}])
+		self.assertEqual(servers["pools"], [])
+		self.assertEqual([r["hostname"] for r in servers["reservations"]], \
+			["beta", "alpha"])
+		self.assertEqual(servers["reservations"][1], {"hostname": "alpha", \
+			"hw-address": "00:11:22:33:44:00", "ip-address": "10.0.0.3", \
+			"boot-file-name": "pxelinux.0"})
+		self.assertEqual(clients["pools"], [{"pool": "10.0.1.4 - 10.0.1.6"}])
+
+	def test_control_socket(self):
+		server = KeaStandIn()
+		try:
+			control = kea.KeaControl(server.server_address)
+			base = control.config_get()
+			control.config_set(self.config.kea_configuration(base = base))
+			control.config_reload()
+			self.assertEqual([c["command"] for c in server.commands], \
+				["config-get", "config-set", "config-reload"])
+			self.assertEqual(len(server.config["Dhcp4"]["subnet4"]), 2)
+			self.assertRaises(kea.KeaError, control.command, "shutdown-now")
+		finally:
+			server.shutdown()
+			server.server_close()
+
+	def test_config_file(self):
+		server = KeaStandIn()
+		path = os.path.join(server.directory, "kea-dhcp4.conf")
+		try:
+			open(path, "w").write("""# written by hand
+{
+	// kept by the sync
+	"Dhcp4": {
+		/* eth1 is the
+		   lab network */
+		"interfaces-config": {"interfaces": ["eth0", "eth1"]},
+		"server-tag": "http://dhcp#1"
+	}
+}
+""")
+			self.assertEqual(kea.read_config(path)["Dhcp4"]["server-tag"], \
+				"http://dhcp#1")
+			dhcp_sync = sync.DhcpSync(dhcp_server = "kea", kea_config = path, \
+				kea_control_socket = server.server_address)
+			self.assertTrue(dhcp_sync.sync_kea(self.config))
+			content = json.load(open(path))["Dhcp4"]
+			self.assertEqual(content["interfaces-config"]["interfaces"], \
+				["eth0", "eth1"])
+			self.assertEqual(len(content["subnet4"]), 2)
+			self.assertEqual([c["command"] for c in server.commands], \
+				["config-reload"])
+
+			open(path, "w").write('{"Dhcp4": {"subnet4": [}}')
+			self.assertRaises(kea.KeaError, kea.read_config, path)
+			self.assertFalse(dhcp_sync.sync_kea(self.config))
+			self.assertEqual(len(mail.outbox), 1)
+			self.assertEqual(len(server.commands), 1)
+		finally:
+			server.shutdown()
+			server.server_close()
+
+LEASES = """# The format of this file is documented in the dhcpd.leases(5) manual page.
+lease 10.0.0.5 {
+  starts 4 2012/10/18 10:00:00;
+  ends 4 2012/10/18 10:10:00;
+  cltt 4 2012/10/18 10:00:00;
+  hardware ethernet 00:11:22:33:44:aa;
+}
+lease 10.0.1.4 {
+  starts epoch 1350554400; # Thu Oct 18 10:00:00 2012
+  cltt epoch 1350555000; # Thu Oct 18 10:10:00 2012
+}
+lease 10.0.0.5 {
+  starts 4 2012/10/18 11:00:00;
+  cltt 4 2012/10/18 11:30:00;
+}
+"""
+
+class LeaseFileTest(TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.filename = os.path.join(self.directory, "dhcpd.leases")
+		self.state = os.path.join(self.directory, "state")
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def write(self, content, mode = "a"):
+		f = open(self.filename, mode)
+		f.write(content)
+		f.close()
+
+	def utc(self, *args):
+		return datetime.datetime.fromtimestamp( \
+			calendar.timegm(datetime.datetime(*args).timetuple()))
+
+	def test_incremental_read(self):
+		partial = "lease 10.0.1.5 {\n  starts 4 2012/10/18 12:00:00;\n"
+		self.write(LEASES + partial)
+		leases = leases_module.LeaseFile(self.filename, self.state)
+		self.assertEqual(leases.read(), \
+			{"10.0.0.5": self.utc(2012, 10, 18, 11, 30), \
+			"10.0.1.4": self.utc(2012, 10, 18, 10, 10)})
+		self.assertEqual(leases.offset, len(LEASES))
+		leases.save_state()
+
+		# a new run only sees the rest of the partial block
+		self.write("}\n")
+		leases = leases_module.LeaseFile(self.filename, self.state)
+		self.assertEqual(leases.read(), \
+			{"10.0.1.5": self.utc(2012, 10, 18, 12, 0)})
+
+		# dhcpd replaced the file with a shorter one
+		os.unlink(self.filename)
+		self.write(LEASES[:LEASES.index("lease 10.0.1.4")], "w")
+		self.assertEqual(leases.read().keys(), ["10.0.0.5"])
+
+	def test_small_chunks(self):
+		self.write(LEASES)
+		f = open(self.filename)
+		blocks = list(leases_module.parse_leases(f, chunk_size = 7))
+		f.close()
+		self.assertEqual([(address, consumed) for address, t, consumed in blocks], \
+			[("10.0.0.5", LEASES.index("lease 10.0.1.4")), \
+			("10.0.1.4", LEASES.index("lease 10.0.0.5 {\n  starts 4 2012/10/18 11")), \
+			("10.0.0.5", len(LEASES))])
+
+	def test_update_last_contact(self):
+		create_inventory()
+		newer = datetime.datetime(2030, 1, 1)
+		Reachability.objects.create(last_contact = newer, \
+			ip4address = Ip4Address.objects.get(address = "10.0.1.4"))
+		self.write(LEASES)
+		leases_module.update_last_contact( \
+			leases_module.LeaseFile(self.filename, self.state).read())
+		self.assertEqual(Ip4Address.objects.get(address = "10.0.0.5").last_contact, \
+			self.utc(2012, 10, 18, 11, 30))
+		self.assertEqual(Ip4Address.objects.get(address = "10.0.1.4").last_contact, \
+			newer)
+
+
+class EchoStandIn(threading.Thread):
+	""" Answers icmp echo requests sent to a loopback udp port. """
+	def __init__(self):
+		threading.Thread.__init__(self)
+		self.setDaemon(True)
+		self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		self.sock.bind(("127.0.0.1", 0))
+		self.port = self.sock.getsockname()[1]
+		self.start()
+
+	def run(self):
+		while True:
+			try:
+				data, source = self.sock.recvfrom(1024)
+			except socket.error:
+				return
+			icmp_type, code, csum, ident, seq = \
+				struct.unpack("!BBHHH", data[:8])
+			self.sock.sendto(probe.echo_packet(probe.ICMP_ECHO_REPLY, \
+				ident, seq, data[8:]), source)
+
+class ProberTest(TestCase):
+	def setUp(self):
+		self.stand_in = EchoStandIn()
+		self.prober = probe.Prober(count = 3, timeout = 0.2, interval = 0.01, \
+			sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM), \
+			port = self.stand_in.port)
+
+	def tearDown(self):
+		self.prober.close()
+		self.stand_in.sock.close()
+
+	def test_echo_packet(self):
+		packet = probe.echo_packet(probe.ICMP_ECHO_REPLY, 1, 42, "payload")
+		self.assertEqual(probe.checksum(packet), 0)
+		self.assertEqual(probe.parse_echo_reply(packet), 42)
+		self.assertEqual(probe.parse_echo_reply( \
+			probe.echo_packet(probe.ICMP_ECHO_REQUEST, 1, 42, "payload")), None)
+		self.assertEqual(probe.parse_echo_reply(packet, 1), 42)
+		self.assertEqual(probe.parse_echo_reply(packet, 2), None)
+
+	def test_send_failures(self):
+		sendto = self.prober.sock.sendto
+		failures = [errno.ENOBUFS, errno.EAGAIN, errno.ENETUNREACH]
+		def failing_sendto(*args):
+			if failures:
+				error = failures.pop(0)
+				raise socket.error(error, os.strerror(error))
+			return sendto(*args)
+		self.prober.sock.sendto = failing_sendto
+		result = dict(self.prober.run([(1, "127.0.0.1")]))[1]
+		# a full send buffer is retried, an unreachable network is a loss
+		self.assertEqual((result.sent, result.received()), (3, 2))
+
+	def test_probe(self):
+		targets = [(i, "127.0.0.1") for i in range(200)] + [("down", "127.0.0.2")]
+		results = dict(self.prober.run(targets))
+		self.assertEqual(len(results), 201)
+		self.assertEqual(results[0].sent, 3)
+		self.assertEqual(results[0].received(), 3)
+		self.assertTrue(results[0].avg_rtt() < 200)
+		self.assertEqual(results["down"].sent, 3)
+		self.assertEqual(results["down"].avg_rtt(), None)
+		self.assertEqual(results["down"].loss(), 1.0)
+
+class DatabaseWriterTest(TestCase):
+	def test_batches(self):
+		create_inventory()
+		addresses = list(Ip4Address.objects.order_by("id"))
+		when = datetime.datetime(2012, 10, 18, 12, 0)
+		writer = results.DatabaseWriter(batch_size = 4, flush_interval = 3600)
+		for i, address in enumerate(addresses[:6]):
+			writer.put(address.id, when, float(i))
+		self.assertEqual(writer.flushes, 1)
+		# finding the existing rows, inserting the new ones and finding
+		# the hosts whose cached details to drop
+		self.assertNumQueries(3, writer.close)
+		self.assertEqual(writer.flushes, 2)
+
+		for i, address in enumerate(addresses[:6]):
+			address = Ip4Address.objects.get(id = address.id)
+			self.assertEqual(address.last_contact, when)
+			self.assertEqual(address.ping_avg_rtt, float(i))
+		self.assertEqual(Ip4Address.objects.get(id = addresses[6].id).last_contact, \
+			None)
+
+		later = when + datetime.timedelta(minutes = 5)
+		writer.put(addresses[0].id, later, 9.0)
+		writer.put(addresses[6].id, later, 8.0)
+		self.assertNumQueries(4, writer.close)
+		self.assertEqual([(r.ip4address_id, r.last_contact, r.ping_avg_rtt) \
+			for r in Reachability.objects.filter(ip4address__in = \
+				[addresses[0].id, addresses[6].id]).order_by("ip4address")], \
+			[(addresses[0].id, later, 9.0), (addresses[6].id, later, 8.0)])
+
+	def test_concurrent_insert(self):
+		create_inventory()
+		first, second = Ip4Address.objects.order_by("id")[:2]
+		# inserted by another writer after this one looked for the rows
+		Reachability.objects.create(ip4address = first, ping_avg_rtt = 1.0)
+		table = connection.ops.quote_name(Reachability._meta.db_table)
+		results.insert_or_update(connection.cursor(), \
+			"INSERT INTO %s (ip4address_id, ping_avg_rtt) VALUES (%%s, %%s)" % table, \
+			[(first.id, 2.0), (second.id, 3.0)], \
+			"UPDATE %s SET ping_avg_rtt = %%s WHERE ip4address_id = %%s" % table, \
+			lambda (id, rtt): (rtt, id))
+		self.assertEqual(list(Reachability.objects.filter(ip4address__in = \
+			[first.id, second.id]).order_by("ip4address") \
+			.values_list("ping_avg_rtt", flat = True)), [2.0, 3.0])
+
+class ProbeSchedulerTest(TestCase):
+	def setUp(self):
+		self.scheduler = scheduler.ProbeScheduler(interval = 300, \
+			recheck_interval = 30, max_interval = 1000, jitter = 0)
+		self.scheduler.update_inventory([self.target(1, "10.0.0.1"), \
+			self.target(2, "10.0.0.2")], 0)
+
+	def target(self, interface_id, address):
+		return targets_module.ProbeTarget(1, "alpha", interface_id, "eth0", \
+			interface_id * 10, address)
+
+	def test_new_targets_are_spread_out(self):
+		self.assertEqual(len(self.scheduler), 2)
+		self.assertEqual(self.scheduler.due(-1), [])
+		self.assertEqual(len(self.scheduler.due(300)), 2)
+		self.assertEqual(self.scheduler.next_due(), None)
+
+	def test_intervals(self):
+		self.scheduler.update_inventory([self.target(1, "10.0.0.1")], 0)
+		target, = self.scheduler.due(300)
+
+		# a target that stays down backs off up to max_interval
+		now = 300
+		intervals = []
+		for i in range(5):
+			self.assertFalse(self.scheduler.completed(target, False, now))
+			when = self.scheduler.next_due()
+			self.assertEqual(self.scheduler.due(when), [target])
+			intervals.append(when - now)
+			now = when
+		self.assertEqual(intervals, [300, 600, 1000, 1000, 1000])
+
+		# and is rechecked quickly when it comes back
+		self.assertTrue(self.scheduler.completed(target, True, now))
+		self.assertEqual(self.scheduler.next_due(), now + 30)
+		self.assertEqual(self.scheduler.due(now + 30), [target])
+		self.assertFalse(self.scheduler.completed(target, True, now + 30))
+		self.assertEqual(self.scheduler.due(now + 329), [])
+
+	def test_inventory_changes(self):
+		self.assertEqual(self.scheduler.update_inventory( \
+			[self.target(1, "10.0.0.9"), self.target(3, "10.0.0.3")], 10), \
+			(1, 1, 1))
+		due = self.scheduler.due(10)
+		self.assertEqual([(t.interface_id, t.address) for t in due], \
+			[(1, "10.0.0.9")])
+		self.assertEqual(sorted([t.interface_id for t in \
+			self.scheduler.due(310)]), [3])
+
+class ProbeTargetsTest(TestCase):
+	def test_probe_targets(self):
+		create_inventory()
+		host = Host.objects.get(hostname = "alpha")
+		Interface.objects.create(name = "eth1", macaddr = "00:11:22:33:44:ff", \
+			dhcp_client = False, host = host, domain = Domain.objects.get())
+
+		with self.assertNumQueries(1):
+			targets = targets_module.probe_targets()
+		self.assertEqual([(t.hostname, t.interface_name, t.address) \
+			for t in targets], [("alpha", "eth0", "10.0.0.3"), \
+			("beta", "eth0", "10.0.0.2"), ("delta", "eth0", "10.0.1.2"), \
+			("gamma", "eth0", "10.0.0.4")])
+		self.assertEqual(targets_module.probe_targets("workstation"), [])
+
+		shards = [targets_module.probe_targets(shard = (i, 3)) for i in range(3)]
+		self.assertEqual(sorted(sum(shards, [])), sorted(targets))
+
+	def test_shard_of(self):
+		keys = ["10.0.%d.%d" % (i / 256, i % 256) for i in range(3000)]
+		before = [shard.shard_of(key, 3) for key in keys]
+		after = [shard.shard_of(key, 4) for key in keys]
+		for count in [before.count(i) for i in range(3)]:
+			self.assertTrue(800 < count < 1200)
+		# adding a shard only moves keys to the new shard
+		for old, new in zip(before, after):
+			self.assertTrue(new == old or new == 3)
+
+	def test_parse_shard(self):
+		self.assertEqual(shard.parse_shard("1/3"), (0, 3))
+		self.assertEqual(shard.parse_shard("3/3"), (2, 3))
+		self.assertRaises(argparse.ArgumentTypeError, shard.parse_shard, "0/3")
+		self.assertRaises(argparse.ArgumentTypeError, shard.parse_shard, "3")
+
+class SinksTest(TestCase):
+	def test_sinks(self):
+		create_inventory()
+		targets = targets_module.probe_targets()
+		up = probe.ProbeResult(targets[0].address)
+		up.sent = 2
+		up.rtts = [1.0, 2.0]
+		down = probe.ProbeResult(targets[1].address)
+		down.sent = 2
+		when = datetime.datetime(2012, 10, 18, 12, 0)
+
+		text = StringIO.StringIO()
+		log = StringIO.StringIO()
+		outputs = [sinks.DatabaseSink(), sinks.TextSink(text), sinks.JsonSink(log)]
+		for sink in outputs:
+			sink.put(targets[0], up, when)
+			sink.put(targets[1], down, when)
+			sink.close()
+
+		address = Ip4Address.objects.get(id = targets[0].ip4address_id)
+		self.assertEqual((address.last_contact, address.ping_avg_rtt), (when, 1.5))
+		self.assertEqual(Ip4Address.objects.get(id = targets[1].ip4address_id) \
+			.last_contact, None)
+		self.assertEqual(text.getvalue(), "alpha (eth0/10.0.0.3) : 1.500\n" \
+			"beta (eth0/10.0.0.2) : fail   \n")
+		lines = [json.loads(line) for line in log.getvalue().splitlines()]
+		self.assertEqual([(l["host"], l["received"], l["avg_rtt"]) for l in lines], \
+			[("alpha", 2, 1.5), ("beta", 0, None)])
+
+	def test_sink_thread(self):
+		class Recorder(sinks.Sink):
+			def __init__(self):
+				self.results = []
+				self.closed = False
+			def put(self, target, result, when):
+				if target == "fail":
+					raise ValueError(target)
+				self.results.append((target, threading.currentThread()))
+			def close(self):
+				self.closed = True
+
+		recorder = Recorder()
+		thread = sinks.SinkThread([recorder], poll_interval = 0.01)
+		for i in range(3):
+			thread.put(i, None, None)
+		thread.close()
+		self.assertEqual([r[0] for r in recorder.results], [0, 1, 2])
+		self.assertFalse(threading.currentThread() in [r[1] for r in recorder.results])
+		self.assertTrue(recorder.closed)
+
+		thread = sinks.SinkThread([Recorder()], poll_interval = 0.01)
+		thread.put("fail", None, None)
+		self.assertRaises(ValueError, thread.close)
+
+class HistoryTest(TestCase):
+	def test_ring_buffers(self):
+		h = history.History()
+		start = 1350000000 - 1350000000 % (288 * 300)
+		for i in range(600):
+			h.add(start + i * 300 + 10, float(i))
+		h = history.History(h.dumps())
+		self.assertEqual(len(h.dumps()), history.HISTORY_SIZE)
+
+		# the first tier has wrapped around and keeps the last 576 values
+		series = h.series(0)
+		self.assertEqual(len(series), 576)
+		self.assertEqual(series[0], (start + 24 * 300, 24.0))
+		self.assertEqual(series[-1], (start + 599 * 300, 599.0))
+		# the other tiers average 6, 72 and 288 values
+		self.assertEqual(h.series(1)[0], (start, 2.5))
+		self.assertEqual(h.series(2)[0], (start, 35.5))
+		# the last period of a tier holds the average so far
+		self.assertEqual(h.series(3), [(start, 143.5), (start + 288 * 300, 431.5), \
+			(start + 576 * 300, 587.5)])
+		h.add(start + 599 * 300 + 20, 601.0)
+		self.assertEqual(h.series(0)[-1], (start + 599 * 300, 600.0))
+		# values older than the current period are ignored
+		h.add(start, 1000.0)
+		self.assertEqual(h.series(0)[0], (start + 24 * 300, 24.0))
+
+	def test_history_sink(self):
+		create_inventory()
+		targets = targets_module.probe_targets()
+		up = probe.ProbeResult(targets[0].address)
+		up.sent = 2
+		up.rtts = [1.0, 2.0]
+		down = probe.ProbeResult(targets[1].address)
+		down.sent = 2
+		start = datetime.datetime(2012, 10, 18, 12, 0)
+
+		sink = sinks.HistorySink(batch_size = 2)
+		for i in range(3):
+			when = start + datetime.timedelta(minutes = 5 * i)
+			sink.put(targets[0], up, when)
+			sink.put(targets[1], down, when)
+		sink.close()
+
+		timestamps, values = history.latency_history(targets[0].ip4address_id)
+		self.assertEqual(list(timestamps), [time.mktime((start + \
+			datetime.timedelta(minutes = 5 * i)).timetuple()) for i in range(3)])
+		self.assertEqual(list(values), [1.5, 1.5, 1.5])
+		timestamps, values = history.latency_history(targets[0].ip4address_id, \
+			start = timestamps[1])
+		self.assertEqual(len(timestamps), 2)
+		self.assertEqual(len(history.latency_history( \
+			targets[1].ip4address_id)[0]), 0)
+
+	def test_concurrent_history_insert(self):
+		create_inventory()
+		address = Ip4Address.objects.order_by("id")[0]
+		start = datetime.datetime(2012, 10, 18, 12, 0)
+		history.HistoryWriter().write([(address.id, start, 1.0)])
+
+		class Racing(history.HistoryWriter):
+			# found no history, the other writer inserted it right after
+			missed = True
+			def read(self, ids):
+				if self.missed:
+					self.missed = False
+					return {}
+				return history.HistoryWriter.read(self, ids)
+
+		Racing().write([(address.id, start + datetime.timedelta(minutes = 5), 2.0)])
+		self.assertEqual(list(history.latency_history(address.id)[1]), [1.0, 2.0])
+
+class FleetSummaryTest(TestCase):
+	def test_fleet_summary(self):
+		create_inventory()
+		now = datetime.datetime(2012, 10, 18, 12, 0)
+		for address, seen, rtt in (("10.0.0.3", now, 1.0), \
+				("10.0.0.2", now - datetime.timedelta(minutes = 5), 3.0), \
+				("10.0.1.2", now - datetime.timedelta(days = 2), 2.0)):
+			Reachability.objects.create(last_contact = seen, ping_avg_rtt = rtt, \
+				ip4address = Ip4Address.objects.get(address = address))
+
+		with self.assertNumQueries(1):
+			fleet = summary.fleet_summary(now)
+		total = fleet["total"]
+		self.assertEqual((total["addresses"], total["up"], total["loss"]), \
+			(4, 2, 0.5))
+		self.assertEqual([(p, round(rtt, 2)) for p, rtt in total["rtt"]], \
+			[(50, 2.0), (90, 2.8), (99, 2.98)])
+		self.assertEqual(total["not_seen"], [("1 hour", 2), ("1 day", 2), \
+			("1 week", 1)])
+		self.assertEqual(total["never_seen"], 1)
+		self.assertEqual([h["name"] for h in fleet["host_type"]], ["server"])
+		subnets = dict([(s["name"], s) for s in fleet["subnet"]])
+		self.assertEqual(subnets["servers"]["addresses"], 3)
+		self.assertEqual(subnets["clients"]["rtt"], \
+			[(50, None), (90, None), (99, None)])
+		self.assertEqual(subnets["clients"]["loss"], 1.0)
+
+	def test_index(self):
+		create_inventory()
+		response = self.client.get("/info/")
+		self.assertEqual(response.status_code, 200)
+		self.assertTrue("<td>clients</td>" in response.content)
+
+class ApiTest(TestCase):
+	def setUp(self):
+		User.objects.create_user("reader", "reader@example.com", "reader")
+		self.client.login(username = "reader", password = "reader")
+
+	def test_access(self):
+		self.client.logout()
+		self.assertEqual(self.get("/api/hosts/", 403), {"error": "not allowed"})
+		with override_settings(MDB_API_CLIENTS = ("127.0.0.1",)):
+			self.assertEqual(self.get("/api/hosts/")["results"], [])
+
+	def get(self, url, status = 200):
+		response = self.client.get(url)
+		self.assertEqual(response.status_code, status)
+		self.assertEqual(response["Content-Type"], "application/json")
+		return json.loads(response.content)
+
+	def test_cursor_pagination(self):
+		create_inventory()
+		page = self.get("/api/hosts/?limit=3")
+		self.assertEqual([h["hostname"] for h in page["results"]], \
+			["alpha", "beta", "gamma"])
+		self.assertEqual(page["results"][0]["interfaces"][0]["ip4address"], \
+			"10.0.0.3")
+		self.assertEqual(page["cursor"], page["results"][-1]["id"])
+		self.assertTrue(page["next"].startswith("/api/hosts/?cursor="))
+
+		page = self.get(page["next"])
+		self.assertEqual([h["hostname"] for h in page["results"]], ["delta"])
+		self.assertEqual((page["cursor"], page["next"]), (None, None))
+
+		# filter values need not be ASCII
+		HostType.objects.filter(host_type = "server").update(host_type = u"s\xe9rveur")
+		page = self.get("/api/hosts/?limit=1&host_type=s%C3%A9rveur&fields=hostname")
+		self.assertEqual(page["results"], [{"hostname": "alpha"}])
+		self.assertTrue("host_type=s%C3%A9rveur" in page["next"])
+		# the test client decodes a unicode query string as latin-1
+		page = self.get(str(page["next"]))
+		self.assertEqual(page["results"], [{"hostname": "beta"}])
+
+	@override_settings(MDB_API_CLIENTS = ("127.0.0.1",))
+	def test_queries_per_page(self):
+		create_inventory()
+		# an allowed client, so the session and user are not loaded
+		self.client.logout()
+		# hosts, interfaces, ip4 addresses, domains and ip6 addresses
+		with self.assertNumQueries(5):
+			self.client.get("/api/hosts/?limit=1")
+		with self.assertNumQueries(5):
+			self.client.get("/api/hosts/")
+		with self.assertNumQueries(3):
+			self.client.get("/api/ip4addresses/")
+
+	def test_filters_and_fields(self):
+		create_inventory()
+		page = self.get("/api/interfaces/?subnet=clients&fields=id,ip4address")
+		self.assertEqual([sorted(i.keys()) for i in page["results"]], \
+			[["id", "ip4address"]])
+		self.assertEqual(page["results"][0]["ip4address"], "10.0.1.2")
+		page = self.get("/api/ip4addresses/?subnet=10.0.0.0&host_type=server" \
+			"&fields=address,hostname")
+		self.assertEqual(sorted([(a["address"], a["hostname"]) \
+			for a in page["results"]]), [("10.0.0.2", "beta"), \
+			("10.0.0.3", "alpha"), ("10.0.0.4", "gamma")])
+		page = self.get("/api/hosts/?domain=example.com&host_type=desktop")
+		self.assertEqual(page["results"], [])
+		self.assertEqual(self.get("/api/domains/")["results"][0]["domain_name"], \
+			"example.com")
+
+		self.assertTrue("error" in self.get("/api/hosts/?limit=0", 400))
+		self.assertTrue("error" in self.get("/api/hosts/?cursor=x", 400))
+		self.assertTrue("error" in self.get("/api/hosts/?color=red", 400))
+		self.assertTrue("error" in self.get("/api/hosts/?fields=color", 400))
+		# also on an empty page
+		self.assertTrue("error" in self.get( \
+			"/api/hosts/?host_type=desktop&fields=color", 400))
+
+class HostDetailTest(TestCase):
+	def setUp(self):
+		cache.clear()
+
+	def test_host_detail(self):
+		create_inventory()
+		host = Host.objects.get(hostname = "alpha")
+		url = "/info/host/%d/" % host.id
+		Ip6Subnet.objects.create(name = "v6", network = "2001:db8:0:1", \
+			domain_soa = "ns.example.com", domain_admin = "admin@example.com", \
+			domain_filename = "/tmp/v6")
+		Ip6Address.objects.create(subnet = Ip6Subnet.objects.get(), \
+			address = "::3", interface = host.interface_set.get())
+
+		with self.assertNumQueries(8):
+			response = self.client.get(url)
+		self.assertEqual(response.status_code, 200)
+		self.assertTrue("<h1>alpha</h1>" in response.content)
+		self.assertTrue("10.0.0.3 (servers, 0.0.10.in-addr.arpa)" \
+			in response.content)
+		self.assertTrue("2001:db8:0:1::3" in response.content)
+
+		# cached until the host changes
+		with self.assertNumQueries(0):
+			self.client.get(url)
+		host.description = "Mail server"
+		host.save()
+		self.assertTrue("Mail server" in self.client.get(url).content)
+		with self.assertNumQueries(0):
+			self.client.get(url)
+		Ip6Address.objects.get().delete()
+		self.assertFalse("2001:db8:0:1::3" in self.client.get(url).content)
+
+		self.assertEqual(self.client.get("/info/host/%d/" % (host.id + 100)) \
+			.status_code, 404)
+
+		# a zero padded id is cached under the same key
+		padded = "/info/host/%03d/" % host.id
+		self.client.get(padded)
+		host.description = "Web server"
+		host.save()
+		self.assertTrue("Web server" in self.client.get(padded).content)
+
+	def test_invalidation(self):
+		create_inventory()
+		alpha = Host.objects.get(hostname = "alpha")
+		interface = alpha.interface_set.get()
+		address = interface.ip4address
+		url = "/info/host/%d/" % alpha.id
+		self.assertTrue("10.0.0.3" in self.client.get(url).content)
+		self.assertTrue('src="/info/graph/%d.png"' % interface.id \
+			in self.client.get(url).content)
+
+		address.address = "10.0.0.30"
+		address.save()
+		self.assertTrue("10.0.0.30" in self.client.get(url).content)
+
+		when = datetime.datetime(2012, 10, 18, 12, 0)
+		writer = results.DatabaseWriter()
+		writer.put(address.id, when, 1.5)
+		writer.close()
+		self.assertTrue("1.500 ms" in self.client.get(url).content)
+		writer.put(address.id, when, 2.5)
+		writer.close()
+		self.assertTrue("2.500 ms" in self.client.get(url).content)
+		leases_module.update_last_contact( \
+			{"10.0.0.30": datetime.datetime(2012, 10, 19, 12, 0)})
+		self.assertTrue("Oct. 19, 2012" in self.client.get(url).content)
+		Reachability.objects.filter(ip4address = address).get().delete()
+		self.assertTrue("never" in self.client.get(url).content)
+
+		# the host the interface moved away from no longer shows it
+		other = Host.objects.exclude(id = alpha.id)[0]
+		other_url = "/info/host/%d/" % other.id
+		self.client.get(other_url)
+		interface.host = other
+		interface.save()
+		self.assertFalse("10.0.0.30" in self.client.get(url).content)
+		self.assertTrue("10.0.0.30" in self.client.get(other_url).content)
+
+class ExportTest(TestCase):
+	def without_timestamp(self, zone):
+		# zone files have a comment with the time they were rendered
+		return [l for l in zone.splitlines() \
+			if not re.match(r"^; \d{4}-\d\d-\d\d ", l)]
+
+	def test_zone_export(self):
+		create_inventory()
+		domain = Domain.objects.get()
+		url = "/export/domain/%d.zone" % domain.id
+		response = self.client.get(url)
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(self.without_timestamp(response.content), \
+			self.without_timestamp(domain.zone_file_contents()))
+		etag = response["ETag"]
+		self.assertTrue(str(domain.domain_serial) in etag)
+
+		# an unchanged zone is only looked up
+		with self.assertNumQueries(1):
+			response = self.client.get(url, HTTP_IF_NONE_MATCH = etag)
+		self.assertEqual(response.status_code, 304)
+		self.assertEqual(response.content, "")
+
+		Host.objects.get(hostname = "alpha").save()
+		response = self.client.get(url, HTTP_IF_NONE_MATCH = etag)
+		self.assertEqual(response.status_code, 200)
+		self.assertNotEqual(response["ETag"], etag)
+
+		subnet = Ip4Subnet.objects.get(name = "servers")
+		response = self.client.get("/export/ip4subnet/%d.zone" % subnet.id)
+		self.assertEqual(self.without_timestamp(response.content), \
+			self.without_timestamp(subnet.zone_file_contents()))
+		self.assertEqual(self.client.get("/export/domain/%d.zone" % \
+			(domain.id + 1)).status_code, 404)
+
+	def test_dhcp_export(self):
+		config = create_inventory()
+		response = self.client.get("/export/dhcpd/%d.conf" % config.id)
+		self.assertEqual(dhcp.strip_header(response.content), \
+			DHCPD_CONFIGURATION)
+		response = self.client.get("/export/kea/%d.json" % config.id, \
+			HTTP_IF_NONE_MATCH = response["ETag"])
+		# the kea and dhcpd files have their own etags
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(json.loads(response.content), \
+			config.kea_configuration())
+
+		index = json.loads(self.client.get("/export/").content)
+		self.assertTrue({"name": "default", "serial": config.serial, \
+			"url": "/export/dhcpd/%d.conf" % config.id} in index)
+
+		with override_settings(MDB_EXPORT_CLIENTS = ("10.0.0.53",)):
+			self.assertEqual(self.client.get("/export/").status_code, 403)
+
+class SyncTest(TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def publish_everything(self):
+		for kind, model, serial, active in (("domain", Domain, "domain_serial", \
+				"domain_active_serial"), ("ip4subnet", Ip4Subnet, \
+				"domain_serial", "domain_active_serial"), ("ip6subnet", \
+				Ip6Subnet, "domain_serial", "domain_active_serial"), \
+				("dhcpconfig", DhcpConfig, "serial", "active_serial")):
+			model.objects.update(**{active: F(serial)})
+		SyncJournal.objects.all().delete()
+
+	def test_journal(self):
+		config = create_inventory()
+		self.publish_everything()
+		self.assertEqual(sync.dirty_zones(), [])
+
+		Host.objects.get(hostname = "delta").save()
+		keys = set([(kind, id) for entry_id, kind, id in sync.journal_entries()])
+		clients = Ip4Subnet.objects.get(name = "clients")
+		domain = Domain.objects.get()
+		self.assertEqual(keys, set([("domain", domain.id), \
+			("ip4subnet", clients.id), ("dhcpconfig", config.id)]))
+
+		# one query per kind of zone in the journal
+		with self.assertNumQueries(2):
+			zones = sync.dirty_zones(keys)
+		self.assertEqual([(kind, zone.id) for kind, zone in zones], \
+			[("domain", domain.id), ("ip4subnet", clients.id)])
+
+		last_id = sync.journal_entries()[-1][0]
+		sync.forget_journal(last_id)
+		self.assertEqual(sync.journal_entries(), [])
+
+	def test_cron_sync_clears_journal(self):
+		create_inventory()
+		self.assertTrue(SyncJournal.objects.exists())
+		# like zone_synchronizer.py
+		last_id = sync.last_journal_id()
+		zone_sync = sync.ZoneSync("true %s", "true %s %s", self.directory, \
+			os.path.join(self.directory, "fail-%s-%s"), \
+			output = StringIO.StringIO())
+		zones = sync.dirty_zones()
+		for kind, zone in zones:
+			zone.domain_filename = os.path.join(self.directory, zone.domain_name)
+		self.assertEqual(zone_sync.sync(zones), 3)
+		sync.forget_journal(last_id)
+		self.assertEqual(sync.dirty_zones(), [])
+		self.assertEqual(SyncJournal.objects.count(), 0)
+		self.assertEqual(sync.last_journal_id(), 0)
+
+	def test_zone_sync(self):
+		create_inventory()
+		self.publish_everything()
+		domain = Domain.objects.get()
+		domain.domain_filename = os.path.join(self.directory, "example.com")
+		domain.domain_serial += 1
+		domain.save()
+
+		output = StringIO.StringIO()
+		zone_sync = sync.ZoneSync("true %s", "test -n %s -a -f %s", \
+			self.directory, os.path.join(self.directory, "fail-%s-%s"), \
+			output = output)
+		keys = set([(kind, id) for entry_id, kind, id in sync.journal_entries()])
+		self.assertEqual(zone_sync.sync(sync.dirty_zones(keys)), 1)
+		self.assertTrue("alpha" in open(domain.domain_filename).read())
+		self.assertTrue("restarting bind...ok" in output.getvalue())
+		# publishing does not make the zone dirty again
+		self.assertEqual(sync.dirty_zones(), [])
+		self.assertEqual(sync.journal_entries()[-1][1:], ("domain", domain.id))
+		self.assertEqual(SyncJournal.objects.count(), 1)
+
+		subnet = Ip4Subnet.objects.get(name = "servers")
+		subnet.domain_filename = os.path.join(self.directory, "servers")
+		subnet.save()
+		zone_sync.zone_check_command = "false %s %s"
+		self.assertEqual(zone_sync.sync(sync.dirty_zones()), 0)
+		self.assertFalse(os.path.exists(subnet.domain_filename))
+		self.assertEqual([zone.id for kind, zone in sync.dirty_zones()], \
+			[subnet.id])
+
+	def test_dhcp_sync(self):
+		config = create_inventory()
+		dhcpd_config = os.path.join(self.directory, "dhcpd.conf")
+		dhcp_sync = sync.DhcpSync(dhcpd_init = "true %s", \
+			dhcpd_config = dhcpd_config, omapi_port = None)
+		self.assertTrue(dhcp_sync.sync(config))
+		self.assertEqual(dhcp.strip_header(open(dhcpd_config).read()), \
+			DHCPD_CONFIGURATION)
+		config = DhcpConfig.objects.get()
+		self.assertEqual(config.active_serial, config.serial)
+
+class PublishTest(TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def target_dir(self, name):
+		path = os.path.join(self.directory, name)
+		os.mkdir(path)
+		return path
+
+	def test_fan_out(self):
+		log = os.path.join(self.directory, "reloads")
+		targets = [publish.DirectoryTarget(self.target_dir("ns%d" % i), \
+			"sleep 0.5; echo ns%d >> %s" % (i, log)) for i in range(4)]
+		remote = self.target_dir("remote")
+		targets.append(publish.CommandTarget("cp %%(source)s %s/%%(name)s" % \
+			remote, "echo remote >> %s" % log, name = "remote"))
+
+		started = time.time()
+		results = publish.Publisher(targets).publish([("example.com", "zone\n"), \
+			("servers", u"subnet\n")])
+		# the targets are reloaded at the same time
+		self.assertTrue(time.time() - started < 1.5)
+		self.assertEqual(results, dict([(t.name, None) for t in targets]))
+		for target in ("ns0", "ns3", "remote"):
+			self.assertEqual(sorted(os.listdir(os.path.join(self.directory, \
+				target))), ["example.com", "servers"])
+		# one reload per target
+		self.assertEqual(sorted(open(log).read().split()), \
+			["ns0", "ns1", "ns2", "ns3", "remote"])
+
+	def test_retries(self):
+		counter = os.path.join(self.directory, "attempts")
+		# fails the first time it runs
+		flaky = publish.CommandTarget("echo x >> %s; test $(wc -l < %s) -gt 1" \
+			% (counter, counter), name = "flaky")
+		broken = publish.CommandTarget("false", name = "broken")
+		results = publish.Publisher([flaky, broken], retries = 3, \
+			retry_delay = 0).publish([("example.com", "zone\n")])
+		self.assertEqual(results["flaky"], None)
+		self.assertTrue(results["broken"].startswith("false failed"))
+		self.assertEqual(len(open(counter).readlines()), 2)
+
+	def test_zone_sync_targets(self):
+		create_inventory()
+		ns1 = self.target_dir("ns1")
+		ns2 = self.target_dir("ns2")
+		publisher = publish.Publisher([publish.DirectoryTarget(ns1), \
+			publish.DirectoryTarget(ns2)])
+		zone_sync = sync.ZoneSync("false %s", "true %s %s", \
+			os.path.join(self.directory, "check"), \
+			os.path.join(self.directory, "fail-%s-%s"), \
+			output = StringIO.StringIO(), publisher = publisher)
+		self.assertEqual(zone_sync.sync(sync.dirty_zones()), 3)
+		self.assertEqual(sorted(os.listdir(ns2)), ["clients", "example.com", \
+			"servers"])
+		self.assertEqual(sync.dirty_zones(), [])
+
+		Host.objects.get(hostname = "alpha").save()
+		publisher.targets.append(publish.DirectoryTarget( \
+			os.path.join(self.directory, "missing")))
+		publisher.retry_delay = 0
+		self.assertEqual(zone_sync.sync(sync.dirty_zones()), 0)
+		# stays dirty until every target has it
+		self.assertEqual(len(sync.dirty_zones()), 2)
+
+	def test_dhcp_sync_targets(self):
+		config = create_inventory()
+		target = self.target_dir("dhcp1")
+		publisher = publish.Publisher([publish.DirectoryTarget(target)])
+		check = os.path.join(self.directory, "dhcpd.conf.check")
+		dhcp_sync = sync.DhcpSync(dhcpd_config = "/etc/dhcp3/dhcpd.conf", \
+			publisher = publisher, dhcpd_check_command = "false %s", \
+			dhcpd_check_temp_file = check)
+		serial = config.active_serial
+		self.assertFalse(dhcp_sync.sync(config))
+		self.assertEqual(os.listdir(target), [])
+		self.assertEqual(DhcpConfig.objects.get(id = config.id).active_serial, \
+			serial)
+		self.assertTrue("failed the check" in mail.outbox[-1].body)
+		self.assertFalse(os.path.exists(check))
+
+		dhcp_sync.dhcpd_check_command = "grep -q ^subnet %s"
+		self.assertTrue(dhcp_sync.sync(config))
+		self.assertEqual(os.listdir(target), ["dhcpd.conf"])
+		self.assertEqual(DhcpConfig.objects.get(id = config.id).active_serial, \
+			config.serial)
+
+class MetricsTest(TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+		connection.use_debug_cursor = None
+
+	def test_stages(self):
+		create_inventory()
+		m = metrics.Metrics("zone sync", track_queries = True)
+		with m.stage("render", zone = "example.com"):
+			list(Host.objects.all())
+			list(Interface.objects.all())
+		with m.stage("render", zone = "example.org"):
+			pass
+		try:
+			with m.stage("write"):
+				raise IOError("disk full")
+		except IOError:
+			pass
+		m.count("zones_written", 2)
+
+		self.assertEqual([(s["stage"], s["queries"], s["success"]) \
+			for s in m.stages], \
+			[("render", 2, True), ("render", 0, True), ("write", 0, False)])
+		self.assertEqual(m.totals()["render"]["count"], 2)
+		self.assertEqual(m.run_summary()["queries"], 2)
+
+		json_log = os.path.join(self.directory, "sync.json")
+		textfile = os.path.join(self.directory, "sync.prom")
+		m.save(json_log, textfile)
+		lines = [json.loads(l) for l in open(json_log)]
+		self.assertEqual([l["stage"] for l in lines], \
+			["render", "render", "write", "run"])
+		self.assertEqual(lines[0]["labels"], {"zone": "example.com"})
+		self.assertEqual(lines[-1]["counters"], {"zones_written": 2})
+
+		text = open(textfile).read()
+		self.assertTrue('mdb_zone_sync_stage_queries{stage="render"} 2.0\n' in text)
+		self.assertTrue('mdb_zone_sync_object_stage_seconds{stage="render",zone="example.org"} ' in text)
+		self.assertTrue("mdb_zone_sync_zones_written 2.0\n" in text)
+		# the temporary file was renamed over the textfile
+		self.assertEqual(sorted(os.listdir(self.directory)), \
+			["sync.json", "sync.prom"])
+
+		# a new run forgets the stages and queries of the last one
+		m.start()
+		with m.stage("render"):
+			pass
+		self.assertEqual(m.run_summary()["queries"], 0)
+		self.assertEqual(len(m.stages), 1)
+
+class BenchmarkTest(TestCase):
+	def tearDown(self):
+		connection.use_debug_cursor = None
+
+	def test_inventory(self):
+		inventory = benchmark.build_inventory(hosts = 10, ip4_subnets = 2, \
+			ip4_prefix = 30, ip6_subnets = 1, domains = 3)
+		self.assertEqual(Host.objects.count(), 10)
+		self.assertEqual(Ip4Address.objects.count(), 4)
+		# both subnets are used up, the last hosts go without an address
+		self.assertEqual(Interface.objects.filter(ip4address = None).count(), 6)
+		self.assertEqual(Ip6Address.objects.count(), 10)
+		self.assertEqual(Ip4Subnet.objects.get(name = "net1").domain_name, \
+			"0.0.10.in-addr.arpa")
+		self.assertTrue(re.search(r"^host00003 +\tIN\tA\t10\.0\.0\.6$", \
+			Domain.objects.get(domain_name = "d0.example.com").zone_file_contents(), \
+			re.M))
+
+		results = benchmark.run_benchmarks(inventory, repeat = 2, \
+			create_prefix = 28, host_saves = 2)
+		self.assertEqual([r["name"] for r in results], \
+			[name for name, function in benchmark.BENCHMARKS])
+		for result in results:
+			self.assertEqual(len(result["runs"]), 2)
+			self.assertTrue(result["queries"] > 0, result["name"])
+		self.assertFalse(Ip4Subnet.objects.filter(name = "benchmark").exists())
+		json.dumps(results)
+
+PROFILED_MIDDLEWARE = ('mdb.profiling.ProfileMiddleware',) + \
+	settings.MIDDLEWARE_CLASSES
+
+class ProfileTest(TestCase):
+	def setUp(self):
+		cache.clear()
+		User.objects.create_superuser("admin", "admin@example.com", "admin")
+
+	def test_fingerprint(self):
+		self.assertEqual(profiling.fingerprint( \
+			"SELECT 1 FROM mdb_ip4address WHERE id = 12 AND address = 'a''b' " \
+			"AND subnet_id IN (1, 2, 3)"), \
+			"SELECT ? FROM mdb_ip4address WHERE id = ? AND address = ? " \
+			"AND subnet_id IN (...)")
+
+	def test_off(self):
+		with override_settings(MIDDLEWARE_CLASSES = PROFILED_MIDDLEWARE):
+			response = self.client.get("/info/host/")
+			self.assertFalse(response.has_header("X-Mdb-Queries"))
+			self.client.login(username = "admin", password = "admin")
+			self.assertEqual(self.client.get("/info/profile/").status_code, 404)
+
+	def test_changelist(self):
+		create_inventory()
+		with override_settings(MDB_PROFILE = True, \
+				MIDDLEWARE_CLASSES = PROFILED_MIDDLEWARE):
+			self.client.login(username = "admin", password = "admin")
+			response = self.client.get("/admin/mdb/host/")
+			self.assertEqual(response.status_code, 200)
+			# the list_display methods query the interfaces of every host
+			self.assertTrue(int(response["X-Mdb-Duplicate-Queries"]) >= 4)
+			self.assertTrue(int(response["X-Mdb-Queries"]) > \
+				int(response["X-Mdb-Duplicate-Queries"]))
+			for header in ("X-Mdb-Query-Time", "X-Mdb-View-Time", "X-Mdb-Total-Time"):
+				float(response[header])
+			self.client.get("/admin/mdb/host/")
+			self.client.get("/info/host/")
+
+			response = self.client.get("/info/profile/?order=queries")
+			endpoints = response.context["endpoints"]
+			self.assertEqual([(e["endpoint"], e["requests"]) for e in endpoints], \
+				[("mdb_host_changelist", 2), ("mdb.views.host", 1)])
+			# the profile page itself is not recorded
+			self.assertTrue("mdb_interface" in response.content)
+		self.assertFalse(connection.use_debug_cursor)
+
+class InetTest(TestCase):
+	def setUp(self):
+		create_inventory()
+		Ip6Subnet.objects.create(name = "v6", network = "2001:db8:0:1", \
+			domain_soa = "ns.example.com", domain_admin = "admin@example.com", \
+			domain_filename = "/tmp/v6")
+
+	def lookups(self):
+		return (
+			[s.name for s in Ip4Subnet.objects.containing("10.0.1.3")],
+			[s.name for s in Ip4Subnet.objects.overlapping("10.0.0.0/23") \
+				.order_by("name")],
+			[s.name for s in Ip4Subnet.objects.overlapping("10.0.0.4/30")],
+			Ip4Subnet.objects.overlapping("10.0.2.0/24").count(),
+			[a.address for a in Ip4Address.objects.contained_by("10.0.0.0/30") \
+				.order_by("id")],
+			[s.name for s in Ip6Subnet.objects.containing("2001:db8:0:1::7")],
+			Ip6Subnet.objects.containing("2001:db8:0:2::7").count(),
+			# an IPv4 address is in no IPv6 subnet
+			Ip6Subnet.objects.containing("10.0.0.1").count(),
+		)
+
+	def test_lookups(self):
+		expected = (["clients"], ["clients", "servers"], ["servers"], 0, \
+			["10.0.0.1", "10.0.0.2", "10.0.0.3"], ["v6"], 0, 0)
+		self.assertEqual(self.lookups(), expected)
+
+		# other databases filter in Python
+		vendor = connection.vendor
+		connection.vendor = "other"
+		try:
+			self.assertEqual(self.lookups(), expected)
+		finally:
+			connection.vendor = vendor
+
+	@unittest.skipUnless(connection.vendor == "postgresql", "needs PostgreSQL")
+	def test_postgresql_indexes(self):
+		cursor = connection.cursor()
+		# small tables are scanned anyway, unless that is ruled out
+		cursor.execute("SET LOCAL enable_seqscan = off")
+		for index, query in ( \
+				("mdb_ip4subnet_cidr_gist", Ip4Subnet.objects.containing("10.0.1.3")), \
+				("mdb_ip4subnet_cidr_gist", Ip4Subnet.objects.overlapping("10.0.0.0/23")), \
+				("mdb_ip6subnet_cidr_gist", Ip6Subnet.objects.containing("2001:db8:0:1::7")), \
+				("mdb_ip4address_address_gist", Ip4Address.objects.contained_by("10.0.0.0/30"))):
+			cursor.execute("SELECT count(*) FROM pg_indexes WHERE indexname = %s", [index])
+			self.assertEqual(cursor.fetchone()[0], 1)
+			sql, params = query.query.get_compiler(connection = connection).as_sql()
+			cursor.execute("EXPLAIN " + sql, params)
+			plan = "\n".join([row[0] for row in cursor.fetchall()])
+			self.assertTrue(index in plan, plan)
+
+	def test_overlapping_subnets_are_rejected(self):
+		config = DhcpConfig.objects.get()
+		subnet = Ip4Subnet(name = "wide", network = "10.0.0.0", \
+			netmask = "255.255.254.0", dhcp_config = config)
+		self.assertRaises(ValidationError, subnet.clean)
+		subnet.network = "10.0.2.0"
+		subnet.clean()
+		# a subnet does not overlap itself
+		Ip4Subnet.objects.get(name = "servers").clean()
+
+		subnet = Ip6Subnet(name = "v6 wide", network = "2001:db8:0:0", \
+			netmask = 48)
+		self.assertRaises(ValidationError, subnet.clean)
+		subnet.netmask = 64
+		subnet.clean()
+
+	def test_invalid_admin_input(self):
+		Form = modelform_factory(Ip4Subnet)
+		config = DhcpConfig.objects.get()
+		for network, netmask in (("", "255.255.255.0"), \
+				("10.0.0.300", "255.255.255.0"), ("10.0.5.0", "")):
+			form = Form({"name": "bad", "network": network, "netmask": netmask, \
+				"domain_soa": "ns.example.com", "domain_admin": "admin@example.com", \
+				"domain_filename": "/tmp/bad", "dhcp_config": config.id, \
+				"domain_ttl": 60, "domain_serial": 1, "domain_refresh": 1, \
+				"domain_retry": 1, "domain_expire": 1, "domain_minimum_ttl": 1})
+			self.assertFalse(form.is_valid())
+			self.assertTrue(form.errors)
+
+		Form = modelform_factory(Ip6Subnet)
+		form = Form({"name": "bad", "network": "", "netmask": ""})
+		self.assertFalse(form.is_valid())
+
+class RrdCachedStandInHandler(SocketServer.StreamRequestHandler):
+	""" Understands just enough of the rrdcached protocol: CREATE,
+	UPDATE, FLUSH, BATCH and QUIT. Files are kept in a dict. """
+	def execute(self, line):
+		command, rest = line.split(" ", 1)
+		args = rest.split(" ")
+		files = self.server.files
+		if command == "CREATE":
+			if args[0] in files:
+				return "RRD Error: file exists"
+			files[args[0]] = []
+		elif command == "UPDATE":
+			if args[0] not in files:
+				return "No such file: %s" % args[0]
+			files[args[0]].extend(args[1:])
+		elif command == "FLUSH":
+			if args[0] not in files:
+				return "No such file or directory"
+		else:
+			return "Unknown command"
+		return None
+
+	def handle(self):
+		while True:
+			line = self.rfile.readline().rstrip("\n")
+			self.server.lines.append(line)
+			if not line or line == "QUIT":
+				return
+			if line == "BATCH":
+				self.wfile.write("0 Go ahead.  End with dot '.' on its own line.\n")
+				errors = []
+				number = 0
+				while True:
+					line = self.rfile.readline().rstrip("\n")
+					self.server.lines.append(line)
+					if line == ".":
+						break
+					number += 1
+					error = self.execute(line)
+					if error:
+						errors.append("%d %s" % (number, error))
+				self.wfile.write("%d errors\n" % len(errors))
+				for error in errors:
+					self.wfile.write(error + "\n")
+				continue
+			error = self.execute(line)
+			if error:
+				self.wfile.write("-1 %s\n" % error)
+			else:
+				self.wfile.write("0 ok\n")
+
+class RrdCachedStandIn(SocketServer.UnixStreamServer):
+	def __init__(self):
+		self.directory = tempfile.mkdtemp()
+		SocketServer.UnixStreamServer.__init__(self, \
+			os.path.join(self.directory, "rrdcached.sock"), \
+			RrdCachedStandInHandler)
+		self.files = {}
+		self.lines = []
+		thread = threading.Thread(target = self.serve_forever)
+		thread.setDaemon(True)
+		thread.start()
+
+	def server_close(self):
+		SocketServer.UnixStreamServer.server_close(self)
+		shutil.rmtree(self.directory)
+
+class RrdCachedTest(TestCase):
+	def setUp(self):
+		self.server = RrdCachedStandIn()
+		self.rrd_dir = tempfile.mkdtemp()
+		open(os.path.join(self.rrd_dir, "1_1.rrd"), "w").close()
+		self.server.files[os.path.join(self.rrd_dir, "1_1.rrd")] = []
+
+	def tearDown(self):
+		self.server.shutdown()
+		self.server.server_close()
+		shutil.rmtree(self.rrd_dir)
+
+	def target(self, host_id, interface_id):
+		return targets_module.ProbeTarget(host_id, "alpha", interface_id, \
+			"eth0", 1, "10.0.0.1")
+
+	def test_batched_updates(self):
+		writer = rrd.RrdCachedWriter("unix:" + self.server.server_address, \
+			self.rrd_dir, batch_size = 3)
+		writer.log(self.target(1, 1), 1.5, 1000)
+		writer.log(self.target(1, 1), 2.5, 1300)
+		writer.log(self.target(2, 2), 0.5, 1000)
+		writer.log(self.target(2, 2), 0.7, 1300)
+		writer.close()
+
+		existing = os.path.join(self.rrd_dir, "1_1.rrd")
+		created = os.path.join(self.rrd_dir, "2_2.rrd")
+		self.assertEqual(self.server.files, {existing: ["1000:1.5", "1300:2.5"], \
+			created: ["1000:0.5", "1300:0.7"]})
+		self.assertEqual(writer.errors, 0)
+		# one batch per three values, and the new file is only created once
+		self.assertEqual(self.server.lines.count("BATCH"), 2)
+		self.assertEqual(len([l for l in self.server.lines \
+			if l.startswith("CREATE")]), 1)
+		self.assertTrue(" DS:rtt:GAUGE:" in [l for l in self.server.lines \
+			if l.startswith("CREATE")][0])
+
+	def test_reconnect(self):
+		existing = os.path.join(self.rrd_dir, "1_1.rrd")
+		writer = rrd.RrdCachedWriter("unix:" + self.server.server_address, \
+			self.rrd_dir, batch_size = 1)
+		# rrdcached was restarted, the batch goes over a new connection
+		writer.client.sock.shutdown(socket.SHUT_RDWR)
+		writer.log(self.target(1, 1), 1.5, 1000)
+		self.assertEqual(self.server.files[existing], ["1000:1.5"])
+		self.assertEqual(writer.errors, 0)
+
+		# rrdcached is gone, the batch is dropped
+		writer.client.sock.shutdown(socket.SHUT_RDWR)
+		writer.address = "unix:" + os.path.join(self.rrd_dir, "nothing.sock")
+		stderr = sys.stderr
+		sys.stderr = StringIO.StringIO()
+		try:
+			writer.log(self.target(1, 1), 2.5, 1300)
+			self.assertTrue("dropped 1 commands" in sys.stderr.getvalue())
+		finally:
+			sys.stderr = stderr
+		self.assertEqual(writer.errors, 1)
+		self.assertEqual(writer.client, None)
+
+		writer.address = "unix:" + self.server.server_address
+		writer.log(self.target(1, 1), 3.5, 1600)
+		writer.close()
+		self.assertEqual(self.server.files[existing], ["1000:1.5", "1600:3.5"])
+
+	def test_flush_interval(self):
+		sink = sinks.RrdSink(self.rrd_dir, rrdcached = "unix:" + \
+			self.server.server_address, batch_size = 100, flush_interval = 3600)
+		result = probe.ProbeResult("10.0.0.1")
+		result.sent = 1
+		result.rtts = [1.5]
+		sink.put(self.target(1, 1), result, datetime.datetime(2012, 10, 18, 12, 0))
+		sink.flush_if_due()
+		self.assertEqual(self.server.lines.count("BATCH"), 0)
+		sink.writer.flush_interval = 0
+		sink.flush_if_due()
+		self.assertEqual(self.server.lines.count("BATCH"), 1)
+		sink.close()
+		self.assertEqual(self.server.lines.count("BATCH"), 1)
+
+	def test_flush(self):
+		existing = os.path.join(self.rrd_dir, "1_1.rrd")
+		missing = os.path.join(self.rrd_dir, "2_2.rrd")
+		self.assertEqual(rrd.flush_rrds("unix:" + self.server.server_address, \
+			[existing, missing]), set([existing, missing]))
+		self.assertTrue("FLUSH %s" % existing in self.server.lines)
+		self.assertEqual(rrd.flush_rrds("unix:" + os.path.join(self.rrd_dir, \
+			"nothing.sock"), [existing]), set())
+
+		# an old graph of a file rrdcached could not flush is rendered again
+		png = os.path.join(self.rrd_dir, "1_1.png")
+		open(png, "w").close()
+		os.utime(existing, (1000, 1000))
+		self.assertTrue(rrd.graph_is_current(existing, png, \
+			"unix:" + self.server.server_address))
+		self.assertFalse(rrd.graph_is_current(existing, png, \
+			"unix:" + os.path.join(self.rrd_dir, "nothing.sock")))
+
+class RrdGraphTest(TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.rrdtool = rrd.RRDTOOL
+		# stands in for rrdtool graph: writes its output file, or fails
+		# if the rrd file is called bad.rrd
+		rrd.RRDTOOL = os.path.join(self.directory, "rrdtool")
+		script = open(rrd.RRDTOOL, "w")
+		script.write("#!/bin/sh\necho \"$*\" > \"$0.args\"\n" \
+			"case \"$*\" in *bad.rrd*) exit 1;; esac\necho png > \"$2\"\n")
+		script.close()
+		os.chmod(rrd.RRDTOOL, 0755)
+
+	def tearDown(self):
+		rrd.RRDTOOL = self.rrdtool
+		shutil.rmtree(self.directory)
+
+	def test_render_graph(self):
+		png = os.path.join(self.directory, "1_1.png")
+		self.assertEqual(rrd.render_graph(("good.rrd", png, "alpha", None)), \
+			(png, True))
+		self.assertEqual(open(png).read(), "png\n")
+		self.assertFalse("--daemon" in open(rrd.RRDTOOL + ".args").read())
+		rrd.render_graph(("good.rrd", png, "alpha", "unix:/run/rrdcached.sock"))
+		self.assertTrue("--daemon unix:/run/rrdcached.sock" in \
+			open(rrd.RRDTOOL + ".args").read())
+		# a failed render leaves the old graph and no temporary file
+		self.assertEqual(rrd.render_graph(("bad.rrd", png, "alpha", None)), \
+			(png, False))
+		self.assertEqual(open(png).read(), "png\n")
+		self.assertEqual(sorted(os.listdir(self.directory)), \
+			["1_1.png", "rrdtool", "rrdtool.args"])
+
+	def test_graph_is_current(self):
+		rrd_file = os.path.join(self.directory, "1_1.rrd")
+		png = os.path.join(self.directory, "1_1.png")
+		open(rrd_file, "w").close()
+		self.assertFalse(rrd.graph_is_current(rrd_file, png))
+		open(png, "w").close()
+		os.utime(rrd_file, (1000, 1000))
+		os.utime(png, (2000, 2000))
+		self.assertTrue(rrd.graph_is_current(rrd_file, png))
+		os.utime(rrd_file, (3000, 3000))
+		self.assertFalse(rrd.graph_is_current(rrd_file, png))
+
+	def test_cache_eviction(self):
+		cache = graphs.GraphCache(self.directory, \
+			os.path.join(self.directory, "cache"), max_files = 2)
+		for interface_id in (1, 2, 3):
+			target = targets_module.ProbeTarget(1, "alpha", interface_id, \
+				"eth0", 1, "10.0.0.1")
+			open(cache.source(target), "w").close()
+			self.assertTrue(cache.get(target) is not None)
+			os.utime(cache.get(target), (interface_id * 1000, time.time()))
+		self.assertEqual(sorted(os.listdir(cache.cache_dir)), \
+			["1_2.png", "1_3.png"])
+
+	def test_graph_view(self):
+		create_inventory()
+		interface = Interface.objects.get(host__hostname = "alpha")
+		cache_dir = os.path.join(self.directory, "cache")
+		url = "/info/graph/%d.png" % interface.id
+		with override_settings(MDB_RRD_PATH = self.directory, \
+				MDB_GRAPH_CACHE_DIR = cache_dir):
+			self.assertEqual(self.client.get(url).status_code, 404)
+
+			open(os.path.join(self.directory, "%d_%d.rrd" % \
+				(interface.host_id, interface.id)), "w").close()
+			response = self.client.get(url)
+			self.assertEqual(response.status_code, 200)
+			self.assertEqual(response["Content-Type"], "image/png")
+			self.assertEqual(response.content, "png\n")
+
+			response = self.client.get(url, \
+				HTTP_IF_NONE_MATCH = response["ETag"])
+			self.assertEqual(response.status_code, 304)
+			response = self.client.get(url, \
+				HTTP_IF_MODIFIED_SINCE = response["Last-Modified"])
+			self.assertEqual(response.status_code, 304)
@@ -4,5 +4,7 @@ from django.conf.urls.defaults import *
 urlpatterns = patterns('mdb.views',
 	url(r'^$', 'index'),
 	url(r'^host/$', 'host'),
-	url(r'^host/(<?P<host_id>\d+)/$', 'host_detail'),
+	url(r'^host/(?P<host_id>\d+)/$', 'host_detail'),
+	url(r'^graph/(?P<interface_id>\d+)\.png$', 'graph'),
+	url(r'^profile/$', 'profile'),
 )
@@ -1,14 +1,121 @@
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.cache import cache
+from django.http import Http404, HttpResponse, HttpResponseNotFound, \
+	HttpResponseServerError
 from django.shortcuts import render_to_response
 from django.template import RequestContext
+from django.template.loader import render_to_string
+from django.views.decorators.http import condition
+
+from mdb.graphs import GraphCache
+from mdb.models import Host, host_detail_cache_key, load_reachability
+from mdb.profiling import endpoint_summary, profile_exempt
+from mdb.summary import fleet_summary
+from mdb.targets import probe_target
+
+import datetime
+import os
 
 def home(request):
     return render_to_response('index.django.html', context_instance=RequestContext(request))
 
 def index(request):
-	return render_to_response('info.django.html', context_instance=RequestContext(request))
+	try:
+		summary = fleet_summary()
+	except ImportError:
+		# the summary needs numpy
+		summary = None
+	return render_to_response('info.django.html', {'summary': summary}, \
+		context_instance=RequestContext(request))
 
 def host(request):
 	return render_to_response('host.django.html', context_instance=RequestContext(request))
 
 def host_detail(request, host_id):
-	return render_to_response('host.django.html', context_instance=RequestContext(request))
+	""" The interfaces, addresses and zones of a host. The rendered
+	details are cached until the host, one of its interfaces, addresses
+	or their reachability is changed, or for MDB_HOST_CACHE_TIMEOUT
+	seconds. """
+	# "007" and "7" are the same host, invalidation uses the id
+	host_id = int(host_id)
+	key = host_detail_cache_key(host_id)
+	cached = cache.get(key)
+	if cached is None:
+		try:
+			host = Host.objects.select_related("host_type", \
+				"operating_system__architecture").prefetch_related( \
+				"interface_set__ip4address__subnet", "interface_set__domain", \
+				"interface_set__ip6address_set__subnet").get(id = host_id)
+		except Host.DoesNotExist:
+			raise Http404
+		load_reachability([i.ip4address for i in host.interface_set.all()])
+		cached = (host.hostname, \
+			render_to_string('host-detail.django.html', {'host': host}))
+		cache.set(key, cached, getattr(settings, "MDB_HOST_CACHE_TIMEOUT", 300))
+	hostname, details = cached
+	return render_to_response('host.django.html', \
+		{'hostname': hostname, 'details': details}, \
+		context_instance=RequestContext(request))
+
+def graph_cache():
+	return GraphCache(getattr(settings, "MDB_RRD_PATH", ""), \
+		getattr(settings, "MDB_GRAPH_CACHE_DIR", "/var/cache/mdb/graphs"), \
+		getattr(settings, "MDB_GRAPH_CACHE_SIZE", 1000), \
+		getattr(settings, "MDB_RRDCACHED", None))
+
+def graph_source_stat(request, interface_id):
+	""" stat of the RRD file behind a graph, or None. Looked up once per
+	request, the conditional checks and the view all need it. """
+	if not hasattr(request, "graph_source"):
+		request.graph_target = probe_target(interface_id)
+		request.graph_source = None
+		if request.graph_target is not None:
+			try:
+				request.graph_source = graph_cache().source_stat( \
+					request.graph_target)
+			except OSError:
+				pass
+	return request.graph_source
+
+def graph_etag(request, interface_id):
+	source = graph_source_stat(request, interface_id)
+	if source is None:
+		return None
+	return "%x-%x" % (int(source.st_mtime), source.st_size)
+
+def graph_last_modified(request, interface_id):
+	source = graph_source_stat(request, interface_id)
+	if source is None:
+		return None
+	return datetime.datetime.utcfromtimestamp(int(source.st_mtime))
+
+@condition(etag_func=graph_etag, last_modified_func=graph_last_modified)
+def graph(request, interface_id):
+	""" The latency graph of an interface, rendered only when the RRD
+	file changed since it was last rendered. """
+	if graph_source_stat(request, interface_id) is None:
+		return HttpResponseNotFound("No latency history for this interface.", \
+			content_type="text/plain")
+	png = graph_cache().get(request.graph_target)
+	if png is None:
+		return HttpResponseServerError("Could not render the graph.", \
+			content_type="text/plain")
+	f = open(png, "rb")
+	try:
+		return HttpResponse(f.read(), content_type="image/png")
+	finally:
+		f.close()
+
+@profile_exempt
+@staff_member_required
+def profile(request):
+	""" The endpoints with the slowest requests, see mdb.profiling. """
+	if not getattr(settings, "MDB_PROFILE", False):
+		raise Http404
+	order = request.GET.get("order", "total")
+	if order not in ("total", "queries", "duplicates"):
+		order = "total"
+	return render_to_response('profile.django.html', \
+		{'endpoints': endpoint_summary(order), 'order': order}, \
+		context_instance=RequestContext(request))
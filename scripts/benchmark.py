@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os,sys,argparse,datetime,json
+from commands import getstatusoutput
+
+parser = argparse.ArgumentParser(description = 'Time zone file and dhcp rendering, subnet and host changes and the admin on a synthetic inventory')
+
+parser.add_argument('--hosts', dest='hosts', type=int, default=10000,\
+	help='Hosts in the inventory, each with one interface')
+parser.add_argument('--ip4-subnets', dest='ip4_subnets', type=int, default=4,\
+	help='IPv4 subnets in the inventory')
+parser.add_argument('--ip4-prefix', dest='ip4_prefix', type=int, default=16,\
+	help='Prefix length of the IPv4 subnets')
+parser.add_argument('--ip6-subnets', dest='ip6_subnets', type=int, default=4,\
+	help='IPv6 subnets in the inventory')
+parser.add_argument('--domains', dest='domains', type=int, default=200,\
+	help='Domains the hosts are spread over')
+parser.add_argument('--repeat', dest='repeat', type=int, default=3,\
+	help='Runs of every benchmark')
+parser.add_argument('--create-prefix', dest='create_prefix', type=int, default=22,\
+	help='Prefix length of the subnet created and deleted by ip4subnet_create and ip4subnet_delete')
+parser.add_argument('--host-saves', dest='host_saves', type=int, default=100,\
+	help='Hosts saved by host_save')
+parser.add_argument('--benchmark', dest='benchmarks', action='append',\
+	help='Only run this benchmark, can be given more than once')
+parser.add_argument('--output', dest='output',\
+	help='Write the results to this file instead of printing them')
+
+args = parser.parse_args()
+
+if args.domains < 1:
+	parser.error("--domains must be at least 1")
+
+from django.core.management import setup_environ
+from dns_mdb import settings
+setup_environ(settings)
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from mdb import benchmark
+
+def revision():
+	status, output = getstatusoutput("git -C %s rev-parse HEAD" % \
+		os.path.dirname(os.path.abspath(__file__)))
+	if status != 0:
+		return None
+	return output
+
+if args.benchmarks:
+	unknown = set(args.benchmarks) - set([name for name, f in benchmark.BENCHMARKS])
+	if unknown:
+		parser.error("unknown benchmarks: %s" % ", ".join(sorted(unknown)))
+
+# never touch the real inventory, build it in a test database
+started = datetime.datetime.now()
+setup_test_environment()
+database = connection.settings_dict["NAME"]
+connection.creation.create_test_db(verbosity = 0)
+try:
+	inventory = benchmark.build_inventory(hosts = args.hosts, \
+		ip4_subnets = args.ip4_subnets, ip4_prefix = args.ip4_prefix, \
+		ip6_subnets = args.ip6_subnets, domains = args.domains)
+	results = benchmark.run_benchmarks(inventory, repeat = args.repeat, \
+		names = args.benchmarks, create_prefix = args.create_prefix, \
+		host_saves = args.host_saves)
+finally:
+	connection.creation.destroy_test_db(database, verbosity = 0)
+	teardown_test_environment()
+
+report = {
+	"started": started.isoformat(),
+	"revision": revision(),
+	"engine": connection.settings_dict["ENGINE"],
+	"scale": inventory.scale,
+	"build_seconds": inventory.seconds,
+	"repeat": args.repeat,
+	"benchmarks": results,
+}
+
+if args.output:
+	output = open(args.output, "w")
+	output.write(json.dumps(report, indent = 1, sort_keys = True) + "\n")
+	output.close()
+else:
+	print json.dumps(report, indent = 1, sort_keys = True)
@@ -2,45 +2,85 @@
 # coding: utf-8
 
 import os,sys
-from commands import getstatusoutput
 
 from django.core.management import setup_environ
-from django.core.mail import mail_admins
 from dns_mdb import settings
 
 setup_environ(settings)
 
 from mdb.models import *
+from mdb.metrics import Metrics
+from mdb.publish import Publisher, DirectoryTarget, CommandTarget
+from mdb.sync import DhcpSync, last_journal_id, forget_journal
 
 debugging = False
 
+# timings of every run, appended as JSON lines to metrics_json_log and
+# written to metrics_textfile for the Prometheus node exporter.
+metrics_json_log = None
+metrics_textfile = None
+#metrics_textfile = "/var/lib/prometheus/node-exporter/mdb_dhcp_sync.prom"
+
 dhcpd_init = "/etc/init.d/dhcp3-server %s"
 
 dhcpd_config = "/etc/dhcp3/dhcpd.conf"
 #dhcpd_config = "dhcpd.conf"
 
+# write one include file per subnet to this directory instead of a
+# single configuration file. Only subnets whose serial moved since the
+# last run are regenerated.
+dhcpd_include_dir = None
+#dhcpd_include_dir = "/etc/dhcp3/mdb.d"
 
-config = DhcpConfig.objects.filter(name = "default").get()
+# set to "kea" to generate a configuration for the ISC Kea server
+# instead. It is written to kea_config and loaded through kea's
+# control socket, no restart needed. Settings from the existing
+# kea_config (interfaces, lease database, control socket) are kept.
+# kea_config is rewritten as plain JSON, so comments in it are lost.
+# Set kea_config to None to push the configuration to the running
+# server with config-set only.
+dhcp_server = "dhcpd"
+kea_config = "/etc/kea/kea-dhcp4.conf"
+kea_control_socket = "/tmp/kea4-ctrl-socket"
 
+# host changes are pushed to the running dhcpd through omapi,
+# set omapi_port to None to always restart dhcpd instead.
+omapi_host = "127.0.0.1"
+omapi_port = 7911
+omapi_key_name = None
+omapi_key = None
 
-if config.serial == config.active_serial and not debugging:
-	sys.exit(0)
+# publish the complete dhcpd configuration to these servers instead,
+# named like dhcpd_config. Each target restarts its own dhcpd. The
+# configuration is checked with dhcpd_check_command first, and not
+# published if the check fails.
+dhcp_targets = []
+#dhcp_targets = [
+#	CommandTarget("rsync %(source)s dhcp2:/etc/dhcp3/%(name)s", \
+#		"ssh dhcp2 /etc/init.d/dhcp3-server restart"),
+#]
+dhcpd_check_command = "/usr/sbin/dhcpd -t -cf %s"
+dhcpd_check_temp_file = "/tmp/dhcpd-check.conf"
 
-dhcpd_file = open(dhcpd_config , "w")
-dhcpd_file.write(config.dhcpd_configuration())
-dhcpd_file.close()
+publisher = None
+if dhcp_targets:
+	publisher = Publisher(dhcp_targets)
 
-config.active_serial = config.serial
-config.save()
+metrics = Metrics("dhcp_sync", \
+	track_queries = bool(metrics_json_log or metrics_textfile))
+dhcp_sync = DhcpSync(dhcpd_init, dhcpd_config, dhcpd_include_dir, \
+	dhcp_server, kea_config, kea_control_socket, omapi_host, omapi_port, \
+	omapi_key_name, omapi_key, debugging, publisher, metrics, \
+	dhcpd_check_command, dhcpd_check_temp_file)
 
-status, output = getstatusoutput(dhcpd_init % "restart")
-if status != 0:
-	mail_admins("Failed to restart dhcp3-server", \
-		"Failed to restart dhcp3-server, plase inspect...\n\n" + output)
-	sys.exit(1)
-else:
-	mail_admins("Update dhcpd configuration success!", \
-		"Updated dhcpd configuration to serial %d." % \
-		config.active_serial)
-	sys.exit(0)
+with metrics.stage("query"):
+	# the journal is only for sync_daemon.py, see zone_synchronizer.py
+	last_id = last_journal_id()
+	config = DhcpConfig.objects.filter(name = "default").get()
 
+success = dhcp_sync.sync(config)
+if success:
+	forget_journal(last_id)
+metrics.save(metrics_json_log, metrics_textfile)
+if not success:
+	sys.exit(1)
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os,sys,argparse,json
+
+parser = argparse.ArgumentParser(description = 'Summarize latency and reachability per host type and subnet')
+
+parser.add_argument('--down-after', dest='down_after', type=int, default=900,\
+	help='Seconds without an answer before an address counts as down')
+parser.add_argument('--json', action='store_true',\
+	help='Print the summary as JSON')
+
+args = parser.parse_args()
+
+from django.core.management import setup_environ
+from dns_mdb import settings
+setup_environ(settings)
+from mdb.summary import fleet_summary
+
+
+def format_rtt(rtt):
+	if rtt is None:
+		return "-"
+	return "%.2f" % rtt
+
+def print_table(title, rows):
+	print title
+	print "%-24s %9s %7s %6s %s %s %7s" % ("name", "addresses", "up", "loss", \
+		" ".join(["%8s" % ("p%d" % p) for p, rtt in rows[0]["rtt"]]), \
+		" ".join(["%8s" % (">" + label.replace(" ", "")) \
+			for label, count in rows[0]["not_seen"]]), "never")
+	for row in rows:
+		print "%-24s %9d %7d %5.1f%% %s %s %7d" % (row["name"], \
+			row["addresses"], row["up"], row["loss"] * 100, \
+			" ".join(["%8s" % format_rtt(rtt) for p, rtt in row["rtt"]]), \
+			" ".join(["%8d" % count for label, count in row["not_seen"]]), \
+			row["never_seen"])
+	print
+
+summary = fleet_summary(down_after = args.down_after)
+
+if args.json:
+	print json.dumps(summary, indent = 1, sort_keys = True)
+	sys.exit(0)
+
+print_table("Host types", [summary["total"]] + summary["host_type"])
+print_table("Subnets", [summary["total"]] + summary["subnet"])
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os,sys,argparse
+
+parser = argparse.ArgumentParser(description = 'Update last contact of ' \
+	'addresses from the dhcpd leases file')
+
+parser.add_argument('-d', '--debug', action='store_true',\
+	help="Turn on debugging")
+parser.add_argument('--leases', default='/var/lib/dhcp3/dhcpd.leases',\
+	help='Path to the dhcpd leases file')
+parser.add_argument('--state-file', dest='state_file',\
+	default='/var/tmp/mdb_lease_service.state',\
+	help='Where to remember how far the leases file has been read')
+
+args = parser.parse_args()
+
+from django.core.management import setup_environ
+from dns_mdb import settings
+setup_environ(settings)
+from mdb.leases import LeaseFile, update_last_contact
+
+lease_file = LeaseFile(args.leases, args.state_file)
+
+latest = lease_file.read()
+update_last_contact(latest)
+
+# only remember the new offset once the database has been updated
+lease_file.save_state()
+
+if args.debug:
+	print "Updated %d addresses, read leases up to byte %d." % \
+		(len(latest), lease_file.offset)
+
+sys.exit(0)
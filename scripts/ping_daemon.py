@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os,sys,datetime,argparse,signal,time
+
+from mdb.shard import parse_shard
+
+parser = argparse.ArgumentParser(description = 'Continuously ping hosts from mdb')
+
+parser.add_argument('-t', '--type', default='all',\
+	help="Which type of host to operate on")
+parser.add_argument('-d', '--debug', action='store_true',\
+	help="Turn on debugging")
+parser.add_argument('--num-pings', dest='num_pings', type=int, default=5,\
+	help='Number of ping requests to each host. More requests gives a more accurate average calculation.')
+parser.add_argument('--timeout', type=float, default=1.0,\
+	help='Seconds to wait for each ping reply')
+parser.add_argument('--max-in-flight', dest='max_in_flight', type=int, default=1000,\
+	help='Maximum number of unanswered ping requests at any time')
+parser.add_argument('--interval', type=float, default=300,\
+	help='Seconds between probes of a reachable host')
+parser.add_argument('--recheck-interval', dest='recheck_interval', type=float, default=30,\
+	help='Seconds until a host that just went up or down is probed again')
+parser.add_argument('--max-interval', dest='max_interval', type=float, default=3600,\
+	help='Maximum seconds between probes of a host that stays down')
+parser.add_argument('--jitter', type=float, default=0.1,\
+	help='Random variation of the intervals, as a fraction of the interval')
+parser.add_argument('--inventory-interval', dest='inventory_interval', type=float, default=60,\
+	help='Seconds between checks for new, changed or removed interfaces')
+parser.add_argument('--shard', type=parse_shard, default=None,\
+	help='Only ping shard i of N (i/N, 1 <= i <= N), to split the work between several machines')
+parser.add_argument('--sink', dest='sinks', action='append',\
+	choices=['db', 'history', 'rrd', 'json', 'text'],\
+	help='Where to send the results, can be given more than once (default: db)')
+parser.add_argument('--batch-size', dest='batch_size', type=int, default=500,\
+	help='Number of results written to the database or sent to rrdcached at a time')
+parser.add_argument('--flush-interval', dest='flush_interval', type=float, default=5.0,\
+	help='Maximum number of seconds results wait before being written')
+parser.add_argument('--rrd-path', dest='rrd_path',\
+	help='Specify the path to the rrd files, for the rrd sink')
+parser.add_argument('--rrdcached',\
+	help='Send rrd updates to rrdcached at this address (unix:/path or host:port) instead of running rrdtool')
+parser.add_argument('--json-file', dest='json_file',\
+	help='Append the results of the json sink to this file instead of printing them')
+
+parser.add_argument('--metrics-json', dest='metrics_json',\
+	help='Append the timings of every --inventory-interval to this file as JSON lines')
+parser.add_argument('--metrics-textfile', dest='metrics_textfile',\
+	help='Write the timings of the last --inventory-interval to this file for the Prometheus node exporter')
+
+args = parser.parse_args()
+
+if args.sinks and "rrd" in args.sinks and args.rrd_path is None:
+	parser.error("the rrd sink needs --rrd-path")
+
+from django.core.management import setup_environ
+from dns_mdb import settings
+setup_environ(settings)
+from django.db import reset_queries, transaction
+from mdb.metrics import Metrics
+from mdb.models import *
+from mdb.probe import Prober
+from mdb.scheduler import ProbeScheduler
+from mdb.sinks import SinkThread, create_sinks
+from mdb.targets import probe_targets
+
+
+def inventory():
+	host_type = None
+	if args.type != "all":
+		host_type = args.type
+	rows = probe_targets(host_type, args.shard)
+	# don't keep a transaction open between checks
+	transaction.commit_unless_managed()
+	return rows
+
+scheduler = ProbeScheduler(args.interval, args.recheck_interval, \
+	args.max_interval, args.jitter)
+prober = Prober(count = args.num_pings, timeout = args.timeout, \
+	interval = 0.2, max_in_flight = args.max_in_flight)
+sinks = SinkThread(create_sinks(args))
+metrics = Metrics("ping_daemon", \
+	track_queries = bool(args.metrics_json or args.metrics_textfile))
+
+# interface id -> (Target, the ProbeTarget it had when the probe was
+# sent); update_inventory changes Targets while they are probed
+probing = {}
+# Targets that came due while being probed, probed again once done
+requeued = {}
+next_inventory = 0
+
+def start_probe(target):
+	probing[target.interface_id] = (target, target.probe_target)
+	prober.add(target.interface_id, target.address)
+
+# results still waiting in the sinks are written on the way out
+signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+try:
+	while True:
+		# with DEBUG on Django logs every query, and nothing else
+		# clears the log of a process that runs forever
+		reset_queries()
+		now = time.time()
+		if now >= next_inventory:
+			if next_inventory:
+				metrics.save(args.metrics_json, args.metrics_textfile)
+				metrics.start()
+			with metrics.stage("inventory"):
+				rows = inventory()
+			added, changed, removed = scheduler.update_inventory(rows, now)
+			metrics.count("targets", len(scheduler))
+			if args.debug and (added or changed or removed):
+				print "inventory: %d added, %d changed, %d removed, %d targets" % \
+					(added, changed, removed, len(scheduler))
+			next_inventory = now + args.inventory_interval
+
+		for target in scheduler.due(now):
+			if target.interface_id in probing:
+				requeued[target.interface_id] = target
+				continue
+			start_probe(target)
+
+		wait = next_inventory - now
+		next_due = scheduler.next_due()
+		if next_due is not None:
+			wait = min(wait, next_due - now)
+
+		for interface_id, result in prober.poll(max(wait, 0)):
+			target, probed = probing.pop(interface_id)
+			up = result.avg_rtt() != None
+			metrics.count("probes")
+			if up:
+				metrics.count("up")
+			# the result of an old address says nothing about the new one,
+			# which update_inventory scheduled right away
+			if probed.address == target.address and \
+					scheduler.completed(target, up, time.time()) and args.debug:
+				print "%s went %s" % (target.address, up and "up" or "down")
+			sinks.put(probed, result, datetime.datetime.now())
+			if interface_id in requeued:
+				start_probe(requeued.pop(interface_id))
+except KeyboardInterrupt:
+	pass
+finally:
+	sinks.close()
+	prober.close()
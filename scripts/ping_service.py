@@ -1,8 +1,9 @@
 #!/usr/bin/env python
 # coding: utf-8
 
-import os,sys,datetime,argparse,threading,time,Queue
-from commands import getstatusoutput
+import os,sys,datetime,argparse
+
+from mdb.shard import parse_shard
 
 parser = argparse.ArgumentParser(description = 'Ping hosts from mdb')
 
@@ -13,12 +14,41 @@ parser.add_argument('-d', '--debug', action='store_true',\
 parser.add_argument('--show-types', dest='show_types', action='store_true',\
 	help='Show available host types')
 parser.add_argument('--num-threads', dest='num_threads', type=int, default=1,\
-	help='Number of threads used for pinging hosts')
+	help='Ignored, all hosts are pinged concurrently. See --max-in-flight.')
 parser.add_argument('--num-pings', dest='num_pings', type=int, default=5,\
 	help='Number of ping requests to each host. More requests gives a more accurate average calculation.')
+parser.add_argument('--timeout', type=float, default=1.0,\
+	help='Seconds to wait for each ping reply')
+parser.add_argument('--interval', type=float, default=0.2,\
+	help='Seconds between ping requests to the same host')
+parser.add_argument('--max-in-flight', dest='max_in_flight', type=int, default=1000,\
+	help='Maximum number of unanswered ping requests at any time')
+parser.add_argument('--shard', type=parse_shard, default=None,\
+	help='Only ping shard i of N (i/N, 1 <= i <= N), to split the work between several machines')
+parser.add_argument('--sink', dest='sinks', action='append',\
+	choices=['db', 'history', 'rrd', 'json', 'text'],\
+	help='Where to send the results, can be given more than once (default: db)')
+parser.add_argument('--batch-size', dest='batch_size', type=int, default=500,\
+	help='Number of results written to the database or sent to rrdcached at a time')
+parser.add_argument('--flush-interval', dest='flush_interval', type=float, default=5.0,\
+	help='Maximum number of seconds results wait before being written')
+parser.add_argument('--rrd-path', dest='rrd_path',\
+	help='Specify the path to the rrd files, for the rrd sink')
+parser.add_argument('--rrdcached',\
+	help='Send rrd updates to rrdcached at this address (unix:/path or host:port) instead of running rrdtool')
+parser.add_argument('--json-file', dest='json_file',\
+	help='Append the results of the json sink to this file instead of printing them')
+
+parser.add_argument('--metrics-json', dest='metrics_json',\
+	help='Append the timings of every run to this file as JSON lines')
+parser.add_argument('--metrics-textfile', dest='metrics_textfile',\
+	help='Write the timings of the last run to this file for the Prometheus node exporter')
 
 args = parser.parse_args()
 
+if args.sinks and "rrd" in args.sinks and args.rrd_path is None:
+	parser.error("the rrd sink needs --rrd-path")
+
 #project_path = '/opt/django/dns_mdb/'
 #if project_path not in sys.path:
 #    sys.path.append(project_path)
@@ -27,51 +57,12 @@ from django.core.management import setup_environ
 from django.core.mail import mail_admins
 from dns_mdb import settings
 setup_environ(settings)
+from mdb.metrics import Metrics
 from mdb.models import *
+from mdb.probe import Prober
+from mdb.sinks import SinkThread, create_sinks
+from mdb.targets import probe_targets
 
-PING_CMD='ping -W 1 -c %d -n -q %s | grep rtt | cut -d " " -f4'
-
-queue = Queue.Queue()
-
-
-class PingThread(threading.Thread):
-	""" Threaded ping """
-	def __init__(self, host_queue):
-		threading.Thread.__init__(self)
-		self.queue = queue
-
-	def run(self):
-		while True:
-			host = self.queue.get()
-			self.do_ping_host(host)
-			self.queue.task_done()
-
-	def do_ping_host(self, host):
-		interfaces = host.interface_set.all()
-		for interface in interfaces:
-			self.do_ping_interface(interface, host)
-
-	def do_ping_interface(self, interface, host):
-		res = self.do_ping_ipaddr(interface.ip4address.address)
-		if res == None:
-			if args.debug:
-				print "%s (%s/%s) : fail   " % (host, \
-					interface.name, interface.ip4address.address)
-			return
-		interface.ip4address.last_contact = datetime.datetime.now()
-		interface.ip4address.ping_avg_rtt = float(res[1])
-		interface.ip4address.save()
-		if args.debug:
-			print "%s (%s/%s) : %s" % (host, interface.name, \
-				interface.ip4address.address, res)
-
-	def do_ping_ipaddr(self, ipaddr):
-		status, output = getstatusoutput(PING_CMD % (args.num_pings,ipaddr))
-		if status == 0 and len(output) > 0:
-			return output.split("/")
-		else:
-			return None
-	
 
 def show_host_types():
 	types = HostType.objects.all()
@@ -82,24 +73,34 @@ if args.show_types:
 	show_host_types()
 	sys.exit(0)
 
-if args.type == "all":
-	hosts = Host.objects.all()
-else:
-	hosts = Host.objects.filter(host_type__host_type = args.type)
+host_type = None
+if args.type != "all":
+	host_type = args.type
 
-# start num_threads threads for pinging
-for i in xrange(args.num_threads):
-	t = PingThread(queue)
-	t.setDaemon(True)
-	t.start()
+metrics = Metrics("ping", \
+	track_queries = bool(args.metrics_json or args.metrics_textfile))
 
-if args.debug:
-	print "Pinging %d hosts using %d threads." % (len(hosts), args.num_threads)
+with metrics.stage("inventory"):
+	targets = probe_targets(host_type, args.shard)
+metrics.count("targets", len(targets))
 
-# Add all hosts to the queue. Ping threads
-# will pick hosts from this queue.
-for host in hosts:
-	queue.put(host)
+prober = Prober(count = args.num_pings, timeout = args.timeout, \
+	interval = args.interval, max_in_flight = args.max_in_flight)
+sinks = SinkThread(create_sinks(args))
 
-# Wait for all threads to finish, eg. queue is empty.
-queue.join()
+if args.debug:
+	print "Pinging %d interfaces, at most %d requests in flight." % \
+		(len(targets), args.max_in_flight)
+
+# every result goes to all sinks, which write in a thread of their own
+with metrics.stage("probe"):
+	for target, result in prober.run([(t, t.address) for t in targets]):
+		when = datetime.datetime.now()
+		if result.avg_rtt() is not None:
+			metrics.count("up")
+		sinks.put(target, result, when)
+
+with metrics.stage("flush"):
+	sinks.close()
+prober.close()
+metrics.save(args.metrics_json, args.metrics_textfile)
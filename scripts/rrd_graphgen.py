@@ -1,10 +1,9 @@
 #!/usr/bin/env python
 # coding: utf-8
 
-import os,sys,datetime,argparse,threading,time,Queue
-from commands import getstatusoutput
+import os,sys,argparse,multiprocessing
 
-parser = argparse.ArgumentParser(description = 'Ping hosts from mdb')
+parser = argparse.ArgumentParser(description = 'Render latency graphs from the rrd files')
 
 parser.add_argument('-t', '--type', default='all',\
 	help="Which type of host to operate on")
@@ -12,113 +11,30 @@ parser.add_argument('-d', '--debug', action='store_true',\
 	help="Turn on debugging")
 parser.add_argument('--show-types', dest='show_types', action='store_true',\
 	help='Show available host types')
-parser.add_argument('--num-threads', dest='num_threads', type=int, default=1,\
-	help='Number of threads used for pinging hosts')
-parser.add_argument('--num-pings', dest='num_pings', type=int, default=5,\
-	help='Number of ping requests to each host. More requests gives a more accurate average calculation.')
+parser.add_argument('--num-threads', dest='num_threads', type=int, default=None,\
+	help='Ignored, see --processes')
+parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count(),\
+	help='Number of graphs rendered in parallel (default: number of cpus)')
+parser.add_argument('--incremental', action='store_true',\
+	help='Only render graphs whose rrd file changed since the graph was rendered')
 parser.add_argument('--rrd-path', dest='rrd_path', required=True,\
 	help='Specify the path to the rrd files')
 parser.add_argument('--graph-path', dest='graph_path', required=True,\
 	help="Specify the output directory for the graphs")
+parser.add_argument('--rrdcached',\
+	help='Render through rrdcached at this address (unix:/path or host:port), so updates it has not written yet are included')
 
 args = parser.parse_args()
 
 from django.core.management import setup_environ
-from django.core.mail import mail_admins
 from dns_mdb import settings
 setup_environ(settings)
+from django.db import connection
 from mdb.models import *
+from mdb.rrd import rrd_filename, png_filename, graph_title, \
+	flush_rrds, graph_is_current, render_graph
+from mdb.targets import probe_targets
 
-queue = Queue.Queue()
-
-RRD_GRAPH = 	"%s " \
-		"-w 785 -h 120 -a PNG " \
-		"--slope-mode " \
-		"--start -86400 --end now " \
-		"--font DEFAULT:7: "\
-		"--title \"%s\" " \
-		"--watermark \"NEUF.NO\" " \
-		"--vertical-label \"latency(ms)\" " \
-		"--right-axis-label \"latency(ms)\" " \
-		"--lower-limit 0 " \
-		"--right-axis 1:0 " \
-		"--x-grid MINUTE:10:HOUR:1:MINUTE:120:0:%%R " \
-		"--alt-y-grid --rigid " \
-		"DEF:roundtrip=%s:rrd:AVERAGE " \
-		"LINE1:roundtrip#0000FF:\"latency(ms)\" "
-
-# RRD_GRAPH ARGS: <output_filename.png>, <title>, <rrd>
-
-RRD_DIR = args.rrd_path
-RRD_GRAPH_DIR = args.graph_path
-RRDTOOL = "/usr/bin/rrdtool"
-
-class RrdService():
-	def log(self, host, interface, avg_ping):
-		rrd = self.get_rrd(host, interface)
-		self.update_rrd(rrd, avg_ping)
-
-	def get_rrd(self, host, interface):
-		return "%s/%s_%s.rrd" % ( RRD_DIR, host.id,\
-			interface.id)
-
-	def get_png(self, host, interface):
-		return "%s/%s_%s.png" % (RRD_GRAPH_DIR, host.id,\
-			interface.id)
-
-	def update_rrd(self, rrd, avg_ping):
-		self.create_rrd(rrd)
-		
-		self.rrd_exec("update", RRD_UPDATE % (rrd, avg_ping))
-
-	def create_rrd(self, rrd):
-		if os.path.isfile(rrd):
-			return True
-		if args.debug:
-			print "Creating rrd: " + rrd
-		if not self.rrd_exec("create", RRD_CREATE % rrd):
-			if args.debug:
-				print "Could not create RRD database."
-			return False
-		return True
-
-	def create_title(self, host, interface):
-#		return "%s (%s)" % (host.hostname, unicode(interface))
-		return unicode(interface)
-
-	def create_graph(self, host, interface):
-		rrd = self.get_rrd(host, interface)
-		if not os.path.isfile(rrd): return 
-
-		self.rrd_exec("graph", RRD_GRAPH % (self.get_png(host, interface), \
-			self.create_title(host, interface), rrd))
-
-	def rrd_exec(self, function, rrd_cmd):
-		cmd = "%s %s %s" % (RRDTOOL, function, rrd_cmd)
-		if args.debug:
-			print "RRD_EXEC (%s)" % cmd
-		if os.system(cmd) != 0:
-			return False
-		else:
-			return True
-
-class WorkerThread(threading.Thread):
-	""" Threaded ping """
-	def __init__(self, host_queue, rrd_service):
-		threading.Thread.__init__(self)
-		self.queue = queue
-		self.rrd_service = rrd_service
-
-	def run(self):
-		while True:
-			host = self.queue.get()
-			self.do_graph_host(host)
-			self.queue.task_done()
-
-	def do_graph_host(self, host):
-		interfaces = host.interface_set.all()
-		for interface in interfaces:
-			self.rrd_service.create_graph(host, interface)
 
 def show_host_types():
 	types = HostType.objects.all()
@@ -129,28 +45,47 @@ if args.show_types:
 	show_host_types()
 	sys.exit(0)
 
-if args.type == "all":
-	hosts = Host.objects.all()
+host_type = None
+if args.type != "all":
+	host_type = args.type
+
+graphs = []
+for target in probe_targets(host_type):
+	rrd = rrd_filename(args.rrd_path, target)
+	if os.path.isfile(rrd):
+		graphs.append((rrd, png_filename(args.graph_path, target), \
+			graph_title(target)))
+
+# the modification times only tell what changed once rrdcached wrote
+# its pending updates, graphs of files it could not flush are rendered
+if args.incremental and args.rrdcached is not None:
+	flushed = flush_rrds(args.rrdcached, [rrd for rrd, png, title in graphs])
 else:
-	hosts = Host.objects.filter(host_type__host_type = args.type)
+	flushed = None
 
-rrd_service = RrdService()
+jobs = []
+for rrd, png, title in graphs:
+	if args.incremental and (flushed is None or rrd in flushed) and \
+			graph_is_current(rrd, png):
+		continue
+	jobs.append((rrd, png, title, args.rrdcached))
 
-# start num_threads threads for pinging
-for i in xrange(args.num_threads):
-	t = WorkerThread(queue, rrd_service)
-	t.setDaemon(True)
-	t.start()
+# the rendering processes don't use the database
+connection.close()
 
 if args.debug:
-	print "Pinging %d hosts using %d threads." % (len(hosts), args.num_threads)
-
-# Add all hosts to the queue. Ping threads
-# will pick hosts from this queue.
-for host in hosts:
-	queue.put(host)
-
-# Wait for all threads to finish, eg. queue is empty.
-queue.join()
-
+	print "Rendering %d graphs using %d processes." % (len(jobs), args.processes)
+
+failed = 0
+pool = multiprocessing.Pool(args.processes)
+for png, success in pool.imap_unordered(render_graph, jobs):
+	if not success:
+		failed += 1
+	if args.debug:
+		print "%s : %s" % (png, success and "ok" or "fail")
+pool.close()
+pool.join()
+
+if failed:
+	sys.exit(1)
 sys.exit(0)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os,sys,argparse,time
+
+parser = argparse.ArgumentParser(description = 'Publish zone files and the dhcp configuration as soon as they change')
+
+parser.add_argument('-d', '--debug', action='store_true',\
+	help="Turn on debugging")
+parser.add_argument('--poll-interval', dest='poll_interval', type=float, default=1.0,\
+	help='Seconds between checks for new changes')
+parser.add_argument('--quiet-period', dest='quiet_period', type=float, default=3.0,\
+	help='Publish once no changes came in for this many seconds')
+parser.add_argument('--max-delay', dest='max_delay', type=float, default=30.0,\
+	help='Publish at most this many seconds after the first change, even if changes keep coming in')
+parser.add_argument('--resync-interval', dest='resync_interval', type=float, default=3600,\
+	help='Seconds between retries of everything that is not published, such as zones that failed validation')
+
+args = parser.parse_args()
+
+from django.core.management import setup_environ
+from dns_mdb import settings
+
+setup_environ(settings)
+
+from django.db import reset_queries, transaction
+from mdb.metrics import Metrics
+from mdb.models import *
+from mdb.publish import Publisher, DirectoryTarget, CommandTarget
+from mdb.sync import ZoneSync, DhcpSync, dirty_zones, journal_entries, \
+	forget_journal
+
+# see zone_synchronizer.py
+bind_init = "/etc/init.d/bind9 %s"
+error_log_file = "/tmp/zonecheck/zonecheck-fail-%s-%s"
+zone_check_command = "/usr/sbin/named-checkzone %s %s"
+zone_check_temp_dir = "/tmp/zonecheck"
+zone_targets = []
+
+# see dhcp_synchronizer.py
+dhcpd_init = "/etc/init.d/dhcp3-server %s"
+dhcpd_config = "/etc/dhcp3/dhcpd.conf"
+dhcpd_include_dir = None
+dhcp_server = "dhcpd"
+kea_config = "/etc/kea/kea-dhcp4.conf"
+kea_control_socket = "/tmp/kea4-ctrl-socket"
+omapi_host = "127.0.0.1"
+omapi_port = 7911
+omapi_key_name = None
+omapi_key = None
+dhcp_targets = []
+dhcpd_check_command = "/usr/sbin/dhcpd -t -cf %s"
+dhcpd_check_temp_file = "/tmp/dhcpd-check.conf"
+
+# see zone_synchronizer.py, written after every publish
+metrics_json_log = None
+metrics_textfile = None
+
+metrics = Metrics("sync_daemon", \
+	track_queries = bool(metrics_json_log or metrics_textfile))
+zone_sync = ZoneSync(bind_init, zone_check_command, zone_check_temp_dir, \
+	error_log_file, publisher = zone_targets and Publisher(zone_targets) or None, \
+	metrics = metrics)
+dhcp_sync = DhcpSync(dhcpd_init, dhcpd_config, dhcpd_include_dir, \
+	dhcp_server, kea_config, kea_control_socket, omapi_host, omapi_port, \
+	omapi_key_name, omapi_key, \
+	publisher = dhcp_targets and Publisher(dhcp_targets) or None, \
+	metrics = metrics, dhcpd_check_command = dhcpd_check_command, \
+	dhcpd_check_temp_file = dhcpd_check_temp_file)
+
+
+def publish(keys):
+	""" Publishes the dirty zones and dhcp configuration among keys,
+	(kind, id) pairs from the journal, or everything dirty if keys is
+	None. """
+	metrics.start()
+	with metrics.stage("query"):
+		zones = dirty_zones(keys)
+	if zones:
+		zone_sync.sync(zones)
+
+	with metrics.stage("query"):
+		configs = DhcpConfig.objects.filter(name = "default")
+		if keys is not None:
+			configs = configs.filter(id__in = \
+				[id for kind, id in keys if kind == "dhcpconfig"])
+		configs = list(configs)
+	for config in configs:
+		dhcp_sync.sync(config)
+	metrics.save(metrics_json_log, metrics_textfile)
+
+def debug(message):
+	if args.debug:
+		print "%s %s" % (time.strftime("%H:%M:%S"), message)
+
+# the journal only tells what changed from now on
+last_id = 0
+entries = journal_entries()
+if entries:
+	last_id = entries[-1][0]
+publish(None)
+forget_journal(last_id)
+transaction.commit_unless_managed()
+
+pending = set()
+first_change = None
+last_change = None
+next_resync = time.time() + args.resync_interval
+
+while True:
+	# with DEBUG on Django logs every query, and nothing else clears
+	# the log of a process that runs forever
+	reset_queries()
+	entries = journal_entries(last_id)
+	transaction.commit_unless_managed()
+	now = time.time()
+	if entries:
+		debug("%d changes" % len(entries))
+		last_id = entries[-1][0]
+		pending.update([(kind, id) for entry_id, kind, id in entries])
+		if first_change is None:
+			first_change = now
+		last_change = now
+
+	if pending and (now - last_change >= args.quiet_period or \
+			now - first_change >= args.max_delay):
+		debug("publishing %d objects" % len(pending))
+		publish(pending)
+		forget_journal(last_id)
+		transaction.commit_unless_managed()
+		pending = set()
+		first_change = None
+	elif now >= next_resync:
+		debug("publishing everything that is not published")
+		publish(None)
+		transaction.commit_unless_managed()
+		next_resync = now + args.resync_interval
+
+	time.sleep(args.poll_interval)
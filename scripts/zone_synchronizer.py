@@ -2,15 +2,16 @@
 # coding: utf-8
 
 import os,sys
-from commands import getstatusoutput
 
 from django.core.management import setup_environ
-from django.core.mail import mail_admins
 from dns_mdb import settings
 
 setup_environ(settings)
 
 from mdb.models import *
+from mdb.metrics import Metrics
+from mdb.publish import Publisher, DirectoryTarget, CommandTarget
+from mdb.sync import ZoneSync, dirty_zones, last_journal_id, forget_journal
 
 bind_init = "/etc/init.d/bind9 %s"
 
@@ -18,151 +19,55 @@ error_log_file = "/tmp/zonecheck/zonecheck-fail-%s-%s"
 
 zone_check_command = "/usr/sbin/named-checkzone %s %s"
 zone_check_temp_dir = "/tmp/zonecheck"
-zone_check_temp_file = "%s/%s" % ( zone_check_temp_dir, "zone" )
+
+# publish the zone files to these servers instead of writing them to
+# their domain_filename and reloading the local bind. Zone files are
+# named after the last part of their domain_filename.
+zone_targets = []
+#zone_targets = [
+#	DirectoryTarget("/etc/bind/zones", "/etc/init.d/bind9 reload"),
+#	CommandTarget("rsync %(source)s ns2:/etc/bind/zones/%(name)s", \
+#		"ssh ns2 rndc reload"),
+#]
 
 debugging = False
 
+# timings of every run, appended as JSON lines to metrics_json_log and
+# written to metrics_textfile for the Prometheus node exporter.
+metrics_json_log = None
+metrics_textfile = None
+#metrics_textfile = "/var/lib/prometheus/node-exporter/mdb_zone_sync.prom"
+
 if not os.path.isfile( (zone_check_command % ("","")).strip()):
 	print "ERROR: cannot find zone checking tool, exiting..."
 	if not debugging:
 		sys.exit(1)
 
-if not os.path.isfile( (bind_init % ("")).strip()):
+if not zone_targets and not os.path.isfile( (bind_init % ("")).strip()):
 	print "ERROR: cannot find bind init script, exiting..."
 	if not debugging:
 		sys.exit(1)
 
-if not os.path.isdir(zone_check_temp_dir):
-	os.mkdir(zone_check_temp_dir)
-
-def check_zone(zone, filename):
-	retval = {}
-	
-	status, output = getstatusoutput(zone_check_command % (zone, filename))
-	retval['value'] = status
-	retval['output'] = output
-	if debugging and status != 0:
-		print output
-
-	return retval
-
-reload_bind = False
-
-for domain in Domain.objects.all():
-	if domain.domain_serial == domain.domain_active_serial and not debugging:
-		continue
-	
-	print "updating domain %s [%d -> %d]" % \
-		(domain.domain_name, domain.domain_active_serial, \
-		domain.domain_serial)
-
-	sys.stdout.write("\t- validating...")
-	zonecheck = open(zone_check_temp_file, "w")
-	zonecheck.write(domain.zone_file_contents())
-	zonecheck.close()
-
-	result = check_zone(domain.domain_name, zone_check_temp_file)
-	if result['value'] != 0:
-		sys.stdout.write("fail\n")
-		log = open(error_log_file % (domain.domain_name, \
-			domain.domain_serial), "w")
-		log.write(domain.zone_file_contents())
-		log.close()
-		continue
-	
-	sys.stdout.write("ok\n")
-
-	sys.stdout.write("\t- writing zone file...")
-	zonefile = open(domain.domain_filename, "w")
-	zonefile.write(domain.zone_file_contents())
-	zonefile.close()
-	sys.stdout.write("ok\n")
-
-	reload_bind = True
-
-	if not debugging:
-		domain.domain_active_serial = domain.domain_serial
-		domain.save()
-	
-for subnet in Ip4Subnet.objects.all():
-	if subnet.domain_serial == subnet.domain_active_serial and not debugging:
-		continue
-	print "updating subnet %s [%d -> %d]" % \
-		(subnet.domain_name, subnet.domain_active_serial, \
-		subnet.domain_serial)
-	
-	sys.stdout.write("\t- validating...")
-	zonecheck = open(zone_check_temp_file, "w")
-	zonecheck.write(subnet.zone_file_contents())
-	zonecheck.close()
-	sys.stdout.write("ok\n")
-
-	result = check_zone(subnet.domain_name, zone_check_temp_file)
-	if result['value'] != 0:
-		sys.stdout.write("fail\n")
-		log = open(error_log_file % (subnet.domain_name, \
-			subnet.domain_serial), "w")
-		log.write(subnet.zone_file_contents())
-		log.close()		
-		continue
-
-	sys.stdout.write("\t- writing zone file...")
-	zonefile = open(subnet.domain_filename, "w")
-	zonefile.write(subnet.zone_file_contents())
-	zonefile.close()
-	sys.stdout.write("ok\n")
-
-	reload_bind = True
-
-	if not debugging:
-		subnet.domain_active_serial = subnet.domain_serial
-		subnet.save()
-
-for subnet in Ip6Subnet.objects.all():
-	if subnet.domain_serial == subnet.domain_active_serial and not debugging:
-		continue
-	print "updating subnet %s [%d -> %d]" % \
-		(subnet.domain_name, subnet.domain_active_serial, \
-		subnet.domain_serial)
-	
-	sys.stdout.write("\t- validating...")
-	zonecheck = open(zone_check_temp_file, "w")
-	zonecheck.write(subnet.zone_file_contents())
-	zonecheck.close()
-	sys.stdout.write("ok\n")
-
-	print subnet.zone_file_contents()
-
-	result = check_zone(subnet.domain_name, zone_check_temp_file)
-	if result['value'] != 0:
-		sys.stdout.write("fail\n")
-		log = open(error_log_file % (subnet.domain_name, \
-			subnet.domain_serial), "w")
-		log.write(subnet.zone_file_contents())
-		log.close()		
-		continue
-
-	sys.stdout.write("\t- writing zone file...")
-	zonefile = open(subnet.domain_filename, "w")
-	zonefile.write(subnet.zone_file_contents())
-	zonefile.close()
-	sys.stdout.write("ok\n")
-
-	reload_bind = True
-
-	if not debugging:
-		subnet.domain_active_serial = subnet.domain_serial
-		subnet.save()
-
-
-if reload_bind and not debugging:
-	sys.stdout.write("restarting bind...")
-	status, output = getstatusoutput(bind_init % "reload")
-	if status != 0:
-		sys.stdout.write("fail\n")
-		mail_admins("Failed to reload bind", "Failed to reload bind, plase inspect...\n\n" + \
-			output)
+publisher = None
+if zone_targets:
+	publisher = Publisher(zone_targets)
+
+metrics = Metrics("zone_sync", \
+	track_queries = bool(metrics_json_log or metrics_textfile))
+zone_sync = ZoneSync(bind_init, zone_check_command, zone_check_temp_dir, \
+	error_log_file, debugging, publisher = publisher, metrics = metrics)
+
+with metrics.stage("query"):
+	# everything dirty is published, the journal is only for sync_daemon.py
+	last_id = last_journal_id()
+	if debugging:
+		# regenerate every zone
+		zones = [(kind, zone) for kind, model in (("domain", Domain), \
+			("ip4subnet", Ip4Subnet), ("ip6subnet", Ip6Subnet)) \
+			for zone in model.objects.all()]
 	else:
-		sys.stdout.write("ok\n")
-		mail_admins("Successfully updated bind zone files", \
-			"Bind zone files has been updated")
+		zones = dirty_zones()
+
+zone_sync.sync(zones)
+forget_journal(last_id)
+metrics.save(metrics_json_log, metrics_textfile)
@@ -94,6 +94,7 @@ TEMPLATE_LOADERS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'mdb.profiling.ProfileMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -146,3 +147,30 @@ LOGGING = {
 EMAIL_HOST = 'snes.neuf.no'
 EMAIL_PORT = 25
 
+# Latency graphs rendered on request (mdb.views.graph). Rendered graphs
+# are kept in MDB_GRAPH_CACHE_DIR, at most MDB_GRAPH_CACHE_SIZE of them.
+# Set MDB_RRDCACHED to the --rrdcached address of the ping scripts, so
+# graphs include the updates rrdcached has not written yet.
+MDB_RRD_PATH = '/var/lib/mdb/rrd'
+MDB_GRAPH_CACHE_DIR = '/var/cache/mdb/graphs'
+MDB_GRAPH_CACHE_SIZE = 1000
+MDB_RRDCACHED = None
+
+# Seconds the host detail pages are cached. Changes to hosts, interfaces
+# and IPv6 addresses clear the cache at once; the latency shown is only
+# refreshed when the page expires. Use a shared cache backend (CACHES)
+# when running more than one process.
+MDB_HOST_CACHE_TIMEOUT = 300
+
+# Addresses allowed to fetch zone files and dhcp configurations from
+# /export/. None lets everyone in.
+MDB_EXPORT_CLIENTS = ('127.0.0.1',)
+
+# Addresses allowed to use the JSON API at /api/ without logging in.
+MDB_API_CLIENTS = ()
+
+# Query counts and timings of every request in X-Mdb-* response headers
+# and on /info/profile/ (staff only), over the last MDB_PROFILE_WINDOW
+# requests of every page. The middleware does nothing while this is off.
+MDB_PROFILE = False
+MDB_PROFILE_WINDOW = 100
@@ -8,6 +8,8 @@ admin.autodiscover()
 urlpatterns = patterns('',
 	url(r'^$', 'mdb.views.home', name='home'),
 	url(r'^info/', include('mdb.urls')),
+	url(r'^api/', include('mdb.api_urls')),
+	url(r'^export/', include('mdb.export_urls')),
 	url(r'^admin/', include(admin.site.urls)),
 )
 